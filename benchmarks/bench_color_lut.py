@@ -0,0 +1,108 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares color LUT mode (see lib/color_lut.py) with the exact HLS to 8-bit
+RGB conversion of the network output, on random frames, and reports how
+far the LUT colors are from the exact ones:
+
+    python benchmarks/bench_color_lut.py [--bits 7 7 7] [--pixels 1000 10000 100000] [--clients 1] [--frames 200]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from lib.clock import monotonic
+from lib.color_lut import ColorLUT, DEFAULT_BITS, LEVELS
+from lib.colors import hls_to_rgb
+from lib.output_driver import OutputDriver
+
+
+def time_per_frame(function, frames):
+    function()
+    start = monotonic()
+    for i in xrange(frames):
+        function()
+    return (monotonic() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark color LUT mode")
+    parser.add_argument("--bits", type=int, nargs=3, default=list(DEFAULT_BITS), help="Hue, lightness and saturation bits")
+    parser.add_argument("--pixels", type=int, nargs="+", default=[1000, 10000, 100000], help="Frame sizes")
+    parser.add_argument("--clients", type=int, default=1, help="RGB8 clients to convert each frame for")
+    parser.add_argument("--frames", type=int, default=200, help="Frames to convert at each size")
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        start = monotonic()
+        lut = ColorLUT(args.bits, cache_dir)
+        built = monotonic() - start
+        start = monotonic()
+        ColorLUT(args.bits, cache_dir)
+        loaded = monotonic() - start
+    finally:
+        shutil.rmtree(cache_dir)
+
+    report = lut.error_report()
+    print "%d-%d-%d bits, %d colors: built in %0.1f ms, loaded from cache in %0.1f ms" % (
+        tuple(lut.bits) + (lut.size, built * 1000.0, loaded * 1000.0))
+    print "Error against hls_to_rgb in 8-bit levels, over %d random colors: max %0.2f, p99 %0.2f, mean %0.2f" % (
+        report["pixels"], report["max"], report["p99"], report["mean"])
+    print
+
+    # Each client has its own gamma and color order, as folded into its table
+    drivers = [OutputDriver({"host": "127.0.0.1", "port": i, "gamma": 1.0 + 0.2 * i,
+                             "color-mode": ("RGB8", "GRB8", "BGR8")[i % 3]}) for i in xrange(args.clients)]
+
+    print "%8s %12s %12s %8s" % ("pixels", "exact ms", "LUT ms", "speedup")
+    for pixels in args.pixels:
+        hls = np.random.random((pixels, 3)).astype(np.float32)
+        rgb = np.empty_like(hls)
+        rgb16 = np.empty(hls.shape, dtype=np.uint16)
+        out = np.empty(hls.shape, dtype=np.uint8)
+
+        def exact():
+            # As Networking._quantize and the clients' output LUTs
+            hls_to_rgb(hls, rgb)
+            np.multiply(rgb, LEVELS - 1, rgb)
+            np.clip(rgb, 0, LEVELS - 1, rgb)
+            np.copyto(rgb16, rgb, casting='unsafe')
+            for driver in drivers:
+                driver.to_rgb8(rgb16, out)
+
+        def indexed():
+            frame = lut.frame(hls)
+            for driver in drivers:
+                driver.to_rgb8(frame, out)
+
+        before = time_per_frame(exact, args.frames)
+        after = time_per_frame(indexed, args.frames)
+        print "%8d %12.3f %12.3f %7.1fx" % (pixels, before * 1000.0, after * 1000.0, before / after)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares hls_to_rgb, converting into a reused float32 buffer, with the
+masked float64 conversion it replaced, on random frames, and rgb_to_hls
+with its masked predecessor on a random 8-bit image:
+
+    python benchmarks/bench_colors.py [--pixels 1000 10000 100000] [--frames 200] [--image 1080 1920]
+"""
+
+import argparse
+import colorsys
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from lib.clock import monotonic
+from lib.colors import hls_to_rgb, rgb_to_hls
+
+
+def masked_hls_to_rgb(hls):
+    """
+    hls_to_rgb before the single-pass float32 version: float64 channels
+    filled with a boolean mask per hue sextant
+    """
+
+    H = hls[:, 0]
+    L = hls[:, 1]
+    S = hls[:, 2]
+
+    C = (1 - np.absolute(2 * L - 1)) * S
+
+    Hp = H * 6.0
+    i = Hp.astype(np.int)
+    #f = Hp - i  # |H' mod 2|  ?
+
+    X = C * (1 - np.absolute(np.mod(Hp, 2) - 1))
+    #X = C * (1 - f)
+
+    # initialize with zero
+    R = np.zeros(H.shape, float)
+    G = np.zeros(H.shape, float)
+    B = np.zeros(H.shape, float)
+
+    # handle each case:
+
+    #mask = (Hp >= 0) == ( Hp < 1)
+    mask = i % 6 == 0
+    R[mask] = C[mask]
+    G[mask] = X[mask]
+
+    #mask = (Hp >= 1) == ( Hp < 2)
+    mask = i == 1
+    R[mask] = X[mask]
+    G[mask] = C[mask]
+
+    #mask = (Hp >= 2) == ( Hp < 3)
+    mask = i == 2
+    G[mask] = C[mask]
+    B[mask] = X[mask]
+
+    #mask = (Hp >= 3) == ( Hp < 4)
+    mask = i == 3
+    G[mask] = X[mask]
+    B[mask] = C[mask]
+
+    #mask = (Hp >= 4) == ( Hp < 5)
+    mask = i == 4
+    R[mask] = X[mask]
+    B[mask] = C[mask]
+
+    #mask = (Hp >= 5) == ( Hp < 6)
+    mask = i == 5
+    R[mask] = C[mask]
+    B[mask] = X[mask]
+
+    m = L - 0.5*C
+    R += m
+    G += m
+    B += m
+
+    rgb = np.empty_like(hls)
+    rgb[:, 0] = R
+    rgb[:, 1] = G
+    rgb[:, 2] = B
+    return rgb
+
+
+def masked_rgb_to_hls(arr):
+    """
+    rgb_to_hls before the branch-free version: a masked pass per channel.
+    Only correct when no pixel is black.
+    """
+
+    arr = arr.astype("float32") / 255.0
+    out = np.empty_like(arr)
+
+    arr_max = arr.max(-1)
+    delta = arr.ptp(-1)
+    arr_min = arr.min(-1)
+    total = arr_max + arr_min
+
+    l = total / 2.0
+
+    if total.all() > 0:
+        s = delta / total
+        idx = (l > 0.5)
+        s[idx] = delta[idx] / (2.0 - total[idx])
+
+        # red is max
+        idx = (arr[:,:,0] == arr_max)
+        out[idx, 0] = (arr[idx, 1] - arr[idx, 2]) / delta[idx]
+
+        # green is max
+        idx = (arr[:,:,1] == arr_max)
+        out[idx, 0] = 2. + (arr[idx, 2] - arr[idx, 0] ) / delta[idx]
+
+        # blue is max
+        idx = (arr[:,:,2] == arr_max)
+        out[idx, 0] = 4. + (arr[idx, 0] - arr[idx, 1] ) / delta[idx]
+
+        out[:,:,0] = (out[:,:,0]/6.0) % 1.0
+        out[:,:,1] = l
+        out[:,:,2] = s
+
+        idx = (delta==0)
+        out[idx, 2] = 0.0
+        out[idx, 0] = 0.0
+
+        # remove NaN
+        out[np.isnan(out)] = 0
+
+    return out
+
+
+def time_per_frame(function, frames):
+    function()
+    start = monotonic()
+    for i in xrange(frames):
+        function()
+    return (monotonic() - start) / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HLS to RGB conversion")
+    parser.add_argument("--pixels", type=int, nargs="+", default=[1000, 10000, 100000], help="Frame sizes")
+    parser.add_argument("--frames", type=int, default=200, help="Frames to convert at each size")
+    parser.add_argument("--image", type=int, nargs=2, default=[1080, 1920], help="Image height and width")
+    args = parser.parse_args()
+
+    worst = 0.0
+    print "%8s %12s %12s %8s %10s" % ("pixels", "masked ms", "float32 ms", "speedup", "max error")
+    for pixels in args.pixels:
+        hls = np.random.random((pixels, 3)).astype(np.float32)
+        out = np.empty_like(hls)
+        before = time_per_frame(lambda: masked_hls_to_rgb(hls), args.frames)
+        after = time_per_frame(lambda: hls_to_rgb(hls, out), args.frames)
+        error = np.abs(masked_hls_to_rgb(hls) - out).max()
+        worst = max(worst, error)
+        print "%8d %12.3f %12.3f %7.1fx %10.2g" % (pixels, before * 1000.0, after * 1000.0, before / after, error)
+
+    # The masked version needs every pixel to have some color
+    height, width = args.image
+    image = np.random.randint(1, 256, (height, width, 3)).astype(np.uint8)
+    hls = np.empty(image.shape, dtype=np.float32)
+    frames = max(1, args.frames // 20)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        before = time_per_frame(lambda: masked_rgb_to_hls(image), frames)
+    after = time_per_frame(lambda: rgb_to_hls(image, hls), frames)
+    sample = image.reshape(-1, 3)[::max(1, height * width // 10000)]
+    expected = np.array([colorsys.rgb_to_hls(*(pixel / 255.0)) for pixel in sample])
+    error = np.abs(rgb_to_hls(sample) - expected).max()
+    worst = max(worst, error)
+    print
+    print "%11s %12s %12s %8s %10s" % ("image", "masked ms", "float32 ms", "speedup", "max error")
+    print "%11s %12.3f %12.3f %7.1fx %10.2g" % ("%dx%d" % (width, height), before * 1000.0, after * 1000.0,
+                                                before / after, error)
+    return 0 if worst < 1e-5 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Drives Networking.write_buffer with synthetic frames against stand-in
+receivers on loopback (UDP for Legacy, sACN and Art-Net, a TCP OPC server
+and a ZMQ subscriber), for the demo and firefly2015 scenes and a generated
+50k-pixel scene:
+
+    python benchmarks/bench_network.py [--scenes demo firefly2015 generated]
+        [--protocols Legacy OPC ZMQ sACN ArtNet] [--frames 300] [--fps 0] [--json results.json]
+
+For each scene and protocol it reports the frames and bytes per second
+received, the time write_buffer takes (the cost on the output thread), the
+delivery latency from write_buffer to a complete frame at the receiver, and
+how many received frames were intact.  Clients are not paced.  Each scene
+runs in its own process, since the pixel layout caches are global.
+"""
+
+import argparse
+import json
+import os
+import platform
+import select
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import zmq
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from core import networking
+from core.frame_stats import FrameStats, StageHistogram
+from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
+from lib.colors import hls_to_rgb
+from lib.output_driver import OutputLUT
+from lib.plugin_loader import PluginLoader
+from lib.scene import Scene
+
+PROTOCOLS = ["Legacy", "OPC", "ZMQ", "sACN", "ArtNet"]
+SCENES = ["demo", "firefly2015", "generated"]
+# Distinct frames cycled through, so a received frame can be told apart
+DISTINCT_FRAMES = 16
+# The OPC length field is 16 bits
+OPC_MAX_PIXELS = 65535 // 3
+
+
+class BenchArgs:
+    scene = "demo"
+
+
+class BenchMixer:
+    global_dimmer = 1.0
+
+    def __init__(self):
+        self.stats = FrameStats()
+
+
+class BenchApp:
+    """
+    What Networking and BufferUtils need from the app
+    """
+
+    def __init__(self, scene_name):
+        self.args = BenchArgs()
+        self.settings = {"networking": {"clients": []}}
+        self.mixer = BenchMixer()
+        self.plugins = PluginLoader()
+        BufferUtils.set_app(self)
+        if scene_name == "generated":
+            # Loaded from the demo scene, with its fixtures replaced
+            self.scene = Scene(self)
+            self.scene.data = generated_scene()
+        else:
+            self.args.scene = scene_name
+            self.scene = Scene(self)
+        BufferUtils.init()
+
+
+def generated_scene(strands=50, fixtures=20, pixels=50):
+    """
+    Returns scene data with strands * fixtures * pixels pixels
+    """
+    return {
+        "file-type": "scene",
+        "name": "generated",
+        "fixtures": [{"strand": s, "address": f, "pixels": pixels, "type": "linear",
+                      "pos1": [f * 10, s * 10], "pos2": [f * 10 + 9, s * 10]}
+                     for s in xrange(strands) for f in xrange(fixtures)],
+        "strand-settings": [{"id": s, "enabled": True, "color-mode": "RGB8"} for s in xrange(strands)],
+    }
+
+
+class Receiver(threading.Thread):
+    """
+    Collects (arrival time, frame data) for every frame a stand-in client
+    receives, where frame data is the RGB bytes of all enabled strands back
+    to back, or None for an incomplete frame
+    """
+
+    def __init__(self, strands):
+        threading.Thread.__init__(self, name="Receiver")
+        self.daemon = True
+        self.strands = strands
+        self.frames = []
+        self.bytes = 0
+        self._running = True
+
+    def reset(self):
+        self.frames = []
+        self.bytes = 0
+
+    def stop(self):
+        self._running = False
+        self.join(2.0)
+
+    def frame(self, data):
+        self.frames.append((monotonic(), data))
+
+
+class UDPReceiver(Receiver):
+
+    def __init__(self, protocol, strands):
+        Receiver.__init__(self, strands)
+        self.protocol = protocol
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.1)
+        self.port = self.socket.getsockname()[1]
+        self._parts = {}
+        self._sequence = None
+        # Universes of the default mapping: each strand starts a new one
+        self._universes = []
+        universe = 1 if protocol == "sACN" else 0
+        for strand, start, end in strands:
+            count = max(1, -(-(end - start) // networking.DMXPackets.PIXELS_PER_UNIVERSE))
+            self._universes.append(range(universe, universe + count))
+            universe += count
+
+    def run(self):
+        while self._running:
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            self.bytes += len(data)
+            if self.protocol == "Legacy":
+                self._legacy(data)
+            else:
+                self._dmx(data)
+        self.socket.close()
+
+    def _legacy(self, data):
+        if data == "B":
+            self._parts = {}
+        elif data == "E":
+            parts = [self._parts.get(strand) for strand, start, end in self.strands]
+            self.frame(None if None in parts else "".join(parts))
+        else:
+            self._parts[ord(data[1])] = data[4:]
+
+    def _dmx(self, data):
+        if self.protocol == "sACN":
+            universe, = struct.unpack(">H", data[113:115])
+            sequence = ord(data[111])
+            payload = data[126:]
+        else:
+            universe = ord(data[14]) | ord(data[15]) << 8
+            sequence = ord(data[12])
+            payload = data[18:]
+        if sequence != self._sequence:
+            if self._parts:
+                self.frame(None)
+            self._sequence = sequence
+            self._parts = {}
+        self._parts[universe] = payload
+        if len(self._parts) == sum(len(u) for u in self._universes):
+            frame = []
+            for (strand, start, end), universes in zip(self.strands, self._universes):
+                remaining = (end - start) * 3
+                for universe in universes:
+                    size = min(remaining, networking.DMXPackets.PIXELS_PER_UNIVERSE * 3)
+                    frame.append(self._parts[universe][:size])
+                    remaining -= size
+            self.frame("".join(frame))
+            self._parts = {}
+
+
+class OPCReceiver(Receiver):
+
+    def __init__(self, strands):
+        Receiver.__init__(self, strands)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen(1)
+        self.port = self.socket.getsockname()[1]
+
+    def run(self):
+        connection = None
+        pending = ""
+        while self._running:
+            readable, _, _ = select.select([connection or self.socket], [], [], 0.1)
+            if not readable:
+                continue
+            if connection is None:
+                connection, _ = self.socket.accept()
+                continue
+            data = connection.recv(1 << 20)
+            if not data:
+                connection.close()
+                connection = None
+                continue
+            self.bytes += len(data)
+            pending += data
+            while len(pending) >= 4:
+                length, = struct.unpack(">H", pending[2:4])
+                if len(pending) < 4 + length:
+                    break
+                self.frame(pending[4:4 + length])
+                pending = pending[4 + length:]
+        if connection is not None:
+            connection.close()
+        self.socket.close()
+
+
+class ZMQReceiver(Receiver):
+
+    def __init__(self, strands):
+        Receiver.__init__(self, strands)
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+        self.socket = None
+
+    def connect(self):
+        self.socket = networking.frame_subscriber(zmq.Context.instance(), "tcp://127.0.0.1:%d" % self.port)
+
+    def run(self):
+        while self._running:
+            if self.socket is None or not self.socket.poll(100):
+                continue
+            message = self.socket.recv(copy=False)
+            self.bytes += len(message)
+            try:
+                self.frame(networking.decode_frame(message)[3].tobytes())
+            except ValueError:
+                self.frame(None)
+        if self.socket is not None:
+            self.socket.close()
+
+
+def summary(histogram):
+    return dict((key, value * 1000.0 if key != "count" else value)
+                for key, value in histogram.summary().iteritems())
+
+
+def run_protocol(app, protocol, frames, expected, args):
+    strands = app.net_strands
+    pixels = sum(end - start for strand, start, end in strands)
+    result = {"scene": app.scene_name, "protocol": protocol, "pixels": pixels, "strands": len(strands)}
+    if protocol == "OPC" and pixels > OPC_MAX_PIXELS:
+        result["skipped"] = "an OPC message holds at most %d pixels" % OPC_MAX_PIXELS
+        return result
+
+    if protocol in ("Legacy", "sACN", "ArtNet"):
+        receiver = UDPReceiver(protocol, strands)
+    elif protocol == "OPC":
+        receiver = OPCReceiver(strands)
+    else:
+        receiver = ZMQReceiver(strands)
+    receiver.start()
+    app.settings["networking"]["clients"] = [{
+        "enabled": True, "host": "127.0.0.1", "port": receiver.port, "protocol": protocol,
+        "max-packets-per-second": 0, "max-bytes-per-second": 0,
+    }]
+    net = networking.Networking(app)
+
+    # Warm up: connect, let ZMQ subscribe, build the packet layouts
+    net.write_buffer(frames[0])
+    if protocol == "ZMQ":
+        receiver.connect()
+    for i in xrange(10):
+        net.write_buffer(frames[i % len(frames)])
+        time.sleep(0.02)
+    time.sleep(0.3)
+    receiver.reset()
+
+    write_time = StageHistogram("write")
+    send_times = [[] for frame in frames]
+    period = 1.0 / args.fps if args.fps else 0.0
+    start = monotonic()
+    for i in xrange(args.frames):
+        index = i % len(frames)
+        frame_start = monotonic()
+        net.write_buffer(frames[index])
+        write_time.record(monotonic() - frame_start)
+        send_times[index].append(frame_start)
+        if period:
+            delay = start + (i + 1) * period - monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    time.sleep(0.5)
+    receiver.stop()
+    client_stats = net.get_client_stats().values()
+    net.stop()
+
+    received = receiver.frames
+    delivery = StageHistogram("delivery")
+    intact = 0
+    last_arrival = start
+    for arrival, data in received:
+        index = expected.get(data)
+        if index is None:
+            continue
+        intact += 1
+        sent = [t for t in send_times[index] if t <= arrival]
+        if sent:
+            delivery.record(arrival - sent[-1])
+            last_arrival = arrival
+    elapsed = max(last_arrival, monotonic() - 0.5) - start
+
+    result.update({
+        "frames-written": args.frames,
+        "frames-received": len(received),
+        "frames-intact": intact,
+        "frames-per-second": intact / elapsed,
+        "bytes-per-second": receiver.bytes / elapsed,
+        "write-ms": summary(write_time),
+        "delivery-ms": summary(delivery),
+        "sender": client_stats[0] if client_stats else {},
+    })
+    return result
+
+
+def run_scene(scene_name, args):
+    os.chdir(ROOT)
+    app = BenchApp(scene_name)
+    app.scene_name = scene_name
+    size = BufferUtils.get_buffer_size()
+    app.net_strands = [(strand,) + BufferUtils.get_strand_extents(strand)
+                       for strand, s in enumerate(app.scene.get_strand_settings()) if s["enabled"]]
+
+    random = np.random.RandomState(1)
+    frames = [random.random_sample((size, 3)).astype(np.float32) for i in xrange(DISTINCT_FRAMES)]
+    # The bytes a client should get for each frame: the enabled strands, back to back
+    lut = OutputLUT()
+    expected = {}
+    for index, frame in enumerate(frames):
+        rgb = np.clip(hls_to_rgb(frame) * (OutputLUT.LEVELS - 1), 0, OutputLUT.LEVELS - 1).astype(np.uint16)
+        rgb8 = np.empty(rgb.shape, dtype=np.uint8)
+        lut.apply(rgb, rgb8)
+        expected["".join(rgb8[start:end].tobytes() for strand, start, end in app.net_strands)] = index
+
+    return [run_protocol(app, protocol, frames, expected, args) for protocol in args.protocols]
+
+
+def print_results(results):
+    print "%-12s %-7s %7s %9s %9s %9s %9s %9s %9s %11s" % (
+        "scene", "proto", "pixels", "write-fps", "recv-fps", "MB/s", "write-p99", "deliv-p50", "deliv-p99", "intact")
+    for r in results:
+        if "skipped" in r:
+            print "%-12s %-7s %7d  skipped: %s" % (r["scene"], r["protocol"], r["pixels"], r["skipped"])
+            continue
+        print "%-12s %-7s %7d %9.0f %9.0f %9.2f %9.3f %9.3f %9.3f %5d/%-5d" % (
+            r["scene"], r["protocol"], r["pixels"], 1000.0 / max(r["write-ms"]["mean"], 1e-6),
+            r["frames-per-second"], r["bytes-per-second"] / 1e6, r["write-ms"]["p99"],
+            r["delivery-ms"]["p50"], r["delivery-ms"]["p99"], r["frames-intact"], r["frames-received"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark network output against local receivers")
+    parser.add_argument("--scenes", nargs="+", default=SCENES, help="Scenes to run (\"generated\" is 50k pixels)")
+    parser.add_argument("--protocols", nargs="+", default=PROTOCOLS, choices=PROTOCOLS, help="Protocols to run")
+    parser.add_argument("--frames", type=int, default=300, help="Frames to write per scene and protocol")
+    parser.add_argument("--fps", type=float, default=0.0, help="Frame rate to write at (0 for as fast as possible)")
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print json.dumps(run_scene(args.child, args))
+        return 0
+
+    results = []
+    for scene in args.scenes:
+        command = [sys.executable, os.path.abspath(__file__), "--child", scene, "--frames", str(args.frames),
+                   "--fps", str(args.fps), "--protocols"] + args.protocols
+        output = subprocess.check_output(command)
+        results.extend(json.loads(output.strip().splitlines()[-1]))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "frames": args.frames,
+                "fps": args.fps,
+                "results": results,
+            }, f, indent=4, sort_keys=True)
+    return 0 if all("skipped" in r or r["frames-intact"] > 0 for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares strand packet assembly with StrandPackets against the per-pixel
+loop Networking.write_buffer used before, on a synthetic scene:
+
+    python benchmarks/bench_packets.py [--pixels 3600] [--strands 24] [--frames 200]
+"""
+
+import argparse
+import array
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from core.networking import StrandPackets
+from lib.clock import monotonic
+
+
+def loop_packets(intbuffer, strands, packet_cache):
+    """
+    The packet assembly of Networking.write_buffer before StrandPackets
+    """
+    def fill_packet(intbuffer, start, end, offset, packet):
+        for pixel_index, pixel in enumerate(intbuffer[start:end]):
+            buffer_index = offset + pixel_index * 3
+            packet[buffer_index] = pixel[0]
+            packet[buffer_index + 1] = pixel[1]
+            packet[buffer_index + 2] = pixel[2]
+
+    packets = []
+    for strand, start, end in strands:
+        packet_size = (end - start) * 3 + 4
+        try:
+            packet = packet_cache[packet_size]
+        except KeyError:
+            packet = [0,] * packet_size
+            packet_cache[packet_size] = packet
+        length = packet_size - 4
+        packet[0] = ord('S')
+        packet[1] = strand
+        packet[2] = length & 0x00FF
+        packet[3] = (length & 0xFF00) >> 8
+        fill_packet(intbuffer, start, end, 4, packet)
+        packets.append(array.array('B', packet))
+    return packets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark strand packet assembly")
+    parser.add_argument("--pixels", type=int, default=3600, help="Pixels in the scene")
+    parser.add_argument("--strands", type=int, default=24, help="Strands in the scene")
+    parser.add_argument("--frames", type=int, default=200, help="Frames to assemble")
+    args = parser.parse_args()
+
+    per_strand = args.pixels // args.strands
+    strands = [(s, s * per_strand, (s + 1) * per_strand) for s in xrange(args.strands)]
+    num_pixels = per_strand * args.strands
+    rgb = np.random.random((num_pixels, 3)) * 255
+
+    # Before: int conversion and a Python loop per pixel
+    cache = {}
+    start = monotonic()
+    for i in xrange(args.frames):
+        intbuffer = np.int_(rgb)
+        np.clip(intbuffer, 0, 255, intbuffer)
+        before_packets = loop_packets(intbuffer, strands, cache)
+    before = (monotonic() - start) / args.frames
+
+    # After: uint8 frame and one gather
+    packets = StrandPackets(strands, num_pixels)
+    start = monotonic()
+    for i in xrange(args.frames):
+        np.copyto(packets.rgb, rgb, casting='unsafe')
+        packets.fill()
+    after = (monotonic() - start) / args.frames
+
+    identical = [p.tostring() for p in before_packets] == [p.tobytes() for p in packets.packets]
+    print "%d pixels in %d strands, %d frames" % (num_pixels, args.strands, args.frames)
+    print "Per-pixel loop:  %8.3f ms per frame" % (before * 1000.0)
+    print "StrandPackets:   %8.3f ms per frame" % (after * 1000.0)
+    print "Speedup:         %8.1fx (packets %s)" % (before / after, "identical" if identical else "DIFFER")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
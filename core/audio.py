@@ -16,6 +16,7 @@
 # along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import copy
 import logging
 import threading
 import time
@@ -59,14 +60,63 @@ class Audio(QtCore.QObject):
         self.fader = ColorFade([(0,0,1), (0,1,1)], self._fader_steps)
         self.pitch = 0.0
         self.pitch_confidence = 0.0
+        self.recorder = None
+        self._updates = None
 
         self.smoothEnergy = 0.0
 
+    # Everything apply_fft_data() and apply_pitch_data() keep between calls
+    _state_keys = ("fft", "smoothed", "average", "peak", "peakFrequency", "gain",
+                   "fader", "pitch", "pitch_confidence", "smoothEnergy")
+
+    def get_state(self):
+        """
+        Returns a copy of the audio analysis state, for set_state()
+        """
+        return copy.deepcopy(dict((key, getattr(self, key)) for key in self._state_keys))
+
+    def set_state(self, state):
+        for key in self._state_keys:
+            setattr(self, key, copy.deepcopy(state[key]))
+
+    def keep_updates(self, keep):
+        """
+        Starts (or stops) keeping every FFT and pitch update as it is
+        applied, for take_updates()
+        """
+        self._updates = [] if keep else None
+
+    def take_updates(self):
+        """
+        Returns the updates applied since the last call, in order, for
+        apply_updates() on another copy of the audio state
+        """
+        if self._updates is None:
+            return []
+        updates, self._updates = self._updates, []
+        return updates
+
+    def apply_updates(self, updates):
+        for kind, data in updates:
+            if kind == "fft":
+                self.apply_fft_data(data)
+            else:
+                self.apply_pitch_data(*data)
+
     def fft_data(self):
         return np.multiply(self.fft, self.gain)
 
     @QtCore.Slot(float, float)
     def update_pitch_data(self, pitch, confidence):
+        if self.recorder is not None:
+            # Applied at the start of the next frame (see ShowRecorder)
+            self.recorder.pitch(pitch, confidence, self.apply_pitch_data)
+        else:
+            self.apply_pitch_data(pitch, confidence)
+
+    def apply_pitch_data(self, pitch, confidence):
+        if self._updates is not None:
+            self._updates.append(("pitch", (pitch, confidence)))
         self.pitch = pitch
         self.pitch_confidence = confidence
         #if confidence > 0.9:
@@ -74,6 +124,15 @@ class Audio(QtCore.QObject):
 
     @QtCore.Slot(float, float)
     def update_fft_data(self, latest_fft):
+        if self.recorder is not None:
+            # Applied at the start of the next frame (see ShowRecorder)
+            self.recorder.fft(latest_fft, self.apply_fft_data)
+        else:
+            self.apply_fft_data(latest_fft)
+
+    def apply_fft_data(self, latest_fft):
+        if self._updates is not None:
+            self._updates.append(("fft", copy.copy(latest_fft)))
         if len(latest_fft) == 0:
             print "received no fft"
             return
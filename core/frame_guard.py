@@ -0,0 +1,91 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+log = logging.getLogger("firemix.core.frame_guard")
+
+
+class FrameGuard:
+    """
+    Always-on sanity check for rendered frames.
+
+    A clean frame costs one min and one max reduction over the buffer: both
+    propagate NaN, so a single range comparison catches NaN, Inf and values
+    whose magnitude exceeds max_magnitude.  Only a bad frame pays for the
+    per-element pass that finds the offending pixels and blacks them out in
+    place.
+
+    Bad frames are counted per source, and a source that produces
+    fault_limit bad frames is reported for quarantine.
+    """
+
+    def __init__(self, fault_limit=30, max_magnitude=65536.0):
+        self._fault_limit = fault_limit
+        self._max_magnitude = max_magnitude
+        self.bad_frames = defaultdict(int)
+        self.bad_pixels = defaultdict(int)
+
+    def repair(self, buffer):
+        """
+        Replaces bad pixels in the buffer with black.  Returns the number of
+        pixels replaced.
+        """
+        lo = buffer.min()
+        hi = buffer.max()
+        if lo >= -self._max_magnitude and hi <= self._max_magnitude:
+            return 0
+
+        with np.errstate(invalid='ignore'):
+            bad = np.logical_not(np.isfinite(buffer))
+            bad |= (np.abs(buffer) > self._max_magnitude)
+        bad_pixels = bad.any(axis=1)
+        buffer[bad_pixels] = 0.0
+        return int(np.count_nonzero(bad_pixels))
+
+    def check(self, name, buffer):
+        """
+        Repairs the buffer and accounts any bad pixels to the named source.
+        Returns True if the source has reached the fault limit and should be
+        quarantined.
+        """
+        num_bad = self.repair(buffer)
+        if num_bad == 0:
+            return False
+
+        self.bad_frames[name] += 1
+        self.bad_pixels[name] += num_bad
+        if self.bad_frames[name] == 1:
+            log.warn("%s rendered %d bad pixels (NaN, Inf or out of range)" % (name, num_bad))
+
+        return self._fault_limit > 0 and self.bad_frames[name] >= self._fault_limit
+
+    def forget(self, name):
+        """
+        Clears the fault count of a source, e.g. after it has been re-enabled
+        """
+        self.bad_frames.pop(name, None)
+        self.bad_pixels.pop(name, None)
+
+    def stats(self):
+        """
+        Returns {source: (bad frames, bad pixels)}
+        """
+        return dict((name, (self.bad_frames[name], self.bad_pixels[name])) for name in self.bad_frames)
@@ -0,0 +1,174 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import math
+import os
+import threading
+
+log = logging.getLogger("firemix.core.frame_stats")
+
+
+class StageHistogram:
+    """
+    Latency histogram for one stage of the frame pipeline.
+
+    Samples go into a fixed set of logarithmic buckets (BUCKETS_PER_OCTAVE per
+    doubling, from MIN_TIME up), so recording is a log and a list increment
+    and memory use never grows.  Each stage has a single writer thread, so no
+    locking is needed; readers take a snapshot of the bucket list and may see
+    a sample or two in flight, which doesn't matter for percentiles.
+    """
+    MIN_TIME = 1e-6
+    BUCKETS_PER_OCTAVE = 4
+    NUM_BUCKETS = 96  # 1us .. ~16s
+
+    _scale = BUCKETS_PER_OCTAVE / math.log(2.0)
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self._counts = [0] * self.NUM_BUCKETS
+        self._total = 0.0
+        self._max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.MIN_TIME:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.MIN_TIME) * self._scale) + 1, self.NUM_BUCKETS - 1)
+        self._counts[index] += 1
+        self._total += seconds
+        if seconds > self._max:
+            self._max = seconds
+
+    @classmethod
+    def bucket_upper_bound(cls, index):
+        return cls.MIN_TIME * pow(2.0, float(index) / cls.BUCKETS_PER_OCTAVE)
+
+    def summary(self):
+        """
+        Returns count, mean, max and p50/p95/p99 (in seconds).  Percentiles
+        are reported as the upper bound of the bucket they fall in.
+        """
+        counts = list(self._counts)
+        count = sum(counts)
+        result = {"count": count, "mean": 0.0, "max": self._max, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+        if count == 0:
+            return result
+
+        result["mean"] = self._total / count
+        targets = [("p50", 0.50), ("p95", 0.95), ("p99", 0.99)]
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            while targets and seen >= targets[0][1] * count:
+                result[targets[0][0]] = min(self.bucket_upper_bound(index), self._max)
+                targets.pop(0)
+            if not targets:
+                break
+        return result
+
+
+class FrameStats:
+    """
+    Per-stage frame timing, kept by the mixer and filled in by every stage of
+    the frame pipeline (mixer, output pipeline and networking).
+    """
+    STAGES = (
+        "frame",            # Whole Mixer.tick
+        "preset-tick",      # Pattern.tick of the active (and next) preset
+        "guard",            # Frame guard on the preset buffers
+        "transition",       # Transition.get
+        "composite",        # Layer stack compositing
+        "postprocess",      # Hue mod and lightness/saturation clip
+        "hls-to-rgb",       # Color conversion for output
+        "packet-assembly",  # Building the wire packets
+        "socket-send",      # Sending packets to clients
+        "queue-latency",    # Time frames wait for the output worker
+        "jitter",           # Scheduler wake-up lateness
+    )
+
+    def __init__(self):
+        self._stages = dict((name, StageHistogram(name)) for name in self.STAGES)
+
+    def record(self, stage, seconds):
+        self._stages[stage].record(seconds)
+
+    def reset(self):
+        for stage in self._stages.itervalues():
+            stage.reset()
+
+    def snapshot(self):
+        """
+        Returns {stage: summary} for all stages (see StageHistogram.summary)
+        """
+        return dict((name, self._stages[name].summary()) for name in self.STAGES)
+
+    def format_table(self):
+        lines = ["%-16s %8s %9s %9s %9s %9s %9s" % ("stage (ms)", "count", "mean", "p50", "p95", "p99", "max")]
+        snapshot = self.snapshot()
+        for name in self.STAGES:
+            s = snapshot[name]
+            lines.append("%-16s %8d %9.3f %9.3f %9.3f %9.3f %9.3f" % (
+                name, s["count"], s["mean"] * 1000.0, s["p50"] * 1000.0, s["p95"] * 1000.0,
+                s["p99"] * 1000.0, s["max"] * 1000.0))
+        return "\n".join(lines)
+
+    def write(self, filename):
+        """
+        Writes the current stats to a file, as JSON if the name ends in .json
+        and as a text table otherwise.  The file is replaced atomically.
+        """
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
+            if filename.endswith(".json"):
+                json.dump(self.snapshot(), f, indent=4, sort_keys=True)
+            else:
+                f.write(self.format_table())
+                f.write("\n")
+        os.rename(tmp_filename, filename)
+
+
+class FrameStatsWriter(threading.Thread):
+    """
+    Periodically writes a FrameStats to a file
+    """
+
+    def __init__(self, stats, filename, interval=5.0):
+        threading.Thread.__init__(self, name="FrameStatsWriter")
+        self.daemon = True
+        self._stats = stats
+        self._filename = filename
+        self._interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while True:
+            stopping = self._stop_event.wait(self._interval)
+            try:
+                self._stats.write(self._filename)
+            except (IOError, OSError):
+                log.exception("Could not write frame stats to %s" % self._filename)
+            if stopping:
+                break
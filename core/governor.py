@@ -0,0 +1,124 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from lib.clock import monotonic
+
+log = logging.getLogger("firemix.core.governor")
+
+
+class FrameGovernor:
+    """
+    Keeps the mixer within its frame budget.
+
+    The governor tracks an exponentially weighted moving average of the
+    frame cost.  When it exceeds high_water of the frame period, the governor
+    first steps preset quality down (see Pattern.set_quality), and once
+    quality is at its lowest step it lowers the effective tick rate, down to
+    min_rate.  When the cost would fit in low_water of the period at the next
+    higher rate (or quality), it steps back up in the reverse order.  After
+    each change it holds for hold_time seconds so the average can settle.
+
+    The configured tick rate stays the mixer's nominal rate; only the
+    scheduler's rate is changed.
+    """
+    QUALITY_STEPS = (1.0, 0.75, 0.5, 0.25)
+    RATE_STEP = 0.8
+
+    def __init__(self, target_rate, min_rate=10.0, high_water=0.9, low_water=0.6,
+                 smoothing=0.05, hold_time=2.0):
+        self._min_rate = min_rate
+        self._high_water = high_water
+        self._low_water = low_water
+        self._smoothing = smoothing
+        self._hold_time = hold_time
+        self._hold_until = 0.0
+        self._quality_index = 0
+
+        self.target_rate = target_rate
+        self.rate = target_rate
+        self.frame_cost = 0.0
+        self.decisions = 0
+        self.last_decision = ""
+
+    def quality(self):
+        return self.QUALITY_STEPS[self._quality_index]
+
+    def set_target_rate(self, rate):
+        self.target_rate = rate
+        self.rate = rate
+        self._hold_until = 0.0
+
+    def frame_rendered(self, cost):
+        """
+        Feeds the cost of one frame (in seconds).  Returns the new effective
+        tick rate if it should change, otherwise None.
+        """
+        if self.frame_cost == 0.0:
+            self.frame_cost = cost
+        else:
+            self.frame_cost += self._smoothing * (cost - self.frame_cost)
+
+        now = monotonic()
+        if now < self._hold_until:
+            return None
+
+        load = self.frame_cost * self.rate
+        new_rate = None
+
+        if load > self._high_water:
+            if self._quality_index < len(self.QUALITY_STEPS) - 1:
+                self._quality_index += 1
+                self._decide(now, "lowering preset quality to %0.2f" % self.quality(), load)
+            elif self.rate > self._min_rate:
+                new_rate = max(self._min_rate, self.rate * self.RATE_STEP)
+                self._decide(now, "lowering tick rate to %0.1f FPS" % new_rate, load)
+
+        elif self.rate < self.target_rate:
+            rate = min(self.target_rate, self.rate / self.RATE_STEP)
+            if self.frame_cost * rate < self._low_water:
+                new_rate = rate
+                self._decide(now, "restoring tick rate to %0.1f FPS" % new_rate, load)
+
+        elif (self._quality_index > 0 and
+              load * self.QUALITY_STEPS[self._quality_index - 1] / self.quality() < self._low_water):
+            # Assume the cost scales with quality when stepping back up
+            self._quality_index -= 1
+            self._decide(now, "restoring preset quality to %0.2f" % self.quality(), load)
+
+        if new_rate is not None:
+            self.rate = new_rate
+        return new_rate
+
+    def _decide(self, now, decision, load):
+        self.decisions += 1
+        self.last_decision = decision
+        self._hold_until = now + self._hold_time
+        log.warn("Frame governor: %s (frame cost %0.1f ms, %d%% of the frame budget)" % (
+            decision, self.frame_cost * 1000.0, load * 100))
+
+    def stats(self):
+        return {
+            "quality": self.quality(),
+            "tick-rate": self.rate,
+            "target-tick-rate": self.target_rate,
+            "frame-cost": self.frame_cost,
+            "load": self.frame_cost * self.rate,
+            "decisions": self.decisions,
+            "last-decision": self.last_decision,
+        }
@@ -18,9 +18,7 @@
 
 import logging
 import threading
-import time
 import random
-import math
 import numpy as np
 
 USE_YAPPI = True
@@ -33,13 +31,338 @@ from PySide import QtCore
 
 from lib.pattern import Pattern
 from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
 from core.audio import Audio
-from lib.colors import clip
+from core.output import OutputPipeline
+from core.frame_stats import FrameStats, FrameStatsWriter
+from core.frame_guard import FrameGuard
+from core.render_pool import RenderPool
+from core.governor import FrameGovernor
+from core.show_recorder import ShowRecorder
+from lib.colors import HLS, RGB, clamp_frame, clip, convert
 
 
 log = logging.getLogger("firemix.core.mixer")
 
 
+class FrameScheduler(threading.Thread):
+    """
+    Drives the mixer from a dedicated thread.  Frames are scheduled against
+    absolute deadlines on a monotonic clock, so render time never accumulates
+    into drift.  When a frame overruns its deadline, the late-frame policy
+    decides what happens next:
+
+    skip:     missed deadlines are dropped and the schedule realigns to the
+              frame grid.  Every frame advances the presets by the nominal dt.
+    catch-up: missed frames are rendered back-to-back with the nominal dt
+              (at most max_catch_up of them) until the schedule is met again.
+    stretch:  missed deadlines are dropped and the next frame's dt is the
+              real time elapsed since the previous frame.
+    """
+
+    POLICIES = ("skip", "catch-up", "stretch")
+
+    def __init__(self, mixer, tick_rate, policy="skip", max_catch_up=4):
+        threading.Thread.__init__(self, name="FrameScheduler")
+        self.daemon = True
+
+        if policy not in self.POLICIES:
+            log.error("Unknown late-frame policy %s, using skip" % policy)
+            policy = "skip"
+
+        self._mixer = mixer
+        self._period = 1.0 / tick_rate
+        self._policy = policy
+        self._max_catch_up = max_catch_up
+        self._stop_event = threading.Event()
+
+        self.frames = 0
+        self.missed_deadlines = 0
+        self.dropped_frames = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self._jitter_sum = 0.0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def set_tick_rate(self, tick_rate):
+        """
+        Changes the frame rate; takes effect from the next deadline
+        """
+        self._period = 1.0 / tick_rate
+
+    def stats(self):
+        """
+        Returns a snapshot of the scheduling statistics (times in seconds)
+        """
+        return {
+            "policy": self._policy,
+            "tick-rate": 1.0 / self._period,
+            "frames": self.frames,
+            "missed-deadlines": self.missed_deadlines,
+            "dropped-frames": self.dropped_frames,
+            "jitter-last": self.last_jitter,
+            "jitter-mean": (self._jitter_sum / self.frames) if self.frames else 0.0,
+            "jitter-max": self.max_jitter,
+        }
+
+    def run(self):
+        last_frame = monotonic()
+        next_deadline = last_frame + self._period
+        catching_up = 0
+
+        while not self._stop_event.is_set():
+            period = self._period
+            wait = next_deadline - monotonic()
+            if wait > 0 and self._stop_event.wait(wait):
+                break
+
+            now = monotonic()
+
+            # Jitter is how late we woke up for this deadline.  Catch-up frames
+            # are deliberately late, so they are not counted.
+            if not catching_up:
+                jitter = max(0.0, now - next_deadline)
+                self._mixer.stats.record("jitter", jitter)
+                self.last_jitter = jitter
+                self.max_jitter = max(self.max_jitter, jitter)
+                self._jitter_sum += jitter
+                self.frames += 1
+
+            if self._policy == "stretch":
+                dt = now - last_frame
+            else:
+                dt = period
+            last_frame = now
+
+            try:
+                self._mixer.on_tick_timer(dt)
+            except:
+                # The offending preset has been disabled; keep the show running
+                log.exception("Error rendering frame")
+
+            next_deadline += period
+            late = monotonic() - next_deadline
+            if late <= 0:
+                catching_up = 0
+                continue
+
+            missed = int(late / period) + 1
+            if not catching_up:
+                self.missed_deadlines += missed
+
+            if self._policy == "catch-up":
+                skipped = max(0, missed - (self._max_catch_up - catching_up))
+            else:
+                skipped = missed
+
+            next_deadline += skipped * period
+            self.dropped_frames += skipped
+            catching_up = (catching_up + 1) if skipped < missed else 0
+
+
+class Layer:
+    """
+    One entry of the mixer's layer stack: a preset, drawn over the layers
+    below it with an opacity and a blend mode.
+
+    overwrite: lit pixels (lightness > 0) replace the pixels below, like
+               blend_to_buffer; opacity fades their lightness in.
+    add:       lightness is added; the hue and saturation of whichever side
+               contributes more light win.
+    multiply:  the layer's lightness scales the lightness below (a mask).
+    hls:       hue vectors are averaged by chroma, lightness takes the
+               maximum, like hls_blend with progress = opacity.
+
+    When the base frame and every layer are RGB, and no layer uses the hls
+    mode, the stack is composited in RGB: overwrite fades in the lit pixels'
+    color, add adds the colors and multiply scales them.
+    """
+
+    BLEND_MODES = ("overwrite", "add", "multiply", "hls")
+
+    def __init__(self, preset, opacity=1.0, blend_mode="overwrite"):
+        if blend_mode not in self.BLEND_MODES:
+            raise ValueError("Unknown blend mode %s" % blend_mode)
+        self.preset = preset
+        self.opacity = opacity
+        self.blend_mode = blend_mode
+        self.enabled = True
+
+    def __repr__(self):
+        return "Layer(%s, %0.2f, %s)" % (self.preset.name(), self.opacity, self.blend_mode)
+
+
+class LayerStack:
+    """
+    Composites any number of layers over a base frame.
+
+    All work happens with in-place numpy operations on an output buffer and a
+    handful of per-pixel scratch arrays that are allocated once, so the cost
+    grows linearly with the number of layers and a frame allocates nothing.
+    The layer list is replaced rather than mutated, so the GUI thread can
+    edit it while the mixer thread is compositing.
+    """
+
+    def __init__(self):
+        self.layers = ()
+        self.colorspace = HLS
+        self._buffer = None
+        self._converted = None
+
+    def add(self, layer, index=None):
+        layers = list(self.layers)
+        layers.insert(len(layers) if index is None else index, layer)
+        self.layers = tuple(layers)
+
+    def remove(self, layer):
+        self.layers = tuple(l for l in self.layers if l is not layer)
+
+    def clear(self):
+        self.layers = ()
+
+    def reset_buffers(self):
+        """
+        (Re)allocates the output and scratch buffers for the current scene
+        """
+        BufferUtils.release_buffer(self._buffer)
+        BufferUtils.release_buffer(self._converted)
+        self._buffer = BufferUtils.acquire_buffer()
+        self._converted = BufferUtils.acquire_buffer()
+        size = len(self._buffer)
+        self._a, self._t, self._w1, self._w2, self._x, self._y = [
+            np.zeros(size, dtype=np.float32) for i in xrange(6)]
+        self._mask = np.zeros(size, dtype=np.bool)
+
+    def composite(self, base, layers=None, get_buffer=None, colorspace=HLS):
+        """
+        Returns the composite of the layers over the base frame, in a buffer
+        owned by the stack, and sets `colorspace` to the colorspace of the
+        result.  The base frame and layer buffers are not changed.
+        get_buffer(preset) looks up a layer's frame (default: its own buffer);
+        colorspace is the base frame's.
+        """
+        if layers is None:
+            layers = self.layers
+        if get_buffer is None:
+            get_buffer = lambda preset: preset.get_buffer()
+        if self._buffer is None or len(self._buffer) != len(base):
+            self.reset_buffers()
+
+        layers = [layer for layer in layers if layer.enabled and layer.opacity > 0.0]
+        if colorspace == RGB and all(layer.preset.colorspace == RGB and layer.blend_mode != "hls"
+                                     for layer in layers):
+            self.colorspace = RGB
+            suffix = "_rgb"
+        else:
+            self.colorspace = HLS
+            suffix = ""
+
+        out = self._buffer
+        if colorspace == self.colorspace:
+            out[:] = base
+        else:
+            convert(base, colorspace, self.colorspace, out)
+        for layer in layers:
+            layer_buffer = convert(get_buffer(layer.preset), layer.preset.colorspace, self.colorspace,
+                                   self._converted)
+            getattr(self, "_" + layer.blend_mode + suffix)(out, layer_buffer, layer.opacity)
+        return out
+
+    def _overwrite(self, dst, src, opacity):
+        mask, a = self._mask, self._a
+        np.greater(src.T[1], 0.0, mask)
+        if opacity >= 1.0:
+            np.copyto(dst, src, where=mask[:, np.newaxis])
+            return
+        np.copyto(dst.T[0], src.T[0], where=mask)
+        np.copyto(dst.T[2], src.T[2], where=mask)
+        np.subtract(src.T[1], dst.T[1], a)
+        a *= opacity
+        np.add(dst.T[1], a, out=dst.T[1], where=mask)
+
+    def _add(self, dst, src, opacity):
+        mask, a = self._mask, self._a
+        np.multiply(src.T[1], opacity, a)
+        np.greater(a, dst.T[1], mask)
+        np.copyto(dst.T[0], src.T[0], where=mask)
+        np.copyto(dst.T[2], src.T[2], where=mask)
+        dst.T[1] += a
+
+    def _multiply(self, dst, src, opacity):
+        a = self._a
+        np.multiply(src.T[1], opacity, a)
+        a += 1.0 - opacity
+        dst.T[1] *= a
+
+    def _overwrite_rgb(self, dst, src, opacity):
+        mask, a = self._mask, self._a
+        np.maximum(src.T[0], src.T[1], a)
+        np.maximum(a, src.T[2], a)
+        np.greater(a, 0.0, mask)
+        if opacity >= 1.0:
+            np.copyto(dst, src, where=mask[:, np.newaxis])
+            return
+        for channel in xrange(3):
+            np.subtract(src.T[channel], dst.T[channel], a)
+            a *= opacity
+            np.add(dst.T[channel], a, out=dst.T[channel], where=mask)
+
+    def _add_rgb(self, dst, src, opacity):
+        a = self._a
+        for channel in xrange(3):
+            np.multiply(src.T[channel], opacity, a)
+            dst.T[channel] += a
+
+    def _multiply_rgb(self, dst, src, opacity):
+        a = self._a
+        for channel in xrange(3):
+            np.multiply(src.T[channel], opacity, a)
+            a += 1.0 - opacity
+            dst.T[channel] *= a
+
+    def _hls(self, dst, src, opacity):
+        a, t, w1, w2, x, y = self._a, self._t, self._w1, self._w2, self._x, self._y
+        dst_h, dst_l, dst_s = dst.T
+        src_h, src_l, src_s = src.T
+        dst_power = 1.0 - opacity
+
+        # Chroma weights: (1 - |2L - 1|) * S * power
+        for w, l, s, power in ((w1, dst_l, dst_s, dst_power), (w2, src_l, src_s, opacity)):
+            np.multiply(l, 2.0, w)
+            w -= 1.0
+            np.abs(w, w)
+            np.subtract(1.0, w, w)
+            np.maximum(w, 0.0, w)
+            w *= s
+            w *= power
+
+        # Weighted sum of the hue vectors
+        np.multiply(dst_h, 2 * np.pi, t)
+        np.cos(t, x)
+        x *= w1
+        np.sin(t, y)
+        y *= w1
+        np.multiply(src_h, 2 * np.pi, t)
+        np.cos(t, a)
+        a *= w2
+        x += a
+        np.sin(t, a)
+        a *= w2
+        y += a
+        np.arctan2(y, x, dst_h)
+        dst_h /= 2 * np.pi
+
+        dst_s *= dst_power
+        np.multiply(src_s, opacity, a)
+        dst_s += a
+
+        dst_l *= dst_power
+        np.multiply(src_l, opacity, a)
+        np.maximum(dst_l, a, dst_l)
+
+
 class Mixer(QtCore.QObject):
     """
     Mixer is the brains of FireMix.  It handles the playback of presets
@@ -55,24 +378,24 @@ class Mixer(QtCore.QObject):
         self.playlist = None
         self._scene = app.scene
         self._tick_rate = self._app.settings.get('mixer')['tick-rate']
+        self._late_frame_policy = self._app.settings.get('mixer').get('late-frame-policy', 'skip')
+        self._max_catch_up = self._app.settings.get('mixer').get('max-catch-up-frames', 4)
         self._in_transition = False
         self._start_transition = False
         self._transition_scrubbing = False
         self._transition_duration = self._app.settings.get('mixer')['transition-duration']
         self._transition_slop = self._app.settings.get('mixer')['transition-slop']
-        self._tick_timer = None
+        self._scheduler = None
+        self._tick_lock = threading.Lock()
         self._duration = self._app.settings.get('mixer')['preset-duration']
         self._elapsed = 0.0
         self.running = False
         self._buffer_a = None
         self._max_pixels = 0
-        self._tick_time_data = dict()
         self._num_frames = 0
-        self._last_frame_time = 0.0
         self._start_time = 0.0
         self._stop_time = 0.0
         self._strand_keys = list()
-        self._enable_profiling = self._app.args.profile
         self._paused = self._app.settings.get('mixer').get('paused', False)
         self._frozen = False
         self._last_onset_time = 0.0
@@ -81,15 +404,28 @@ class Mixer(QtCore.QObject):
         self._reset_onset = False
         self.global_dimmer = 1.0
         self.global_speed = 1.0
+        self.preset_quality = 1.0
+        self.recorder = None
         self._render_in_progress = False
-        self._last_tick_time = 0.0
         self._fps_time = 0.0
         self._fps_frames = 0
         self._fps = 0.0
-        self.last_time = time.time()
         self.transition_progress = 0.0
         self.audio = Audio(self)
         self._fft_data = None
+        self.stats = FrameStats()
+        self._stats_writer = None
+        self._layers = LayerStack()
+        self._render_pool = None
+        self._governor = None
+        self._guard = FrameGuard(self._app.settings.get('mixer').get('guard-fault-limit', 30),
+                                 self._app.settings.get('mixer').get('guard-max-value', 65536.0))
+
+        # Seeds the random number generators, so start recording before the
+        # playlist is loaded
+        record_file = getattr(self._app.args, 'record', None)
+        if record_file:
+            self.recorder = ShowRecorder(record_file)
 
         if self._app.args.yappi and USE_YAPPI:
             print "yappi start"
@@ -111,29 +447,77 @@ class Mixer(QtCore.QObject):
 
         self._buffer_a = BufferUtils.create_buffer()
         self._buffer_b = BufferUtils.create_buffer()
+        self._convert_buffers = [None, None]
         self._max_pixels = maxp
 
+        self._output = None
+        if self._net is not None:
+            self._output = OutputPipeline(self._net,
+                                          self._app.settings.get('mixer').get('output-queue-depth', 3),
+                                          self.stats)
+
     def run(self):
         if not self.running:
             self._tick_rate = self._app.settings.get('mixer')['tick-rate']
-            self._last_tick_time = 1.0 / self._tick_rate
-            self._tick_timer = threading.Timer(1.0 / self._tick_rate, self.on_tick_timer)
-            self._tick_timer.start()
+            self._late_frame_policy = self._app.settings.get('mixer').get('late-frame-policy', 'skip')
             self.running = True
             self._elapsed = 0.0
             self._num_frames = 0
-            self._start_time = self._last_frame_time = time.time()
+            self._start_time = monotonic()
             self.reset_output_buffer()
+            if self._app.settings.get('mixer').get('render-backend', 'thread') == 'process':
+                # Fork the workers before starting any other threads
+                self._render_pool = RenderPool(self, self._app.settings.get('mixer').get('render-workers', 2))
+                self._render_pool.start()
+            if self._output is not None:
+                self._output.start()
+            stats_file = getattr(self._app.args, 'stats_file', None)
+            if stats_file:
+                self._stats_writer = FrameStatsWriter(self.stats, stats_file,
+                                                      self._app.settings.get('mixer').get('stats-interval', 5.0))
+                self._stats_writer.start()
+            if self._app.settings.get('mixer').get('governor', False):
+                self._governor = FrameGovernor(self._tick_rate,
+                                               self._app.settings.get('mixer').get('governor-min-rate', 10.0))
+            record_file = getattr(self._app.args, 'record', None)
+            if record_file:
+                if self.recorder is None:
+                    self.recorder = ShowRecorder(record_file)
+                self.audio.recorder = self.recorder
+                self.recorder.start(self)
+            self._scheduler = FrameScheduler(self, self._tick_rate,
+                                             self._late_frame_policy,
+                                             self._max_catch_up)
+            self._scheduler.start()
 
     def stop(self):
         self.running = False
-        self._tick_timer.cancel()
-        self._stop_time = time.time()
+        if self._scheduler is not None:
+            self._scheduler.stop()
+            if self._scheduler is not threading.current_thread():
+                self._scheduler.join()
+        if self._output is not None:
+            self._output.stop()
+        if self._render_pool is not None:
+            self._render_pool.stop()
+            self._render_pool = None
+        if self._stats_writer is not None:
+            self._stats_writer.stop()
+            self._stats_writer.join()
+            self._stats_writer = None
+        if self.recorder is not None:
+            self.audio.recorder = None
+            self.recorder.close()
+            self.recorder = None
+        self._stop_time = monotonic()
 
         if self._app.args.yappi and USE_YAPPI:
             yappi.get_func_stats().print_all()
 
     def pause(self, pause=True):
+        self.record_event("pause", self._pause, pause)
+
+    def _pause(self, pause):
         self._paused = pause
         self._app.settings.get('mixer')['paused'] = pause
 
@@ -142,23 +526,75 @@ class Mixer(QtCore.QObject):
 
     def fps(self):
         if self.running and self._num_frames > self._fps_frames:
-            delta_t = time.time() - self._fps_time
+            delta_t = monotonic() - self._fps_time
             if delta_t > 1.0:
                 self._fps = (self._num_frames - self._fps_frames) / delta_t
                 self._fps_frames = self._num_frames
-                self._fps_time = time.time()
+                self._fps_time = monotonic()
             return self._fps
         else:
             self._fps_frames = 0
-            self._fps_time = time.time()
+            self._fps_time = monotonic()
             return 0.0
 
+    def get_scheduler_stats(self):
+        """
+        Returns frame scheduling statistics: frames, missed deadlines and
+        wake-up jitter (see FrameScheduler.stats)
+        """
+        if self._scheduler is None:
+            return {}
+        return self._scheduler.stats()
+
+    def get_output_stats(self):
+        """
+        Returns render/output pipeline metrics: queue depth, dropped frames and
+        per-stage latency (see OutputPipeline.stats)
+        """
+        if self._output is None:
+            return {}
+        return self._output.stats()
+
+    def get_render_pool_stats(self):
+        """
+        Returns render pool metrics (see RenderPool.stats), or {} when presets
+        are rendered on the mixer thread
+        """
+        if self._render_pool is None:
+            return {}
+        return self._render_pool.stats()
+
+    def get_governor_stats(self):
+        """
+        Returns the frame governor's state and last decision (see
+        FrameGovernor.stats), or {} if the governor is disabled
+        """
+        if self._governor is None:
+            return {}
+        return self._governor.stats()
+
+    def get_frame_stats(self):
+        """
+        Returns per-stage frame timing: {stage: {count, mean, max, p50, p95, p99}}
+        with times in seconds (see FrameStats)
+        """
+        return self.stats.snapshot()
+
     @QtCore.Slot()
     def onset_detected(self):
-        t = time.clock()
+        t = monotonic()
         if (t - self._last_onset_time) > self._onset_holdoff:
             self._last_onset_time = t
-            self._onset = True
+            if self.recorder is not None:
+                self.recorder.onset(self.set_onset)
+            else:
+                self.set_onset()
+
+    def set_onset(self):
+        """
+        Flags an onset for presets to see in the next frame
+        """
+        self._onset = True
 
     @QtCore.Slot(list)
     def update_fft_data(self, data):
@@ -181,9 +617,12 @@ class Mixer(QtCore.QObject):
             return None
 
     def set_transition_mode(self, name):
+        self.record_event("set_transition_mode", self._set_transition_mode, name)
+        return True
+
+    def _set_transition_mode(self, name):
         if not self._in_transition:
             self._transition = self.get_transition_by_name(name)
-        return True
 
     def build_random_transition_list(self):
         self._transition_list = [c for c in self._app.plugins.get('Transition')]
@@ -203,42 +642,61 @@ class Mixer(QtCore.QObject):
 
     def set_preset_duration(self, duration):
         if duration >= 0.0:
-            self._duration = duration
+            self.record_event("set_preset_duration", self._set_preset_duration, duration)
             return True
         else:
             log.warn("Pattern duration must be positive or zero.")
             return False
 
+    def _set_preset_duration(self, duration):
+        self._duration = duration
+
     def get_preset_duration(self):
         return self._duration
 
     def set_transition_duration(self, duration):
         if duration >= 0.0:
-            self._transition_duration = duration
+            self.record_event("set_transition_duration", self._set_transition_duration, duration)
             return True
         else:
             log.warn("Transition duration must be positive or zero.")
             return False
 
+    def _set_transition_duration(self, duration):
+        self._transition_duration = duration
+
     def get_transition_duration(self):
         return self._transition_duration
 
-    def on_tick_timer(self, force_tick=False):
+    def on_tick_timer(self, dt=None, force_tick=False):
+        """
+        Renders one frame.  Called by the FrameScheduler once per frame deadline;
+        the GUI uses force_tick to render a frame while the mixer is frozen.
+        """
         if self._frozen and not force_tick:
-            delay = 1.0 / self._tick_rate
-        else:
-            start = time.clock()
+            return
+
+        if dt is None:
+            dt = 1.0 / self._tick_rate
+
+        with self._tick_lock:
+            if self.recorder is not None:
+                self.recorder.tick(dt, self.global_speed, self.get_preset_quality())
             self._render_in_progress = True
-            self.tick(self._last_tick_time)
-            self._render_in_progress = False
-            dt = (time.clock() - start)
-            delay = max(0, (1.0 / self._tick_rate) - dt)
-            if not self._paused:
-                self._elapsed += dt + delay
-        self.running = self._app._running
-        if self.running:
-            self._tick_timer = threading.Timer(delay, self.on_tick_timer)
-            self._tick_timer.start()
+            start = monotonic()
+            try:
+                self.tick(dt)
+            finally:
+                self._render_in_progress = False
+                if not self._paused:
+                    self._elapsed += dt
+            cost = monotonic() - start
+            self.stats.record("frame", cost)
+
+            if self._governor is not None and not force_tick:
+                rate = self._governor.frame_rendered(cost)
+                if rate is not None and self._scheduler is not None:
+                    self._scheduler.set_tick_rate(rate)
 
     def set_constant_preset(self, classname):
         self._app.playlist.clear_playlist()
@@ -254,6 +712,52 @@ class Mixer(QtCore.QObject):
     def get_tick_rate(self):
         return self._tick_rate
 
+    def get_effective_tick_rate(self):
+        """
+        Returns the rate frames are rendered at: the tick rate, or the frame
+        governor's when it has lowered it
+        """
+        if self._governor is not None:
+            return self._governor.rate
+        return self._tick_rate
+
+    def set_tick_rate(self, tick_rate):
+        """
+        Changes the frame rate of a running mixer without restarting it
+        """
+        self._tick_rate = tick_rate
+        if self._governor is not None:
+            self._governor.set_target_rate(tick_rate)
+        if self._scheduler is not None:
+            self._scheduler.set_tick_rate(tick_rate)
+
+    def get_preset_quality(self):
+        """
+        Returns the quality presets render at: the frame governor's, or
+        preset_quality when the governor is disabled
+        """
+        if self._governor is not None:
+            return self._governor.quality()
+        return self.preset_quality
+
+    def record_event(self, name, apply, *args):
+        """
+        Applies a mixer or playlist event with apply(*args).  While a show is
+        being recorded, the event is held back to the start of the next frame
+        like the other inputs, and recorded there (see ShowRecorder).
+        """
+        if self.recorder is not None:
+            self.recorder.event(name, apply, *args)
+        else:
+            apply(*args)
+
+    def set_output(self, output):
+        """
+        Replaces the output stage.  The output must provide acquire() and
+        submit() like OutputPipeline.  Only call this while the mixer is stopped.
+        """
+        self._output = output
+
     def is_onset(self):
         """
         Called by presets; resets after tick if called during tick
@@ -264,6 +768,9 @@ class Mixer(QtCore.QObject):
         return False
 
     def next(self):
+        self.record_event("next", self._next)
+
+    def _next(self):
         #TODO: Fix this after the Playlist merge
         if len(self.playlist) == 0:
             return
@@ -287,6 +794,9 @@ class Mixer(QtCore.QObject):
         self.transition_starting.emit()
 
     def cancel_transition(self):
+        self.record_event("cancel_transition", self._cancel_transition)
+
+    def _cancel_transition(self):
         self._start_transition = False
         self._transition_scrubbing = False
         if self._in_transition:
@@ -294,6 +804,9 @@ class Mixer(QtCore.QObject):
             self.transition_progress = 0
 
     def scrub_transition(self, scrub_ratio):
+        self.record_event("scrub_transition", self._scrub_transition, scrub_ratio)
+
+    def _scrub_transition(self, scrub_ratio):
         if not self.is_paused():
             return
 
@@ -306,6 +819,9 @@ class Mixer(QtCore.QObject):
         self.transition_progress = scrub_ratio
 
     def cancel_scrub(self):
+        self.record_event("cancel_scrub", self._cancel_scrub)
+
+    def _cancel_scrub(self):
         self._transition_scrubbing = False
 
     def tick(self, dt):
@@ -321,16 +837,12 @@ class Mixer(QtCore.QObject):
             if active_preset is None:
                 return
 
-            try:
-                active_preset.tick(dt)
-            except:
-                log.error("Exception raised in preset %s" % active_preset.name())
-                self.playlist.disable_presets_by_class(active_preset.__class__.__name__)
-                raise
+            start = monotonic()
 
             # Handle transition by rendering both the active and the next
             # preset, and blending them together
-            if self._in_transition and next_preset and (next_preset != active_preset):
+            transitioning = self._in_transition and next_preset and (next_preset != active_preset)
+            if transitioning:
                 if self._start_transition:
                     self._start_transition = False
                     if self._app.settings.get('mixer')['transition'] == "Random":
@@ -338,7 +850,6 @@ class Mixer(QtCore.QObject):
                     if self._transition:
                         self._transition.reset()
                     next_preset._reset()
-                    self._buffer_b = BufferUtils.create_buffer()
 
                 if self._transition_duration > 0.0 and self._transition is not None:
                     if not self._paused and not self._transition_scrubbing:
@@ -349,23 +860,70 @@ class Mixer(QtCore.QObject):
                     if not self._transition_scrubbing:
                         self.transition_progress = 1.0
 
-                next_preset.tick(dt)
-
+            presets = [active_preset]
+            if transitioning:
+                presets.append(next_preset)
+            playing = list(presets)
+            layers = self._layers.layers
+            for layer in layers:
+                if layer.enabled and layer.preset not in presets:
+                    presets.append(layer.preset)
+
+            quality = self.get_preset_quality()
+            for preset in presets:
+                if preset.quality != quality:
+                    preset.set_quality(quality)
+
+            # With the process backend, presets render concurrently in the
+            # render pool; whatever the pool can't take is rendered here.
+            if self._render_pool is not None:
+                errors, presets = self._render_pool.render(presets, dt)
+                for preset, error in errors.iteritems():
+                    if preset in playing:
+                        log.error("Exception raised in preset %s:\n%s" % (preset.name(), error))
+                        preset.disabled = True
+                        self.playlist.disable_presets_by_class(preset.__class__.__name__)
+                    else:
+                        log.error("Exception raised in layer preset %s:\n%s" % (preset.name(), error))
+                        self._disable_layers(preset)
+
+            for preset in presets:
+                try:
+                    preset.tick(dt)
+                except:
+                    if preset not in playing:
+                        # A failing layer is switched off; the frame goes on without it
+                        log.exception("Exception raised in layer preset %s" % preset.name())
+                        self._disable_layers(preset)
+                        continue
+                    log.error("Exception raised in preset %s" % preset.name())
+                    preset.disabled = True
+                    self.playlist.disable_presets_by_class(preset.__class__.__name__)
+                    raise
+
+            self.stats.record("preset-tick", monotonic() - start)
             # If the scene tree is available, we can do efficient mixing of presets.
             # If not, a tree would need to be constructed on-the-fly.
             # TODO: Support mixing without a scene tree available
 
             if self._in_transition:
-                mixed_buffer = self.render_presets(
+                mixed_buffer, colorspace = self.render_presets(
                     active_preset, self._buffer_a,
                     next_preset, self._buffer_b,
                     self._in_transition, self._transition,
-                    self.transition_progress,
-                    check_for_nan=self._enable_profiling)
+                    self.transition_progress)
             else:
-                mixed_buffer = self.render_presets(
-                    active_preset, self._buffer_a,
-                    check_for_nan=self._enable_profiling)
+                mixed_buffer, colorspace = self.render_presets(
+                    active_preset, self._buffer_a)
+
+            if layers:
+                start = monotonic()
+                for layer in layers:
+                    if layer.enabled:
+                        self.guard_preset(layer.preset, self.get_preset_buffer(layer.preset))
+                mixed_buffer = self._layers.composite(mixed_buffer, layers, self.get_preset_buffer, colorspace)
+                colorspace = self._layers.colorspace
+                self.stats.record("composite", monotonic() - start)
 
             # render_presets writes all the desired pixels to
             # self._main_buffer.
@@ -376,14 +934,14 @@ class Mixer(QtCore.QObject):
                 #mixed_buffer.T[1] = np.power(mixed_buffer.T[1], 4)
 
             # Mod hue by 1 (to allow wrap-around) and clamp lightness and
-            # saturation to [0, 1].
-            mixed_buffer.T[0] = np.mod(mixed_buffer.T[0], 1.0)
-            np.clip(mixed_buffer.T[1], 0.0, 1.0, mixed_buffer.T[1])
-            np.clip(mixed_buffer.T[2], 0.0, 1.0, mixed_buffer.T[2])
-
-            # Write this buffer to enabled clients.
-            if self._net is not None:
-                self._net.write_buffer(mixed_buffer)
+            # saturation (or RGB) to [0, 1].  The result is written straight
+            # into a buffer owned by the output stage, which sends it to
+            # enabled clients while we render the next frame.
+            if self._output is not None:
+                start = monotonic()
+                frame = clamp_frame(mixed_buffer, colorspace, self._output.acquire())
+                self.stats.record("postprocess", monotonic() - start)
+                self._output.submit(frame, colorspace)
 
             if (not self._paused and (self._elapsed >= self._duration)
                 and active_preset.can_transition()
@@ -397,6 +955,8 @@ class Mixer(QtCore.QObject):
             elif self._in_transition:
                 if not self._transition_scrubbing and (self.transition_progress >= 1.0):
                     self._in_transition = False
+                    if self._transition is not None:
+                        self._transition.release_frame()
                     # Reset the elapsed time counter so the preset runs for the
                     # full duration after the transition
                     self._elapsed = 0.0
@@ -406,12 +966,10 @@ class Mixer(QtCore.QObject):
             self._onset = False
             self._reset_onset = False
 
-        if self._enable_profiling:
-            tick_time = (time.time() - self._last_frame_time)
-            self._last_frame_time = time.time()
-            if tick_time > 0.0:
-                index = int((1.0 / tick_time))
-                self._tick_time_data[index] = self._tick_time_data.get(index, 0) + 1
+    def _disable_layers(self, preset):
+        for layer in self._layers.layers:
+            if layer.preset is preset:
+                layer.enabled = False
 
     def scene(self):
         return self._scene
@@ -419,42 +977,124 @@ class Mixer(QtCore.QObject):
     def render_presets(self, first_preset, first_buffer,
                        second_preset=None, second_buffer=None,
                        in_transition=False, transition=None,
-                       transition_progress=0.0, check_for_nan=False):
+                       transition_progress=0.0):
         """
         Grabs the command output from a preset with the index given by first.
         If a second preset index is given, render_preset will use a Transition class to generate the output
         according to transition_progress (0.0 = 100% first, 1.0 = 100% second)
-        """
 
-        first_buffer = first_preset.get_buffer()
-        if check_for_nan:
-            for item in first_buffer.flat:
-                if math.isnan(item):
-                    raise ValueError
+        Every buffer passes through the frame guard on the way, so NaN, Inf
+        and out-of-range pixels never reach the output.
+
+        Returns the output and its colorspace.  The transition blends in the
+        presets' colorspace if they share one it supports; otherwise frames
+        are converted to one it does.
+        """
+        start = monotonic()
+        first_buffer = self.get_preset_buffer(first_preset)
+        self.guard_preset(first_preset, first_buffer)
+        colorspace = first_preset.colorspace
 
         if second_preset is not None:
-            second_buffer = second_preset.get_buffer()
-            if check_for_nan:
-                for item in second_buffer.flat:
-                    if math.isnan(item):
-                        raise ValueError
+            second_buffer = self.get_preset_buffer(second_preset)
+            self.guard_preset(second_preset, second_buffer)
+        self.stats.record("guard", monotonic() - start)
 
+        if second_preset is not None:
             if in_transition and transition is not None:
+                start = monotonic()
+                spaces = [space for space in (first_preset.colorspace, second_preset.colorspace)
+                          if space in transition.colorspaces]
+                colorspace = spaces[0] if spaces else transition.colorspaces[0]
+                first_buffer = self._convert(first_buffer, first_preset.colorspace, colorspace, 0)
+                second_buffer = self._convert(second_buffer, second_preset.colorspace, colorspace, 1)
+                transition.colorspace = colorspace
                 first_buffer = transition.get(first_buffer, second_buffer,
                                               transition_progress)
-                if check_for_nan:
-                    for item in first_buffer.flat:
-                        if math.isnan(item):
-                            raise ValueError
+                self.stats.record("transition", monotonic() - start)
+                self._guard.check("Transition %s" % transition, first_buffer)
+
+        return first_buffer, colorspace
+
+    def _convert(self, buffer, source, target, index):
+        """
+        Converts a frame to another colorspace, in the index'th conversion
+        buffer, if it is not already in it
+        """
+        if source == target:
+            return buffer
+        if self._convert_buffers[index] is None:
+            self._convert_buffers[index] = BufferUtils.acquire_buffer()
+        return convert(buffer, source, target, self._convert_buffers[index])
 
-        return first_buffer
+    def get_preset_buffer(self, preset):
+        """
+        Returns the latest frame of a preset, wherever it was rendered
+        """
+        if self._render_pool is not None:
+            buffer = self._render_pool.get_buffer(preset)
+            if buffer is not None:
+                return buffer
+        return preset.get_buffer()
+
+    def guard_preset(self, preset, buffer):
+        """
+        Repairs bad pixels in a preset's buffer, and quarantines the preset
+        once it has rendered too many bad frames.
+        """
+        if self._guard.check(preset.name(), buffer) and not preset.disabled:
+            self.playlist.quarantine_preset(preset)
+
+    def get_guard_stats(self):
+        """
+        Returns {preset or transition name: (bad frames, bad pixels)}
+        """
+        return self._guard.stats()
+
+    def add_layer(self, preset, opacity=1.0, blend_mode="overwrite", index=None):
+        """
+        Adds a preset (a Pattern or the name of a playlist preset) to the layer
+        stack, which is composited over the playlist output.  Returns the Layer,
+        whose opacity and blend mode can be changed while the mixer is running.
+        """
+        if isinstance(preset, basestring):
+            name = preset
+            preset = self.playlist.get_preset_by_name(name)
+            if preset is None:
+                raise ValueError("No preset named %s in the playlist" % name)
+        layer = Layer(preset, opacity, blend_mode)
+        self.record_event("add_layer", lambda *args: self._layers.add(layer, index),
+                          preset.name(), opacity, blend_mode, index)
+        return layer
+
+    def remove_layer(self, layer):
+        if layer in self._layers.layers:
+            # Recorded as the layer's position in the stack
+            self.record_event("remove_layer", lambda position: self._layers.remove(layer),
+                              self._layers.layers.index(layer))
+        else:
+            self._layers.remove(layer)
+
+    def clear_layers(self):
+        self._layers.clear()
+
+    def get_layers(self):
+        return list(self._layers.layers)
 
     def reset_output_buffer(self):
         """
         Clears the output buffer
         """
-        self._buffer_a = BufferUtils.create_buffer()
-        self._buffer_b = BufferUtils.create_buffer()
+        BufferUtils.release_buffer(self._buffer_a)
+        BufferUtils.release_buffer(self._buffer_b)
+        for buffer in self._convert_buffers:
+            BufferUtils.release_buffer(buffer)
+        self._convert_buffers = [None, None]
+        self._buffer_a = BufferUtils.acquire_buffer()
+        self._buffer_b = BufferUtils.acquire_buffer()
+        self._layers.reset_buffers()
+        if self._output is not None:
+            self._output.reset_buffers()
 
     def get_buffer_shape(self):
         return self._buffer_a.shape
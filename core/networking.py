@@ -16,146 +16,1064 @@
 # along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
 import sys
 import numpy as np
 import socket
-import array
 import struct
-from copy import deepcopy
+import threading
 import time
+import uuid
 import zmq
 
-from collections import defaultdict
-
-from lib.colors import hls_to_rgb
+from lib.colors import HLS, RGB, convert, hls_to_rgb
 from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
+from lib.color_lut import ColorLUT, DEFAULT_BITS
+from lib.output_driver import RGB8, HLSF32, OutputLUT
+
+log = logging.getLogger("firemix.core.networking")
+
+
+class StrandPackets:
+    """
+    Wire image of one frame in the legacy strand protocol.
+
+    All strand packets live back to back in one preallocated uint8 array,
+    each a 4-byte header ('S', strand, data length low byte, high byte)
+    followed by the strand's pixels, and `packets` holds a memoryview of each
+    one, ready for sendto.  Write the frame as 8-bit RGB into `rgb`, in the
+    client's color order (see OutputDriver.to_rgb8); fill() then builds every
+    packet with one precomputed gather.  The OPC frame (the data of all
+    strands behind a single header) is built the same way by fill_opc().
+    """
+    HEADER_SIZE = 4
+
+    def __init__(self, strands, num_pixels):
+        """
+        strands is a list of (strand, start, end) pixel extents, in the
+        order the packets are sent
+        """
+        # The gather source is the RGB frame followed by the header bytes
+        headers = []
+        for strand, start, end in strands:
+            length = (end - start) * 3
+            headers.append([ord('S'), strand, length & 0x00FF, (length & 0xFF00) >> 8])
+        opc_length = sum((end - start) * 3 for strand, start, end in strands)
+        headers.append([0x00, 0x00, (opc_length & 0xFF00) >> 8, opc_length & 0xFF])
+
+        frame_size = num_pixels * 3
+        self._source = np.zeros(frame_size + len(headers) * self.HEADER_SIZE, dtype=np.uint8)
+        self._source[frame_size:] = np.array(headers, dtype=np.uint8).ravel()
+        self.rgb = self._source[:frame_size].reshape((num_pixels, 3))
+
+        index = []
+        data_index = []
+        offsets = []
+        offset = 0
+        for i, (strand, start, end) in enumerate(strands):
+            pixels = np.arange(start * 3, end * 3, dtype=np.intp)
+            index.append(frame_size + i * self.HEADER_SIZE + np.arange(self.HEADER_SIZE, dtype=np.intp))
+            index.append(pixels)
+            data_index.append(pixels)
+            offsets.append((offset, offset + self.HEADER_SIZE + len(pixels)))
+            offset += self.HEADER_SIZE + len(pixels)
+        opc_header = frame_size + len(strands) * self.HEADER_SIZE + np.arange(self.HEADER_SIZE, dtype=np.intp)
+
+        self.strands = strands
+        self._index = np.concatenate(index) if index else np.zeros(0, dtype=np.intp)
+        self._opc_index = np.concatenate([opc_header] + data_index)
+        self._data_index = self._opc_index[self.HEADER_SIZE:]
+        self.wire = np.zeros(len(self._index), dtype=np.uint8)
+        self.opc_wire = np.zeros(len(self._opc_index), dtype=np.uint8)
+        self._offsets = offsets
+        view = memoryview(self.wire)
+        self.packets = [view[a:b] for a, b in offsets]
+        self.opc_packet = memoryview(self.opc_wire)
 
-USE_ZMQ = True
-USE_OPC = True
+    def fill(self):
+        np.take(self._source, self._index, out=self.wire)
+
+    def fill_opc(self):
+        np.take(self._source, self._opc_index, out=self.opc_wire)
+
+    def fill_data(self, out):
+        """
+        Writes the pixels of all strands back to back into out, without headers
+        """
+        np.take(self._source, self._data_index, out=out)
+
+    def snapshot(self):
+        """
+        Returns the packets as slices of one immutable copy of the wire
+        buffer, which the client senders can share while the next frame is
+        being built.  The copy is needed: a sender holds on to a frame until
+        its thread gets to it, and to the last packets it sent for comparing
+        against (see ClientSender), possibly for many frames, while the wire
+        buffer is rebuilt in place every frame.  It costs about 6 us for 150 KB.
+        """
+        view = memoryview(self.wire.tobytes())
+        return [view[a:b] for a, b in self._offsets]
+
+    def opc_snapshot(self):
+        return memoryview(self.opc_wire.tobytes())
+
+
+class DMXPackets:
+    """
+    Wire image of one frame as DMX universes, for the sACN (E1.31) and
+    Art-Net drivers.
+
+    Each universe packet is one row of a preallocated uint8 array whose
+    protocol header is written once.  Write the frame as 8-bit RGB into
+    `rgb`; fill() then sets the 512 channels of every universe with one
+    precomputed gather.  Channels no strand is mapped to stay at zero.  The
+    per-packet sequence number is left to the sender.
+    """
+    CHANNELS = 512
+    PIXELS_PER_UNIVERSE = CHANNELS // 3
+    SACN_HEADER_SIZE = 126
+    SACN_SEQUENCE_OFFSET = 111
+    ARTNET_HEADER_SIZE = 18
+    ARTNET_SEQUENCE_OFFSET = 12
+    # Identifies this machine as an sACN source across restarts
+    SACN_CID = uuid.uuid3(uuid.NAMESPACE_DNS, "firemix." + socket.gethostname()).bytes
+
+    def __init__(self, protocol, spans, num_pixels, priority=100):
+        """
+        spans is a list of (start, end, universe, channel): the pixels from
+        start to end are written from the (1-based) channel of the universe
+        on, moving on to channel 1 of the next universe when one is full
+        (a pixel never straddles two universes)
+        """
+        self.protocol = protocol
+        frame_size = num_pixels * 3
+        # The gather source is the RGB frame followed by a zero byte
+        self._source = np.zeros(frame_size + 1, dtype=np.uint8)
+        self.rgb = self._source[:frame_size].reshape((num_pixels, 3))
+
+        placed = []
+        for start, end, universe, channel in spans:
+            k = np.arange(end - start, dtype=np.intp)
+            first = (self.CHANNELS - (channel - 1)) // 3
+            overflow = np.maximum(k - first, 0)
+            in_first = k < first
+            universes = np.where(in_first, universe, universe + 1 + overflow // self.PIXELS_PER_UNIVERSE)
+            channels = np.where(in_first, channel - 1 + 3 * k, 3 * (overflow % self.PIXELS_PER_UNIVERSE))
+            placed.append((start + k, universes, channels))
+
+        self.universes = sorted(set(u for _, universes, _ in placed for u in universes.tolist()))
+        rows = dict((u, i) for i, u in enumerate(self.universes))
+        self._index = np.empty((len(self.universes), self.CHANNELS), dtype=np.intp)
+        self._index.fill(frame_size)
+        for pixels, universes, channels in placed:
+            row = np.array([rows[u] for u in universes.tolist()], dtype=np.intp)
+            for c in xrange(3):
+                self._index[row, channels + c] = pixels * 3 + c
+
+        if protocol == "sACN":
+            header_size = self.SACN_HEADER_SIZE
+            self.sequence_offset = self.SACN_SEQUENCE_OFFSET
+            headers = [self._sacn_header(u, priority) for u in self.universes]
+        else:
+            header_size = self.ARTNET_HEADER_SIZE
+            self.sequence_offset = self.ARTNET_SEQUENCE_OFFSET
+            headers = [self._artnet_header(u) for u in self.universes]
+        self.packet_size = header_size + self.CHANNELS
+        self.wire = np.zeros((len(self.universes), self.packet_size), dtype=np.uint8)
+        if headers:
+            self.wire[:, :header_size] = np.frombuffer("".join(headers), dtype=np.uint8).reshape((-1, header_size))
+        self._data = self.wire[:, header_size:]
+
+    def _sacn_header(self, universe, priority):
+        length = self.SACN_HEADER_SIZE + self.CHANNELS
+        return "".join([
+            # Root layer
+            struct.pack(">HH12sHI", 0x0010, 0x0000, "ASC-E1.17", 0x7000 | (length - 16), 0x00000004),
+            self.SACN_CID,
+            # Framing layer
+            struct.pack(">HI64sBHBBH", 0x7000 | (length - 38), 0x00000002, "FireMix", priority, 0, 0, 0, universe),
+            # DMP layer, with the DMX start code
+            struct.pack(">HBBHHHB", 0x7000 | (length - 115), 0x02, 0xa1, 0x0000, 0x0001, self.CHANNELS + 1, 0),
+        ])
+
+    def _artnet_header(self, universe):
+        return struct.pack("<8sH", "Art-Net", 0x5000) + struct.pack(
+            ">HBBBBH", 14, 0, 0, universe & 0xff, (universe >> 8) & 0x7f, self.CHANNELS)
+
+    def fill(self):
+        np.take(self._source, self._index, out=self._data, mode='clip')
+
+    def snapshot(self):
+        return self.wire.tobytes()
+
+
+def universe_spans(client, strands):
+    """
+    Returns the (start, end, universe, channel) spans of a DMX client.  The
+    client's "universes" list maps strands to a universe and an optional
+    start channel, e.g. {"strand": 0, "universe": 1, "channel": 1};
+    without it, each strand starts a new universe, counting up from
+    "start-universe".
+    """
+    extents = dict((strand, (start, end)) for strand, start, end in strands)
+    spans = []
+    if "universes" in client:
+        for entry in client["universes"]:
+            if entry["strand"] in extents:
+                start, end = extents[entry["strand"]]
+                spans.append((start, end, entry["universe"], entry.get("channel", 1)))
+    else:
+        universe = client.get("start-universe", 1 if client["protocol"] == "sACN" else 0)
+        for strand, start, end in strands:
+            spans.append((start, end, universe, 1))
+            universe += max(1, -(-(end - start) // DMXPackets.PIXELS_PER_UNIVERSE))
+    return spans
+
+
+# Frame message published on the ZMQ socket: this header, then a
+# (strand, first pixel) pair for each strand, then the strands' 8-bit RGB
+# pixels back to back.  All fields are little-endian.
+ZMQ_FRAME_MAGIC = "FMXZ"
+ZMQ_FRAME_VERSION = 1
+ZMQ_FRAME_HEADER = struct.Struct("<4sHHQdII")  # magic, version, header size, frame, time, pixels, strands
+ZMQ_FRAME_STRAND = struct.Struct("<II")
+
+
+class ZMQPublisher:
+    """
+    Publishes every frame as a single ZMQ message, sent with copy=False
+    straight from a numpy buffer: the header is written in place and the
+    pixels are gathered by StrandPackets.fill_data.  A buffer is only
+    reused once ZMQ has let go of it.  See decode_frame for the other end.
+    """
+
+    def __init__(self, socket):
+        self._socket = socket
+        self._packets = None
+        self._template = None
+        self._buffers = []
+        self.frame_number = 0
+
+    def _set_layout(self, packets):
+        self._packets = packets
+        pixels = sum(end - start for strand, start, end in packets.strands)
+        header_size = ZMQ_FRAME_HEADER.size + ZMQ_FRAME_STRAND.size * len(packets.strands)
+        header = [ZMQ_FRAME_HEADER.pack(ZMQ_FRAME_MAGIC, ZMQ_FRAME_VERSION, header_size, 0, 0.0, pixels,
+                                        len(packets.strands))]
+        offset = 0
+        for strand, start, end in packets.strands:
+            header.append(ZMQ_FRAME_STRAND.pack(strand, offset))
+            offset += end - start
+        self._template = np.frombuffer("".join(header), dtype=np.uint8)
+        self._buffers = []
+
+    # Buffers still held by ZMQ beyond this many are left to it
+    MAX_BUFFERS = 8
+
+    def _get_buffer(self):
+        for i, (buffer, tracker) in enumerate(self._buffers):
+            if tracker.done:
+                del self._buffers[i]
+                return buffer
+        if len(self._buffers) >= self.MAX_BUFFERS:
+            del self._buffers[0]
+        buffer = np.empty(len(self._template) + len(self._packets.opc_wire) - StrandPackets.HEADER_SIZE,
+                          dtype=np.uint8)
+        buffer[:len(self._template)] = self._template
+        return buffer
+
+    def publish(self, packets):
+        """
+        Publishes the current frame of packets (a StrandPackets)
+        """
+        if packets is not self._packets:
+            self._set_layout(packets)
+        buffer = self._get_buffer()
+        self.frame_number += 1
+        struct.pack_into("<Qd", buffer, 8, self.frame_number, time.time())
+        packets.fill_data(buffer[len(self._template):])
+        tracker = self._socket.send(buffer, copy=False, track=True)
+        self._buffers.append((buffer, tracker))
+
+
+def decode_frame(message):
+    """
+    Decodes a frame published by ZMQPublisher (a string or a zmq.Frame,
+    which is not copied).  Returns (frame number, timestamp, strands, rgb),
+    where strands is a list of (strand, start, end) pixel ranges of rgb, an
+    (N, 3) uint8 array.  Raises ValueError if the message is not a frame of
+    a known version.
+    """
+    if len(message) < ZMQ_FRAME_HEADER.size:
+        raise ValueError("Frame message too short")
+    magic, version, header_size, frame_number, timestamp, pixels, num_strands = \
+        ZMQ_FRAME_HEADER.unpack_from(message)
+    if magic != ZMQ_FRAME_MAGIC or version != ZMQ_FRAME_VERSION:
+        raise ValueError("Not a version %d frame message" % ZMQ_FRAME_VERSION)
+    if len(message) != header_size + pixels * 3:
+        raise ValueError("Frame message has the wrong size")
+    offsets = [ZMQ_FRAME_STRAND.unpack_from(message, ZMQ_FRAME_HEADER.size + i * ZMQ_FRAME_STRAND.size)
+               for i in xrange(num_strands)]
+    ends = [offset for strand, offset in offsets[1:]] + [pixels]
+    strands = [(strand, offset, end) for (strand, offset), end in zip(offsets, ends)]
+    rgb = np.frombuffer(message, dtype=np.uint8, count=pixels * 3, offset=header_size).reshape((pixels, 3))
+    return frame_number, timestamp, strands, rgb
+
+
+def frame_subscriber(context, address):
+    """
+    Returns a SUB socket connected to a FireMix frame publisher that only
+    ever holds the newest frame, so a slow viewer never falls behind
+    """
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 1)
+    subscriber.setsockopt(zmq.CONFLATE, 1)
+    subscriber.setsockopt(zmq.SUBSCRIBE, "")
+    subscriber.connect(address)
+    return subscriber
+
+
+class TokenBucket:
+    """
+    Paces a sender to `rate` units (packets or bytes) per second, allowing
+    bursts of up to `burst` units.  A rate of zero or None means no limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = self.burst
+        self._last = monotonic()
+
+    def delay(self, amount):
+        """
+        Takes `amount` units from the bucket.  Returns 0 if they are
+        available, otherwise how long to wait before trying again.
+        """
+        if not self.rate:
+            return 0.0
+        now = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        # An amount larger than the burst goes out once the bucket is full
+        if self._tokens >= min(amount, self.burst):
+            self._tokens -= amount
+            return 0.0
+        return (min(amount, self.burst) - self._tokens) / self.rate
+
+
+class ClientSender(threading.Thread):
+    """
+    Sends frames to one UDP client from its own thread and non-blocking
+    socket, paced by a token bucket in packets and/or bytes per second.
+
+    The output thread hands over each frame with send_frame(), which never
+    blocks.  A frame is always sent whole; if more frames arrive while one is
+    being sent, only the newest is kept, so a slow or unreachable controller
+    just gets fewer frames and never delays rendering or the other clients.
+
+    With a keyframe interval set, a strand packet that is identical to the
+    last one this client actually received is not sent again, except in
+    every keyframe_interval-th frame, which is sent in full.
+    """
+    # How long to wait for a full socket buffer to drain before dropping a packet
+    SEND_TIMEOUT = 0.005
+    # How often to retry a host name that does not resolve
+    RESOLVE_INTERVAL = 5.0
+
+    def __init__(self, host, port, packets_per_second=None, bytes_per_second=None, keyframe_interval=0):
+        threading.Thread.__init__(self, name="ClientSender-%s:%d" % (host, port))
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self._address = None
+        self._socket = self._open_socket()
+        self._packet_bucket = TokenBucket(packets_per_second)
+        self._byte_bucket = TokenBucket(bytes_per_second, 65536)
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._frame = None
+        self._last_sent = []
+        self._frames_since_keyframe = 0
+        self.keyframe_interval = keyframe_interval
+
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.frames_dropped = 0
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.bytes_sent = 0
+        self.packets_saved = 0
+        self.bytes_saved = 0
+        self.keyframes = 0
+        self.errors = 0
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setblocking(0)
+        return sock
+
+    def set_rate(self, packets_per_second=None, bytes_per_second=None):
+        self._packet_bucket.rate = packets_per_second
+        self._byte_bucket.rate = bytes_per_second
+
+    def send_frame(self, header, packets, trailer):
+        """
+        Queues a frame for sending, replacing a queued frame that has not
+        been started yet.  The header and trailer packets are always sent;
+        packets are the strand packets, which may be skipped when unchanged.
+        None of them may change after this call.
+        """
+        self._queue((header, packets, trailer))
+
+    def _queue(self, frame):
+        with self._condition:
+            if self._frame is not None:
+                self.frames_skipped += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def stats(self):
+        return {
+            "frames-sent": self.frames_sent,
+            "frames-skipped": self.frames_skipped,
+            "frames-dropped": self.frames_dropped,
+            "packets-sent": self.packets_sent,
+            "packets-dropped": self.packets_dropped,
+            "bytes-sent": self.bytes_sent,
+            "packets-saved": self.packets_saved,
+            "bytes-saved": self.bytes_saved,
+            "keyframes": self.keyframes,
+            "errors": self.errors,
+        }
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._condition:
+                while self._frame is None and not self._stop_event.is_set():
+                    self._condition.wait()
+                frame, self._frame = self._frame, None
+            if frame is None:
+                break
+
+            if self._address is None and not self._resolve():
+                continue
+
+            if self._send_frame(*frame):
+                self.frames_sent += 1
+
+        self._socket.close()
+
+    def _send_frame(self, header, packets, trailer):
+        """
+        Returns False if the frame was abandoned
+        """
+        if len(self._last_sent) != len(packets):
+            self._last_sent = [None] * len(packets)
+            self._frames_since_keyframe = 0
+        keyframe = self._frames_since_keyframe == 0
+        if self.keyframe_interval > 0:
+            if keyframe:
+                self.keyframes += 1
+            self._frames_since_keyframe = (self._frames_since_keyframe + 1) % self.keyframe_interval
+
+        for packet in header:
+            if self._send(packet) == self._FAILED:
+                return False
+
+        for i, packet in enumerate(packets):
+            if not keyframe and packet == self._last_sent[i]:
+                self.packets_saved += 1
+                self.bytes_saved += len(packet)
+                continue
+            result = self._send(packet)
+            if result == self._FAILED:
+                return False
+            # A dropped packet is compared against what the client last got,
+            # so it goes out again next frame
+            if result == self._SENT:
+                self._last_sent[i] = packet
+
+        for packet in trailer:
+            if self._send(packet) == self._FAILED:
+                return False
+        return True
+
+    def _resolve(self):
+        try:
+            self._address = (socket.gethostbyname(self.host), self.port)
+            return True
+        except socket.error as e:
+            self.errors += 1
+            log.error("Could not resolve client %s: %s" % (self.host, e))
+            self._stop_event.wait(self.RESOLVE_INTERVAL)
+            return False
+
+    _SENT, _DROPPED, _FAILED = range(3)
+
+    def _send(self, packet):
+        """
+        Sends one packet once the buckets allow it.  Returns _SENT, _DROPPED
+        if the socket buffer stayed full, or _FAILED if the rest of the
+        frame should be abandoned.
+        """
+        size = len(packet)
+        delay = max(self._packet_bucket.delay(1), self._byte_bucket.delay(size))
+        while delay > 0.0:
+            if self._stop_event.wait(delay):
+                return self._FAILED
+            delay = max(self._packet_bucket.delay(1), self._byte_bucket.delay(size))
+
+        result = self._transmit(packet)
+        if result == self._SENT:
+            self.packets_sent += 1
+            self.bytes_sent += size
+        elif result == self._DROPPED:
+            self.packets_dropped += 1
+        return result
+
+    def _transmit(self, packet):
+        for attempt in (0, 1):
+            try:
+                self._socket.sendto(packet, self._address)
+                return self._SENT
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    # e.g. the host is unreachable; try again next frame
+                    self.errors += 1
+                    if self.errors == 1:
+                        log.error("Error sending to client %s:%d: %s" % (self.host, self.port, e))
+                    return self._FAILED
+                if attempt == 0:
+                    select.select([], [self._socket], [], self.SEND_TIMEOUT)
+        return self._DROPPED
+
+
+class OPCSender(ClientSender):
+    """
+    Sends frames to an Open Pixel Control server (fcserver, LEDscape...)
+    over one persistent TCP connection with TCP_NODELAY.
+
+    The connection is made from the sender thread without blocking the
+    output; while it is down, frames are dropped and it is retried with
+    exponential backoff.  A frame that finds the kernel send buffer full is
+    dropped, but once part of a frame is written the rest always follows
+    (or the connection is reset), so the server never loses sync.
+    """
+    CONNECT_TIMEOUT = 1.0
+    # How long a started frame may wait for the server before reconnecting
+    STALL_TIMEOUT = 1.0
+    MIN_BACKOFF = 0.1
+    MAX_BACKOFF = 5.0
+
+    def __init__(self, host, port, packets_per_second=None, bytes_per_second=None, keyframe_interval=0):
+        ClientSender.__init__(self, host, port, packets_per_second, bytes_per_second, keyframe_interval)
+        self.name = "OPCSender-%s:%d" % (host, port)
+        self._backoff = self.MIN_BACKOFF
+        self._next_connect = 0.0
+        self.connects = 0
+
+    def _open_socket(self):
+        # Connected on the sender thread
+        return None
+
+    def connected(self):
+        return self._socket is not None
+
+    def stats(self):
+        stats = ClientSender.stats(self)
+        stats["connected"] = self.connected()
+        stats["connects"] = self.connects
+        return stats
+
+    def run(self):
+        ClientSender.run(self)
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _send_frame(self, header, packets, trailer):
+        if self._socket is None and not self._connect():
+            self.frames_dropped += 1
+            return False
+        return ClientSender._send_frame(self, header, packets, trailer)
+
+    def _connect(self):
+        now = monotonic()
+        if now < self._next_connect:
+            return False
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setblocking(0)
+        error = sock.connect_ex(self._address)
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            _, writable, _ = select.select([], [sock], [], self.CONNECT_TIMEOUT)
+            if writable:
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            else:
+                error = errno.ETIMEDOUT
+
+        if error:
+            sock.close()
+            self.errors += 1
+            if self._backoff == self.MIN_BACKOFF:
+                log.error("Could not connect to OPC server %s:%d: %s" % (self.host, self.port, os.strerror(error)))
+            self._next_connect = monotonic() + self._backoff
+            self._backoff = min(self.MAX_BACKOFF, self._backoff * 2)
+            return False
+
+        log.info("Connected to OPC server %s:%d" % (self.host, self.port))
+        self._socket = sock
+        self._backoff = self.MIN_BACKOFF
+        self._last_sent = []
+        self.connects += 1
+        return True
+
+    def _disconnect(self, reason):
+        log.error("Lost connection to OPC server %s:%d: %s" % (self.host, self.port, reason))
+        self.errors += 1
+        self._socket.close()
+        self._socket = None
+        self._next_connect = monotonic() + self._backoff
+
+    def _transmit(self, packet):
+        try:
+            sent = self._socket.send(packet)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                return self._DROPPED
+            self._disconnect(e)
+            return self._FAILED
+
+        deadline = monotonic() + self.STALL_TIMEOUT
+        while sent < len(packet):
+            if self._stop_event.is_set():
+                self._disconnect("stopped in the middle of a frame")
+                return self._FAILED
+            remaining = deadline - monotonic()
+            if remaining <= 0.0:
+                self._disconnect("server stalled")
+                return self._FAILED
+            select.select([], [self._socket], [], min(remaining, 0.1))
+            try:
+                sent += self._socket.send(packet[sent:])
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self._disconnect(e)
+                    return self._FAILED
+        return self._SENT
+
+
+# sendmmsg(2) sends a whole frame of universes in one system call.  The
+# structures below are the Linux layouts; elsewhere the DMX sender falls
+# back to one sendto per packet.
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+# struct sockaddr_in, filled in from struct.pack
+_sockaddr_in = ctypes.c_char * 16
+
+
+_sendmmsg = None
+if sys.platform.startswith("linux"):
+    try:
+        _sendmmsg = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).sendmmsg
+        _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        _sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        pass
+
+
+class DMXSender(ClientSender):
+    """
+    Sends the universes built by DMXPackets to one sACN or Art-Net client,
+    all of a frame's packets in one sendmmsg call where the platform has
+    it.  With multicast set, each sACN universe goes to its own multicast
+    group (239.255.<universe high byte>.<universe low byte>) instead of the
+    client's address.  Every universe is sent every frame, as DMX receivers
+    expect; keyframe_interval does not apply.
+    """
+
+    def __init__(self, host, port, packets_per_second=None, bytes_per_second=None, multicast=False):
+        ClientSender.__init__(self, host, port, packets_per_second, bytes_per_second)
+        self.name = "DMXSender-%s:%d" % (host, port)
+        self.multicast = multicast
+        self._layout = None
+        self._sequence = 0
+        self.batched = _sendmmsg is not None
+
+    def send_universes(self, layout, data):
+        """
+        Queues a frame: data is a snapshot of the wire of `layout` (a
+        DMXPackets), which must not change after this call
+        """
+        self._queue((layout, data))
+
+    def _set_layout(self, layout):
+        self._layout = layout
+        count = len(layout.universes)
+        size = layout.packet_size
+        self._outbox = bytearray(count * size)
+        self._rows = np.frombuffer(self._outbox, dtype=np.uint8).reshape((count, size))
+        view = memoryview(self._outbox)
+        self._views = [view[i * size:(i + 1) * size] for i in xrange(count)]
+        if self.multicast:
+            self._addresses = [("239.255.%d.%d" % (u >> 8, u & 0xff), self.port) for u in layout.universes]
+        else:
+            self._addresses = [self._address] * count
+
+        if self.batched:
+            self._names = (_sockaddr_in * count)()
+            self._iovecs = (_iovec * count)()
+            self._messages = (_mmsghdr * count)()
+            base = self._rows.ctypes.data
+            for i, (host, port) in enumerate(self._addresses):
+                address = struct.pack("=H", socket.AF_INET) + struct.pack(">H", port) + socket.inet_aton(host)
+                ctypes.memmove(ctypes.addressof(self._names[i]), address, len(address))
+                self._iovecs[i].iov_base = base + i * size
+                self._iovecs[i].iov_len = size
+                header = self._messages[i].msg_hdr
+                header.msg_name = ctypes.addressof(self._names[i])
+                header.msg_namelen = ctypes.sizeof(_sockaddr_in)
+                header.msg_iov = ctypes.pointer(self._iovecs[i])
+                header.msg_iovlen = 1
+
+    def _send_frame(self, layout, data):
+        if layout is not self._layout:
+            self._set_layout(layout)
+        count = len(layout.universes)
+        delay = max(self._packet_bucket.delay(count), self._byte_bucket.delay(len(data)))
+        while delay > 0.0:
+            if self._stop_event.wait(delay):
+                return False
+            delay = max(self._packet_bucket.delay(count), self._byte_bucket.delay(len(data)))
+
+        self._outbox[:] = data
+        self._sequence = self._sequence % 255 + 1
+        self._rows[:, layout.sequence_offset] = self._sequence
+
+        sent = 0
+        waited = False
+        while sent < count:
+            try:
+                sent += self._send_packets(sent, count)
+                continue
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    self.errors += 1
+                    if self.errors == 1:
+                        log.error("Error sending to client %s:%d: %s" % (self.host, self.port, e))
+                    break
+            if waited:
+                break
+            waited = True
+            select.select([], [self._socket], [], self.SEND_TIMEOUT)
+
+        self.packets_sent += sent
+        self.bytes_sent += sent * layout.packet_size
+        self.packets_dropped += count - sent
+        return sent > 0
+
+    def _send_packets(self, start, end):
+        """
+        Sends packets start to end, returning how many went out.  Raises
+        socket.error if none did.
+        """
+        if self.batched:
+            sent = _sendmmsg(self._socket.fileno(),
+                             ctypes.addressof(self._messages) + start * ctypes.sizeof(_mmsghdr), end - start, 0)
+            if sent < 0:
+                error = ctypes.get_errno()
+                raise socket.error(error, os.strerror(error))
+            return sent
+        for i in xrange(start, end):
+            try:
+                self._socket.sendto(self._views[i], self._addresses[i])
+            except socket.error:
+                if i == start:
+                    raise
+                return i - start
+        return end - start
 
 
 class Networking:
+    """
+    Sends the mixer output to the configured clients through the output
+    driver plugins (see lib/output_driver.py), one driver per client.
+    """
 
     def __init__(self, app):
-        self.socket = None
-        self.context = None
         self._app = app
         self.running = True
-        self.open_socket()
-        self._packet_cache = {}
-        self.port = 3020
-        self.opc_port = 7890
+        self._drivers = {}
+        self._driver_classes = None
+        self._unknown_protocols = set()
+        self._strands = None
+        self._strands_key = None
+        self._rgb = None
+        self._hls = None
+        self._rgb16 = None
+        self._rgb16_previous = None
+        self._frame_times = (None, None)
+        self._blend_buffers = []
+        self._blend_scratch = None
+        self._hls_dimmed = None
+        self._color_lut = None
+        self._color_lut_bits = None
+        self._get_color_lut()
 
-    def open_socket(self):
-        if USE_ZMQ:
-            self.context = zmq.Context()
-            self.zmq_socket = self.context.socket(zmq.PUB)
-            self.zmq_socket.bind("tcp://*:3020")
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    def _get_color_lut(self):
+        """
+        Returns the ColorLUT RGB8 clients are converted with, building it
+        when color LUT mode is turned on or its bits change, or None when
+        the mode is off
+        """
+        settings = self._app.settings['networking']
+        bits = tuple(settings.get('color-lut-bits', DEFAULT_BITS)) if settings.get('color-lut', False) else None
+        if bits != self._color_lut_bits:
+            self._color_lut_bits = bits
+            self._color_lut = None
+            if bits is not None:
+                try:
+                    self._color_lut = ColorLUT(bits, os.path.join(os.getcwd(), "data", "cache"))
+                except ValueError as e:
+                    log.error("Color LUT mode disabled: %s" % e)
+        return self._color_lut
 
-    def write_buffer(self, buffer):
+    def write_buffer(self, buffer, frame_time=None, colorspace=HLS):
         """
         Performs a bulk strand write.
-        Decodes the HLS-Float data according to client settings
+        Converts the HLS-Float (or RGB-Float) data once to each color format the client drivers need,
+        for the clients that are due a frame (see OutputDriver.frame_due).
+        frame_time is when the mixer rendered the frame (by default, now).
         """
+        if frame_time is None:
+            frame_time = monotonic()
         strand_settings = self._app.scene.get_strand_settings()
-        clients = [client for client in self._app.settings['networking']['clients'] if client["enabled"]]
-
-        clients_by_type = defaultdict(list)
-        have_non_dimmed = False
-        for c in clients:
-            clients_by_type[c.get("protocol", "Legacy")].append(c)
-            have_non_dimmed = c.get("ignore-dimming", False) if not have_non_dimmed else True
-
-        have_zmq_clients = bool(clients_by_type.get("ZMQ", []))
-        legacy_clients = clients_by_type["Legacy"]
-        opc_clients = clients_by_type["OPC"]
-
-        # Apply the global dimmer from the mixer.
-        # TODO: this is stupid.  Should just pass the global dimmer as metadata to the clients
-        if have_non_dimmed:
-            non_dimmed_buffer = deepcopy(buffer)
-
-        if self._app.mixer.global_dimmer < 1.0:
-            buffer.T[1] *= self._app.mixer.global_dimmer
-
-        # Protect against presets or transitions that write float data.
-        buffer_rgb = np.int_(hls_to_rgb(buffer) * 255)
-        np.clip(buffer_rgb, 0, 255, buffer_rgb)
-
-        if have_non_dimmed:
-            non_dimmed_buffer_rgb = np.int_(hls_to_rgb(non_dimmed_buffer) * 255)
-            np.clip(non_dimmed_buffer_rgb, 0, 255, non_dimmed_buffer_rgb)
-
-        def fill_packet(intbuffer, start, end, offset, packet, swap_order=False):
-            for pixel_index, pixel in enumerate(intbuffer[start:end]):
-                buffer_index = offset + pixel_index * 3
-                if swap_order:
-                    packet[buffer_index] = pixel[2]
-                    packet[buffer_index + 1] = pixel[1]
-                    packet[buffer_index + 2] = pixel[0]
-                else:
-                    packet[buffer_index] = pixel[0]
-                    packet[buffer_index + 1] = pixel[1]
-                    packet[buffer_index + 2] = pixel[2]
-
-        packets = []
-        non_dimmed_packets = []
-
-        for strand in xrange(len(strand_settings)):
-            if not strand_settings[strand]["enabled"]:
-                continue
+        drivers = []
+        for client in self._app.settings['networking']['clients']:
+            if client["enabled"]:
+                driver = self._get_driver(client)
+                if driver is not None:
+                    drivers.append(driver)
+        self._stop_unused_drivers(drivers)
+        if not drivers:
+            return
+        strands = self._get_strands(strand_settings)
 
-            start, end = BufferUtils.get_strand_extents(strand)
+        # Blending clients need every frame quantized, to blend with the next
+        blending = any(driver.blends() for driver in drivers)
+        due = []
+        for driver in drivers:
+            scheduled = driver.frame_due(frame_time)
+            if scheduled is not None:
+                due.append((driver, scheduled))
+        if not due and not blending:
+            return
 
-            packet_header_size = 4
-            packet_size = (end-start) * 3 + packet_header_size
+        dimmer = self._app.mixer.global_dimmer
+        for driver, scheduled in due:
+            driver.set_dimmer(dimmer)
 
-            try:
-                packet = self._packet_cache[packet_size]
-            except KeyError:
-                packet = [0,] * packet_size
-                self._packet_cache[packet_size] = packet
-
-            length = packet_size - packet_header_size
-
-            packet[0] = ord('S')
-            packet[1] = strand
-            packet[2] = length & 0x00FF
-            packet[3] = (length & 0xFF00) >> 8
-
-            fill_packet(buffer_rgb, start, end, packet_header_size, packet, False)
-            packets.append(array.array('B', packet))
-
-            if have_non_dimmed:
-                fill_packet(non_dimmed_buffer_rgb, start, end, packet_header_size, packet, False)
-                non_dimmed_packets.append(array.array('B', packet))
-
-        if USE_ZMQ and have_zmq_clients:
-            frame = ["B"] + packets + ["E"]
-            self.socket.send_multipart(frame)
-
-        for client in legacy_clients:
-            self.socket.sendto(array.array('B', [ord('B')]), (client["host"], client["port"]))
-            for packet in (non_dimmed_packets if client.get("ignore-dimming", False) else packets):
-                self.socket.sendto(packet, (client["host"], client["port"]))
-                time.sleep(0.001)
-            self.socket.sendto(array.array('B', [ord('E')]), (client["host"], client["port"]))
-
-        for client in opc_clients:
-            # TODO: This is hacky, but for now we re-write the packet for OPC here...
-            # Fortunately, OPC happens to look a lot like our existing protocol...
-            # Byte 0 is channel (aka strand).  0 is broadcast address, indexing starts at 1.
-            # Byte 1 is command, always 0 for "set pixel colors"
-            # Bytes 2 and 3 are big-endian length of the data block.
-            # Note: LEDScape needs the strands all concatenated together which is annoying
-            packet[0] = packet[1] + 1
-            tpacket = [0x00, 0x00, 0x00, 0x00]
-            for packet in packets:
-                tpacket += packet[4:]
-            tlen = len(tpacket) - 4
-            tpacket[2] = (tlen & 0xFF00) >> 8
-            tpacket[3] = (tlen & 0xFF)
-            tpacket = array.array('B', tpacket)
-            self.socket.sendto(tpacket, (client["host"], client["port"]))
+        stats = self._app.mixer.stats
+        stage_start = monotonic()
+
+        # The dimmer is applied by each client's output LUT, or for drivers
+        # that want the HLS frame, to a copy of it.  In color LUT mode, RGB8
+        # clients that do not blend get an IndexedFrame instead.
+        color_lut = self._get_color_lut() if colorspace == HLS else None
+        keys = [self._frame_key(driver, dimmer, color_lut) for driver, scheduled in due]
+        needed = set(keys)
+        if blending:
+            needed.add((RGB8, False))
+        frames = {}
+        hls = buffer
+        if colorspace == RGB and any(key[0] == HLSF32 for key in needed):
+            if self._hls is None or self._hls.shape != buffer.shape:
+                self._hls = np.empty_like(buffer)
+            hls = convert(buffer, RGB, HLS, self._hls)
+        for key in needed:
+            if key == (RGB8, True):
+                frames[key] = color_lut.frame(buffer)
+            elif key[0] == RGB8:
+                frames[key] = self._quantize(buffer, frame_time, colorspace)
+            elif key[1]:
+                if self._hls_dimmed is None or self._hls_dimmed.shape != hls.shape:
+                    self._hls_dimmed = np.empty_like(hls)
+                np.copyto(self._hls_dimmed, hls)
+                self._hls_dimmed.T[1] *= dimmer
+                frames[key] = self._hls_dimmed
+            else:
+                frames[key] = hls
+
+        stats.record("hls-to-rgb", monotonic() - stage_start)
+        stage_start = monotonic()
+
+        # Clients with the same schedule share their blended frame
+        blended = {}
+        for (driver, scheduled), key in zip(due, keys):
+            frame = frames[key]
+            if scheduled < frame_time and driver.blends():
+                if scheduled not in blended:
+                    blended[scheduled] = self._blend(scheduled, len(blended))
+                frame = blended[scheduled]
+            driver.write(frame, strands)
+
+        stats.record("packet-assembly", monotonic() - stage_start)
+        stage_start = monotonic()
+
+        for driver, scheduled in due:
+            driver.send()
+
+        stats.record("socket-send", monotonic() - stage_start)
+
+    def _frame_key(self, driver, dimmer, color_lut):
+        """
+        Returns which frame a driver is given: its color format, and whether
+        it is the dimmed copy of the HLS frame (HLSF32) or an IndexedFrame
+        (RGB8)
+        """
+        if driver.color_format == HLSF32:
+            return (HLSF32, driver.dimmed() and dimmer < 1.0)
+        return (driver.color_format, color_lut is not None and not driver.blends())
+
+    def _quantize(self, buffer, frame_time, colorspace=HLS):
+        """
+        Converts an HLS (or RGB) frame to RGB quantized to 16 bits per
+        channel.  The previous frame is kept for _blend().
+        """
+        if self._rgb is None or self._rgb.shape != buffer.shape:
+            self._rgb = np.empty(buffer.shape, dtype=np.float32)
+        if colorspace == RGB:
+            rgb = np.multiply(buffer, OutputLUT.LEVELS - 1, self._rgb)
+        else:
+            rgb = hls_to_rgb(buffer, self._rgb)
+            rgb *= OutputLUT.LEVELS - 1
+        # Protect against presets or transitions that write float data
+        np.clip(rgb, 0, OutputLUT.LEVELS - 1, rgb)
+        if self._rgb16 is None or self._rgb16.shape != rgb.shape:
+            self._rgb16 = np.empty(rgb.shape, dtype=np.uint16)
+            self._rgb16_previous = np.empty(rgb.shape, dtype=np.uint16)
+            self._frame_times = (None, None)
+        self._rgb16, self._rgb16_previous = self._rgb16_previous, self._rgb16
+        self._frame_times = (self._frame_times[1], frame_time)
+        np.copyto(self._rgb16, rgb, casting='unsafe')
+        return self._rgb16
+
+    def _blend(self, time, index):
+        """
+        Returns the quantized frame at a time between the last two frames,
+        blended linearly from them, in the index'th blend buffer
+        """
+        previous_time, frame_time = self._frame_times
+        if previous_time is None or frame_time <= previous_time:
+            return self._rgb16
+        weight = min(max((time - previous_time) / (frame_time - previous_time), 0.0), 1.0)
+        while len(self._blend_buffers) <= index:
+            self._blend_buffers.append(None)
+        if self._blend_buffers[index] is None or self._blend_buffers[index].shape != self._rgb16.shape:
+            self._blend_buffers[index] = np.empty(self._rgb16.shape, dtype=np.uint16)
+        if self._blend_scratch is None or self._blend_scratch.shape != self._rgb16.shape:
+            self._blend_scratch = np.empty(self._rgb16.shape, dtype=np.float32)
+        scratch = self._blend_scratch
+        np.subtract(self._rgb16, self._rgb16_previous, out=scratch, dtype=np.float32)
+        scratch *= weight
+        scratch += self._rgb16_previous
+        np.copyto(self._blend_buffers[index], scratch, casting='unsafe')
+        return self._blend_buffers[index]
+
+    def _get_driver_class(self, protocol):
+        if self._driver_classes is None:
+            self._driver_classes = {}
+            for driver_class in self._app.plugins.get('OutputDriver'):
+                for name in driver_class.protocols:
+                    self._driver_classes[name] = driver_class
+        return self._driver_classes.get(protocol)
+
+    def _get_driver(self, client):
+        """
+        Returns the driver for a client, starting it on first use and
+        recreating it if it was stopped or cannot apply new settings
+        """
+        client = dict(client)
+        client.setdefault("protocol", "Legacy")
+        key = (client["protocol"], client["host"], client["port"])
+        driver = self._drivers.get(key)
+        if driver is not None and not driver.stopped():
+            if driver.client == client or driver.update(client):
+                return driver
+            driver.stop()
+
+        driver_class = self._get_driver_class(client["protocol"])
+        if driver_class is None:
+            if client["protocol"] not in self._unknown_protocols:
+                self._unknown_protocols.add(client["protocol"])
+                log.error("No output driver for protocol %s" % client["protocol"])
+            return None
+        driver = driver_class(client)
+        driver.start()
+        self._drivers[key] = driver
+        return driver
+
+    def _stop_unused_drivers(self, drivers):
+        for key, driver in self._drivers.items():
+            if driver not in drivers:
+                driver.stop()
+                del self._drivers[key]
+
+    def _get_strands(self, strand_settings):
+        """
+        Returns the (strand, start, end) extents of the enabled strands, as
+        the same list for as long as they do not change
+        """
+        enabled = tuple(bool(s["enabled"]) for s in strand_settings)
+        key = (enabled, BufferUtils.get_buffer_size())
+        if key != self._strands_key:
+            self._strands_key = key
+            self._strands = [(strand,) + BufferUtils.get_strand_extents(strand)
+                             for strand in xrange(len(strand_settings)) if enabled[strand]]
+        return self._strands
+
+    def get_client_stats(self):
+        """
+        Returns {"host:port": driver stats} for each client being sent to
+        (see ClientSender.stats)
+        """
+        return dict(("%s:%d" % (key[1], key[2]), driver.stats()) for key, driver in self._drivers.items())
+
+    def stop(self):
+        """
+        Stops the client drivers; they are restarted with the next frame
+        """
+        for driver in self._drivers.values():
+            driver.stop()
+        for driver in self._drivers.values():
+            driver.join(1.0)
@@ -0,0 +1,289 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import logging
+import random
+import struct
+from collections import defaultdict
+
+import numpy as np
+
+from core.mixer import Mixer
+from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
+from lib.colors import HLS, hls_to_rgb
+from lib.playlist import Playlist
+from lib.plugin_loader import PluginLoader
+from lib.scene import Scene
+from lib.settings import Settings
+
+log = logging.getLogger("firemix.core.offline_render")
+
+
+class HeadlessApp:
+    """
+    Stand-in for FireMixApp that runs without a Qt event loop, timers, audio
+    or networking.  It provides what Scene, Playlist and Mixer expect from
+    the app so that the mixer can be driven directly with a virtual clock.
+    """
+    playlist_changed = None
+
+    def __init__(self, args):
+        self._running = False
+        self.args = args
+        self.settings = Settings()
+        self.net = None
+        self.aubio_connector = None
+        BufferUtils.set_app(self)
+        self.scene = Scene(self)
+        self.plugins = PluginLoader()
+        self.mixer = Mixer(self)
+        self.playlist = Playlist(self)
+
+        self.scene.warmup()
+
+        self.mixer.set_playlist(self.playlist)
+
+        if self.args.preset:
+            log.info("Setting constant preset %s" % args.preset)
+            self.mixer.set_constant_preset(args.preset)
+
+
+def _rgb8(buffer, out, colorspace=HLS):
+    """
+    Converts an HLS (or RGB) frame to 8-bit RGB the same way Networking does
+    """
+    rgb = (hls_to_rgb(buffer) if colorspace == HLS else buffer) * 255
+    np.clip(rgb, 0, 255, rgb)
+    out[:] = rgb
+    return out
+
+
+class FrameFileWriter:
+    """
+    Output stage that appends every frame to a compact binary file, as 8-bit RGB.
+
+    The file starts with a 32-byte little-endian header:
+        magic "FMXF", version (uint16), channels (uint16), pixels (uint32),
+        frames (uint32), frame rate (float32), 12 reserved bytes
+    followed by `frames` frames of `pixels * channels` bytes each.
+    """
+    MAGIC = "FMXF"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHHIIf12x")
+
+    def __init__(self, filename, tick_rate):
+        self._filename = filename
+        self._tick_rate = tick_rate
+        self._buffer = BufferUtils.create_buffer()
+        self._rgb = np.empty(self._buffer.shape, dtype=np.uint8)
+        self._file = open(filename, "wb")
+        self.frames = 0
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION, 3, len(self._buffer),
+                                          self.frames, self._tick_rate))
+
+    def acquire(self):
+        return self._buffer
+
+    def submit(self, buffer, colorspace=HLS):
+        self._file.write(_rgb8(buffer, self._rgb, colorspace).tostring())
+        self.frames += 1
+
+    def close(self):
+        self._write_header()
+        self._file.close()
+
+
+class NpyChunkWriter:
+    """
+    Output stage that writes frames as a series of .npy files, each holding
+    an array of shape (frames, pixels, 3) in 8-bit RGB.
+    """
+
+    def __init__(self, filename, chunk_frames=1024):
+        self._basename = filename[:-len(".npy")] if filename.endswith(".npy") else filename
+        self._buffer = BufferUtils.create_buffer()
+        self._chunk = np.empty((chunk_frames, len(self._buffer), 3), dtype=np.uint8)
+        self._chunk_frames = chunk_frames
+        self._chunk_index = 0
+        self._fill = 0
+        self.frames = 0
+
+    def acquire(self):
+        return self._buffer
+
+    def submit(self, buffer, colorspace=HLS):
+        _rgb8(buffer, self._chunk[self._fill], colorspace)
+        self._fill += 1
+        self.frames += 1
+        if self._fill == self._chunk_frames:
+            self._flush()
+
+    def _flush(self):
+        if self._fill:
+            np.save("%s.%05d.npy" % (self._basename, self._chunk_index), self._chunk[:self._fill])
+            self._chunk_index += 1
+            self._fill = 0
+
+    def close(self):
+        self._flush()
+
+
+def read_frames(filename):
+    """
+    Returns the frames of a FrameFileWriter file as a read-only (frames, pixels, 3)
+    uint8 array, and the frame rate it was rendered at.
+    """
+    with open(filename, "rb") as f:
+        magic, version, channels, pixels, frames, tick_rate = FrameFileWriter.HEADER.unpack(
+            f.read(FrameFileWriter.HEADER.size))
+    if magic != FrameFileWriter.MAGIC or version != FrameFileWriter.VERSION:
+        raise ValueError("%s is not a FireMix frame file" % filename)
+    if frames == 0:
+        return np.zeros((0, pixels, channels), dtype=np.uint8), tick_rate
+    data = np.memmap(filename, dtype=np.uint8, mode="r", offset=FrameFileWriter.HEADER.size,
+                     shape=(frames, pixels, channels))
+    return data, tick_rate
+
+
+def render(app, writer, num_frames, tick_rate):
+    """
+    Drives the mixer for num_frames frames with a virtual clock advancing by
+    1 / tick_rate per frame, as fast as the CPU allows.  Returns the wall-clock
+    time taken and a dict of {preset name: (frames, seconds)}.
+    """
+    mixer = app.mixer
+    mixer.set_output(writer)
+    dt = 1.0 / tick_rate
+    preset_cost = defaultdict(lambda: [0, 0.0])
+
+    start = monotonic()
+    for frame in xrange(num_frames):
+        active = app.playlist.get_active_preset()
+        frame_start = monotonic()
+        mixer.on_tick_timer(dt)
+        if active is not None:
+            cost = preset_cost[active.name()]
+            cost[0] += 1
+            cost[1] += monotonic() - frame_start
+    elapsed = monotonic() - start
+
+    return elapsed, dict((k, tuple(v)) for k, v in preset_cost.iteritems())
+
+
+def render_main(argv):
+    parser = argparse.ArgumentParser(prog="firemix.py render",
+                                     description="Render a show to a file without the GUI or network output")
+    parser.add_argument("scene", type=str, help="Scene file to load")
+    parser.add_argument("output", type=str, help="Output file (.npy for numpy chunks, anything else for a frame file)")
+    parser.add_argument("--playlist", type=str, help="Playlist file to load", default=None)
+    parser.add_argument("--preset", type=str, help="Render only this preset", default=None)
+    parser.add_argument("--frames", type=int, help="Number of frames to render", default=None)
+    parser.add_argument("--duration", type=float, help="Length of the show to render, in seconds", default=60.0)
+    parser.add_argument("--tick-rate", dest="tick_rate", type=float, help="Virtual frame rate (default: mixer setting)", default=None)
+    parser.add_argument("--seed", type=int, help="Random seed, for repeatable renders", default=None)
+    parser.add_argument("--chunk-frames", dest="chunk_frames", type=int, default=1024, help="Frames per .npy chunk")
+    parser.add_argument("--compare", type=str, default=None, help="Frame file to compare the rendered output against")
+    parser.add_argument("--verbose", action='store_const', const=True, default=False, help="Enable verbose log output")
+    args = parser.parse_args(argv)
+
+    # Options the live app provides which the mixer and playlist look at
+    args.profile = False
+    args.yappi = False
+    args.noaudio = True
+    args.gui = False
+    args.stats_file = None
+    args.record = None
+
+    if args.verbose:
+        logging.getLogger("firemix").setLevel(logging.DEBUG)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    app = HeadlessApp(args)
+    if app.playlist.get_active_preset() is None:
+        if args.preset:
+            print "Preset %s could not be loaded, nothing to render" % args.preset
+        elif app.playlist.name is None:
+            print "No playlist given (use --playlist), nothing to render"
+        else:
+            print "Playlist %s has no presets, nothing to render" % app.playlist.name
+        return 1
+    if not args.preset:
+        app.mixer.pause(False)
+
+    tick_rate = float(args.tick_rate or app.mixer.get_tick_rate())
+    app.mixer.set_tick_rate(tick_rate)
+    num_frames = args.frames if args.frames is not None else int(args.duration * tick_rate)
+
+    if args.output.endswith(".npy"):
+        writer = NpyChunkWriter(args.output, args.chunk_frames)
+    else:
+        writer = FrameFileWriter(args.output, tick_rate)
+
+    try:
+        elapsed, preset_cost = render(app, writer, num_frames, tick_rate)
+    finally:
+        writer.close()
+
+    print "Rendered %d frames in %0.2f seconds (%0.1f FPS, %0.1fx real time)" % (
+        writer.frames, elapsed, writer.frames / elapsed, (writer.frames / tick_rate) / elapsed)
+    for name, (frames, seconds) in sorted(preset_cost.iteritems(), key=lambda i: -i[1][1] / i[1][0]):
+        print "  %-40s %6d frames  %8.1f FPS" % (name, frames, frames / seconds)
+    print app.mixer.stats.format_table()
+
+    if args.compare:
+        if args.output.endswith(".npy"):
+            print "--compare needs a frame file output"
+            return 1
+        return compare_frame_files(args.output, args.compare)
+    return 0
+
+
+def compare_frame_files(filename, reference):
+    """
+    Prints a summary of the differences between two frame files.  Returns 0
+    if they are identical.
+    """
+    frames, rate = read_frames(filename)
+    ref_frames, ref_rate = read_frames(reference)
+
+    if frames.shape[1:] != ref_frames.shape[1:]:
+        print "Frame size differs from %s: %s vs %s" % (reference, frames.shape[1:], ref_frames.shape[1:])
+        return 1
+
+    count = min(len(frames), len(ref_frames))
+    differing = 0
+    max_error = 0
+    for i in xrange(count):
+        error = np.abs(frames[i].astype(np.int16) - ref_frames[i]).max()
+        if error > 0:
+            differing += 1
+            max_error = max(max_error, error)
+
+    print "Compared %d frames with %s: %d differ (max error %d)" % (count, reference, differing, max_error)
+    if len(frames) != len(ref_frames):
+        print "Frame count differs: %d vs %d" % (len(frames), len(ref_frames))
+        return 1
+    return 0 if differing == 0 else 1
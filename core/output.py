@@ -0,0 +1,161 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+
+from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
+from lib.colors import HLS
+
+log = logging.getLogger("firemix.core.output")
+
+
+class OutputPipeline:
+    """
+    Second stage of the render pipeline.  The mixer renders frame N+1 while an
+    output worker thread sends frame N to the network.
+
+    Frames are handed over through a ring of preallocated buffers: the mixer
+    acquire()s a free buffer, writes its post-processed frame straight into it,
+    and submit()s it.  The worker sends the buffer and returns it to the ring.
+    Neither side ever copies a frame, and the mixer never waits on socket I/O:
+    if the worker falls behind, the oldest queued frame is dropped and its
+    buffer is reused.
+    """
+
+    def __init__(self, net, depth=3, stats=None):
+        self._net = net
+        self._stats = stats
+        self._depth = max(2, depth)
+        self._free = collections.deque()
+        self._ready = collections.deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self.frames_submitted = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.max_queue_depth = 0
+        self.last_queue_latency = 0.0
+        self.max_queue_latency = 0.0
+        self.last_send_time = 0.0
+        self.max_send_time = 0.0
+
+        self.reset_buffers()
+
+    def reset_buffers(self):
+        """
+        (Re)allocates the frame ring.  Only call this while the worker is stopped.
+        """
+        with self._condition:
+            for buffer in self._free:
+                BufferUtils.release_buffer(buffer)
+            for buffer, submit_time, colorspace in self._ready:
+                BufferUtils.release_buffer(buffer)
+            self._ready.clear()
+            self._free = collections.deque(BufferUtils.acquire_buffer() for i in xrange(self._depth))
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="OutputPipeline")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self._net.stop()
+
+    def acquire(self):
+        """
+        Returns a frame buffer for the mixer to write into.  Never blocks.
+        """
+        with self._condition:
+            if self._free:
+                return self._free.popleft()
+            # The worker is behind: steal the oldest frame that hasn't been sent yet.
+            buffer, submit_time, colorspace = self._ready.popleft()
+            self.frames_dropped += 1
+            return buffer
+
+    def submit(self, buffer, colorspace=HLS):
+        """
+        Queues a buffer obtained from acquire() for output, holding a frame
+        in the given colorspace (see lib/colors.py)
+        """
+        with self._condition:
+            self._ready.append((buffer, monotonic(), colorspace))
+            self.frames_submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._ready))
+            self._condition.notify()
+
+    def queue_depth(self):
+        return len(self._ready)
+
+    def stats(self):
+        """
+        Returns a snapshot of the pipeline metrics (times in seconds)
+        """
+        return {
+            "depth": self._depth,
+            "queue-depth": len(self._ready),
+            "max-queue-depth": self.max_queue_depth,
+            "frames-submitted": self.frames_submitted,
+            "frames-sent": self.frames_sent,
+            "frames-dropped": self.frames_dropped,
+            "queue-latency-last": self.last_queue_latency,
+            "queue-latency-max": self.max_queue_latency,
+            "send-time-last": self.last_send_time,
+            "send-time-max": self.max_send_time,
+            "clients": self._net.get_client_stats(),
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._ready:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                buffer, submit_time, colorspace = self._ready.popleft()
+
+            start = monotonic()
+            self.last_queue_latency = start - submit_time
+            self.max_queue_latency = max(self.max_queue_latency, self.last_queue_latency)
+            if self._stats is not None:
+                self._stats.record("queue-latency", self.last_queue_latency)
+
+            try:
+                self._net.write_buffer(buffer, submit_time, colorspace)
+            except:
+                log.exception("Error writing frame to the network")
+
+            self.last_send_time = monotonic() - start
+            self.max_send_time = max(self.max_send_time, self.last_send_time)
+            self.frames_sent += 1
+
+            with self._condition:
+                self._free.append(buffer)
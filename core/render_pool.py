@@ -0,0 +1,295 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import logging
+import multiprocessing
+import signal
+import traceback
+
+import numpy as np
+
+from lib.buffer_utils import BufferUtils
+from lib.clock import monotonic
+
+log = logging.getLogger("firemix.core.render_pool")
+
+
+def _preset_params(preset):
+    return tuple(sorted((name, p.get_as_str()) for name, p in preset.get_parameters().iteritems()))
+
+
+def _worker_main(conn, shared_buffer, mixer):
+    """
+    Worker process loop.  The worker was forked from the mixer, so it has its
+    own copy of the scene, plugins and playlist; it builds its own instance of
+    each preset it is assigned, drawing straight into the shared buffer, and
+    ticks it on command.  Every audio update the mixer applies is replayed on
+    the worker's copy of the audio state, so presets see the same audio as
+    they would on the mixer.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    mixer.recorder = None
+    mixer.audio.recorder = None
+    mixer._governor = None
+    mixer.audio.keep_updates(False)
+    buffer = np.frombuffer(shared_buffer, dtype=np.float32).reshape((-1, 3))
+    preset = None
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, IOError):
+            return
+        command = message[0]
+
+        try:
+            if command == "tick":
+                dt, onset, quality, tick_rate = message[1:]
+                mixer._onset = onset
+                # The worker's mixer has no governor, so its rate is the
+                # mixer's effective rate
+                mixer._tick_rate = tick_rate
+                if preset.quality != quality:
+                    preset.set_quality(quality)
+                preset.tick(dt)
+                if preset.get_buffer() is not buffer:
+                    # The preset replaced its buffer rather than drawing into it
+                    np.copyto(buffer, preset.get_buffer())
+                conn.send(("done", None))
+
+            elif command == "audio":
+                mixer.audio.apply_updates(message[1])
+
+            elif command == "assign":
+                classname, slug, name, params = message[1:]
+                preset = mixer.playlist.get_preset_from_json_data({'classname': classname}, slug)
+                preset.set_name(name)
+                for key, value in params:
+                    if value is not None:
+                        preset.parameter(key).set_from_str(value)
+                # Draw into the shared buffer from now on (see Pattern.init_pixels)
+                BufferUtils.release_buffer(preset._pooled_buffer)
+                preset._pooled_buffer = buffer
+                preset._reset()
+
+            elif command == "params":
+                for key, value in message[1]:
+                    if value is not None:
+                        preset.parameter(key).set_from_str(value)
+
+            elif command == "stop":
+                return
+
+        except:
+            if command == "tick":
+                conn.send(("error", traceback.format_exc()))
+            else:
+                log.exception("Error handling %s in render worker" % command)
+
+
+class RenderWorker:
+    """
+    Mixer-side handle of one worker process and its shared frame buffer
+    """
+
+    def __init__(self, index, mixer):
+        self.index = index
+        size = BufferUtils.get_buffer_size()
+        self._shared_buffer = multiprocessing.RawArray(ctypes.c_float, size * 3)
+        self.buffer = np.frombuffer(self._shared_buffer, dtype=np.float32).reshape((size, 3))
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_worker_main, name="RenderWorker-%d" % index,
+                                                args=(child_conn, self._shared_buffer, mixer))
+        self._process.daemon = True
+        self.preset = None
+        self._params = None
+        self.busy = False
+        self.alive = True
+
+    def start(self):
+        self._process.start()
+
+    def stop(self):
+        if self.alive:
+            try:
+                self._conn.send(("stop",))
+            except IOError:
+                pass
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.alive = False
+
+    def assign(self, preset):
+        self.preset = preset
+        self._params = _preset_params(preset)
+        self.buffer.fill(0.0)
+        self._conn.send(("assign", preset.__class__.__name__, preset.slug(), preset.name(), self._params))
+
+    def release(self):
+        self.preset = None
+        self._params = None
+
+    def send_audio(self, updates):
+        self._conn.send(("audio", updates))
+
+    def tick(self, dt, onset, tick_rate):
+        params = _preset_params(self.preset)
+        if params != self._params:
+            self._params = params
+            self._conn.send(("params", params))
+        self._conn.send(("tick", dt, onset, self.preset.quality, tick_rate))
+        self.busy = True
+
+    def wait(self, timeout):
+        """
+        Waits for the worker to finish its frame.  Returns None on success,
+        or a description of the error.
+        """
+        self.busy = False
+        if not self._conn.poll(timeout):
+            self.alive = False
+            return "worker did not finish its frame in time"
+        try:
+            status, error = self._conn.recv()
+        except (EOFError, IOError):
+            self.alive = False
+            return "worker exited"
+        return error
+
+
+class RenderPool:
+    """
+    Renders presets concurrently in worker processes.
+
+    Each worker process owns a preset (rebuilt in the worker from its class,
+    slug and current parameters) and a frame buffer in shared memory.  Every
+    frame, dt, the onset flag and every audio update applied since the last
+    frame are sent to the workers over a pipe, all workers render at the
+    same time, and the mixer uses the shared buffers directly once they
+    report back.  Presets stay on their
+    worker for as long as the mixer keeps asking for them, so an incoming
+    preset keeps its state when it becomes the active one.
+
+    Parameter changes made on the mixer's copy of a preset are forwarded to
+    the worker.  Presets that do not get a worker (all are busy or have died)
+    are left for the mixer to render itself.
+    """
+
+    def __init__(self, mixer, num_workers=2, timeout=1.0):
+        self._mixer = mixer
+        self._num_workers = max(1, num_workers)
+        self._timeout = timeout
+        self._workers = []
+        self.frames = 0
+        self.last_render_time = 0.0
+        self.max_render_time = 0.0
+
+    def start(self):
+        """
+        Forks the workers.  Call this before any other threads are started.
+        """
+        for i in xrange(self._num_workers):
+            worker = RenderWorker(i, self._mixer)
+            worker.start()
+            self._workers.append(worker)
+        self._mixer.audio.keep_updates(True)
+        log.info("Started %d render workers" % self._num_workers)
+
+    def stop(self):
+        self._mixer.audio.keep_updates(False)
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    def get_buffer(self, preset):
+        """
+        Returns the shared buffer the preset was rendered into, or None if
+        the preset is not rendered by the pool
+        """
+        for worker in self._workers:
+            if worker.preset is preset and worker.alive:
+                return worker.buffer
+        return None
+
+    def render(self, presets, dt):
+        """
+        Renders one frame of each of the given presets on the workers.
+        Returns {preset: error} for presets whose worker raised, and a list
+        of presets the pool could not take, which the caller has to render.
+        """
+        workers = [w for w in self._workers if w.alive]
+        for worker in workers:
+            if worker.preset is not None and worker.preset not in presets:
+                worker.release()
+
+        inline = []
+        ticking = []
+        onset = self._mixer._onset
+        tick_rate = self._mixer.get_effective_tick_rate()
+
+        start = monotonic()
+        # Every worker keeps its audio state in step, including idle ones
+        updates = self._mixer.audio.take_updates()
+        if updates:
+            for worker in workers:
+                worker.send_audio(updates)
+
+        for preset in presets:
+            if preset.disabled:
+                continue
+            worker = None
+            for w in workers:
+                if w.preset is preset:
+                    worker = w
+                    break
+            else:
+                for w in workers:
+                    if w.preset is None:
+                        worker = w
+                        worker.assign(preset)
+                        break
+            if worker is None:
+                inline.append(preset)
+                continue
+            worker.tick(dt, onset, tick_rate)
+            ticking.append(worker)
+
+        errors = {}
+        for worker in ticking:
+            error = worker.wait(self._timeout)
+            if error is not None:
+                errors[worker.preset] = error
+                if not worker.alive:
+                    log.error("Render worker %d failed (%s), removing it from the pool" % (worker.index, error))
+                    worker.stop()
+                    worker.release()
+
+        self.frames += 1
+        self.last_render_time = monotonic() - start
+        self.max_render_time = max(self.max_render_time, self.last_render_time)
+        return errors, inline
+
+    def stats(self):
+        return {
+            "workers": len([w for w in self._workers if w.alive]),
+            "assigned": [w.preset.name() for w in self._workers if w.preset is not None],
+            "frames": self.frames,
+            "render-time-last": self.last_render_time,
+            "render-time-max": self.max_render_time,
+        }
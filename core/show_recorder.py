@@ -0,0 +1,403 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import cPickle
+import json
+import logging
+import os
+import random
+import struct
+import threading
+
+import numpy as np
+
+from lib.clock import monotonic
+
+log = logging.getLogger("firemix.core.show_recorder")
+
+START = 1
+TICK = 2
+ONSET = 3
+FFT = 4
+PITCH = 5
+PARAMETER = 6
+EVENT = 7
+AUDIO = 8
+
+# Mixer calls that are recorded as events and can be replayed
+MIXER_EVENTS = ("next", "cancel_transition", "set_transition_mode", "set_preset_duration",
+                "set_transition_duration", "pause", "scrub_transition", "cancel_scrub",
+                "add_layer", "remove_layer")
+PLAYLIST_EVENTS = ("set_active_preset_by_name", "shuffle_mode")
+
+
+class ShowRecorder:
+    """
+    Appends everything that drives the mixer to a compact binary file, so
+    that a show can be replayed deterministically (see replay()).
+
+    The file starts with an 8-byte header, magic "FMXR" and version (uint32),
+    followed by records of a type (uint8), a payload length (uint32) and the
+    payload.  Each mixer run starts with a START record holding the random
+    seed and the mixer and playlist state, and an AUDIO record holding the
+    audio analysis state (see Audio.get_state); after that come TICK records
+    (dt, global speed and preset quality) and, in between, whatever
+    happened before the next frame: onsets, FFT and pitch data, parameter
+    changes and mixer/playlist events.
+
+    Records come from the mixer thread and the Qt thread, so writes are
+    serialized.  Audio data, onsets, parameter changes and events would
+    otherwise land in the middle of a frame, wherever the Qt thread happens
+    to run; while recording they are held back and applied, in the order
+    they arrived, at the start of the next frame instead, which is where the
+    replay applies them.  The file is flushed after every frame so
+    a crash loses at most one frame of input.
+    """
+    MAGIC = "FMXR"
+    VERSION = 1
+    HEADER = struct.Struct("<4sI")
+    RECORD = struct.Struct("<BI")
+    TICK = struct.Struct("<ddf")
+    PITCH = struct.Struct("<ff")
+
+    def __init__(self, filename, seed=None):
+        """
+        Opens the recording and seeds the random number generators.  Create
+        the recorder before the playlist is loaded, so that the presets draw
+        their initial state from the seeded generators.
+        """
+        if seed is None:
+            seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+        random.seed(seed)
+        np.random.seed(seed)
+        self.seed = seed
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._file = open(filename, "ab")
+        if self._file.tell() == 0:
+            self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION))
+        self.recording = False
+        self._pending = []
+        self.records = 0
+        self.bytes_written = 0
+
+    def _write(self, record_type, payload):
+        with self._lock:
+            if self._file is None or not (self.recording or record_type == START):
+                return
+            self._file.write(self.RECORD.pack(record_type, len(payload)))
+            self._file.write(payload)
+            self.records += 1
+            self.bytes_written += self.RECORD.size + len(payload)
+            if record_type == TICK:
+                self._file.flush()
+
+    def start(self, mixer):
+        """
+        Records the state the mixer starts from and reseeds the random number
+        generators, so that presets draw the same random numbers on replay.
+        """
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+
+        # Start the active preset afresh, so it draws its initial state from
+        # the seeded generators too
+        playlist = mixer.playlist
+        active = playlist.get_active_preset() if playlist is not None else None
+        next = playlist.get_next_preset() if playlist is not None else None
+        if active is not None:
+            active._reset()
+        mixer._elapsed = 0.0
+
+        self._write(START, json.dumps({
+            "seed": self.seed,
+            "scene": getattr(mixer._app.args, "scene", None),
+            "playlist": playlist.name if playlist is not None else None,
+            "active-preset": active.name() if active is not None else None,
+            "next-preset": next.name() if next is not None else None,
+            "shuffle": playlist._shuffle if playlist is not None else False,
+            "shuffle-list": list(playlist._shuffle_list) if playlist is not None else [],
+            "transition": mixer._app.settings.get('mixer')['transition'],
+            "preset-duration": mixer.get_preset_duration(),
+            "transition-duration": mixer.get_transition_duration(),
+            "tick-rate": mixer.get_tick_rate(),
+            "paused": mixer.is_paused(),
+        }))
+        self.recording = True
+        self._write(AUDIO, cPickle.dumps(mixer.audio.get_state(), cPickle.HIGHEST_PROTOCOL))
+        log.info("Recording show to %s (seed %d)" % (self._filename, self.seed))
+
+    def _defer(self, record_type, payload, apply, *args):
+        with self._lock:
+            if self.recording:
+                self._pending.append((record_type, payload, apply, args))
+                return
+        apply(*args)
+
+    def tick(self, dt, speed, quality):
+        """
+        Called by the mixer before it renders a frame.  Applies the inputs
+        that arrived since the previous frame, in order, and records them
+        followed by the frame.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+        for record_type, payload, apply, args in pending:
+            self._write(record_type, payload)
+            apply(*args)
+        self._write(TICK, self.TICK.pack(dt, speed, quality))
+
+    def onset(self, apply):
+        self._defer(ONSET, "", apply)
+
+    def fft(self, data, apply):
+        # Store and apply the same single-precision copy, so the replay is exact
+        data = np.asarray(data, dtype=np.float32)
+        self._defer(FFT, data.tostring(), apply, data)
+
+    def pitch(self, pitch, confidence, apply):
+        payload = self.PITCH.pack(pitch, confidence)
+        self._defer(PITCH, payload, apply, *self.PITCH.unpack(payload))
+
+    def parameter(self, preset, parameter, value, apply):
+        self._defer(PARAMETER, json.dumps([preset.name(), str(parameter), value]), apply)
+
+    def event(self, name, apply, *args):
+        self._defer(EVENT, json.dumps([name] + list(args)), apply, *args)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_show(filename):
+    """
+    Yields the (type, payload) records of a ShowRecorder file, with the
+    payloads decoded
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    header = ShowRecorder.HEADER
+    if len(data) < header.size:
+        raise ValueError("%s is not a FireMix show recording" % filename)
+    magic, version = header.unpack_from(data)
+    if magic != ShowRecorder.MAGIC or version != ShowRecorder.VERSION:
+        raise ValueError("%s is not a FireMix show recording" % filename)
+
+    offset = header.size
+    while offset + ShowRecorder.RECORD.size <= len(data):
+        record_type, length = ShowRecorder.RECORD.unpack_from(data, offset)
+        offset += ShowRecorder.RECORD.size
+        payload = data[offset:offset + length]
+        if len(payload) < length:
+            # The recording was cut off in the middle of a record
+            break
+        offset += length
+
+        if record_type == TICK:
+            yield record_type, ShowRecorder.TICK.unpack(payload)
+        elif record_type == ONSET:
+            yield record_type, None
+        elif record_type == FFT:
+            yield record_type, np.fromstring(payload, dtype=np.float32)
+        elif record_type == PITCH:
+            yield record_type, ShowRecorder.PITCH.unpack(payload)
+        elif record_type in (START, PARAMETER, EVENT):
+            yield record_type, json.loads(payload)
+        elif record_type == AUDIO:
+            yield record_type, cPickle.loads(payload)
+        else:
+            log.warn("Skipping unknown record type %d in %s" % (record_type, filename))
+
+
+def apply_start(app, state):
+    """
+    Puts the mixer and playlist in the state recorded by a START record
+    """
+    mixer = app.mixer
+    playlist = app.playlist
+    if state["playlist"] and state["playlist"] != playlist.name:
+        playlist.set_filename(os.path.join(os.getcwd(), "data", "playlists", "".join([state["playlist"], ".json"])))
+        playlist.open()
+    app.settings.get('mixer')['transition'] = state["transition"]
+    mixer.cancel_transition()
+    mixer.set_transition_mode(state["transition"])
+    mixer.set_preset_duration(state["preset-duration"])
+    mixer.set_transition_duration(state["transition-duration"])
+    mixer.set_tick_rate(state["tick-rate"])
+    mixer.pause(state["paused"])
+
+    random.seed(state["seed"])
+    np.random.seed(state["seed"])
+
+    active = None
+    if state["active-preset"] is not None:
+        active = playlist.get_preset_by_name(state["active-preset"])
+        if active is None:
+            log.warn("Preset %s is not in the playlist" % state["active-preset"])
+    if active is not None:
+        playlist.active_preset = active
+        active._reset()
+    if state["next-preset"] is not None:
+        next = playlist.get_preset_by_name(state["next-preset"])
+        if next is not None:
+            playlist.next_preset = next
+    playlist._shuffle = state["shuffle"]
+    playlist._shuffle_list = list(state["shuffle-list"])
+    mixer._elapsed = 0.0
+
+
+def apply_event(app, event):
+    name, args = event[0], event[1:]
+    if name in PLAYLIST_EVENTS:
+        getattr(app.playlist, name)(*args)
+    elif name in MIXER_EVENTS:
+        if name == "set_transition_mode":
+            app.settings.get('mixer')['transition'] = args[0]
+        elif name == "remove_layer":
+            # Recorded as the layer's position in the stack
+            layers = app.mixer.get_layers()
+            if not 0 <= args[0] < len(layers):
+                log.warn("Skipping removal of layer %d, the stack has %d" % (args[0], len(layers)))
+                return
+            args = [layers[args[0]]]
+        try:
+            getattr(app.mixer, name)(*args)
+        except ValueError as e:
+            log.warn("Skipping event %s: %s" % (name, e))
+    else:
+        log.warn("Skipping unknown event %s" % name)
+
+
+def replay(app, filename):
+    """
+    Feeds a recorded show back into the mixer as fast as the CPU allows.
+    Returns the number of frames rendered and the wall-clock time taken.
+    """
+    mixer = app.mixer
+    frames = 0
+    elapsed = 0.0
+
+    for record_type, payload in read_show(filename):
+        if record_type == TICK:
+            dt, speed, quality = payload
+            mixer.global_speed = speed
+            mixer.preset_quality = quality
+            start = monotonic()
+            try:
+                mixer.on_tick_timer(dt)
+            except:
+                # The live mixer disables the preset and carries on (see
+                # FrameScheduler.run), so the replay has to as well
+                log.exception("Error rendering frame %d" % frames)
+            elapsed += monotonic() - start
+            frames += 1
+        elif record_type == ONSET:
+            # The holdoff was applied when the onset was recorded
+            mixer.set_onset()
+        elif record_type == FFT:
+            mixer.audio.apply_fft_data(payload)
+        elif record_type == PITCH:
+            mixer.audio.apply_pitch_data(*payload)
+        elif record_type == PARAMETER:
+            preset_name, key, value = payload
+            preset = app.playlist.get_preset_by_name(preset_name)
+            if preset is None or preset.parameter(key) is None or value is None:
+                log.warn("Skipping change of %s.%s, not found in the playlist" % (preset_name, key))
+            else:
+                preset.parameter(key).set_from_str(value)
+        elif record_type == EVENT:
+            apply_event(app, payload)
+        elif record_type == START:
+            apply_start(app, payload)
+        elif record_type == AUDIO:
+            mixer.audio.set_state(payload)
+
+    return frames, elapsed
+
+
+def replay_main(argv):
+    from core.offline_render import HeadlessApp, FrameFileWriter, NpyChunkWriter, compare_frame_files
+
+    parser = argparse.ArgumentParser(prog="firemix.py replay",
+                                     description="Replay a recorded show without the GUI or network output")
+    parser.add_argument("recording", type=str, help="Show recording made with --record")
+    parser.add_argument("output", type=str, nargs="?", default=None,
+                        help="Output file (.npy for numpy chunks, anything else for a frame file).  "
+                             "Without one, the show is only rendered (for profiling).")
+    parser.add_argument("--scene", type=str, help="Scene to load (default: the recorded scene)", default=None)
+    parser.add_argument("--playlist", type=str, help="Playlist to load (default: the recorded playlist)", default=None)
+    parser.add_argument("--chunk-frames", dest="chunk_frames", type=int, default=1024, help="Frames per .npy chunk")
+    parser.add_argument("--compare", type=str, default=None, help="Frame file to compare the rendered output against")
+    parser.add_argument("--verbose", action='store_const', const=True, default=False, help="Enable verbose log output")
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.getLogger("firemix").setLevel(logging.DEBUG)
+
+    for record_type, state in read_show(args.recording):
+        if record_type == START:
+            break
+    else:
+        print "%s does not contain a recorded show" % args.recording
+        return 1
+
+    # Options the live app provides which the mixer and playlist look at
+    args.scene = args.scene or state["scene"]
+    args.playlist = args.playlist or state["playlist"]
+    args.preset = None
+    args.profile = False
+    args.yappi = False
+    args.noaudio = True
+    args.gui = False
+    args.stats_file = None
+    args.record = None
+
+    # The live app seeded the generators before loading the playlist
+    random.seed(state["seed"])
+    np.random.seed(state["seed"])
+    app = HeadlessApp(args)
+
+    writer = None
+    if args.output is not None:
+        if args.output.endswith(".npy"):
+            writer = NpyChunkWriter(args.output, args.chunk_frames)
+        else:
+            writer = FrameFileWriter(args.output, state["tick-rate"])
+        app.mixer.set_output(writer)
+
+    try:
+        frames, elapsed = replay(app, args.recording)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print "Replayed %d frames of %s in %0.2f seconds (%0.1f FPS)" % (
+        frames, os.path.basename(args.recording), elapsed, frames / elapsed if elapsed else 0.0)
+    print app.mixer.stats.format_table()
+
+    if args.compare:
+        if args.output is None or args.output.endswith(".npy"):
+            print "--compare needs a frame file output"
+            return 1
+        return compare_frame_files(args.output, args.compare)
+    return 0
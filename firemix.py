@@ -24,7 +24,7 @@ import sys
 from PySide import QtCore, QtGui
 
 from firemix_app import FireMixApp
-from ui.firemixgui import FireMixGUI
+from lib.buffer_utils import BufferUtils
 
 
 def sig_handler(app, sig, frame):
@@ -37,10 +37,22 @@ def main():
     logging.basicConfig(level=logging.ERROR)
     log = logging.getLogger("firemix")
 
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        from core.offline_render import render_main
+        return render_main(sys.argv[2:])
+
+    if len(sys.argv) > 1 and sys.argv[1] == "replay":
+        from core.show_recorder import replay_main
+        return replay_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description="Firelight mixer and preset host")
     parser.add_argument("scene", type=str, help="Scene file to load (create scenes with FireSim)")
     parser.add_argument("--playlist", type=str, help="Playlist file to load", default=None)
     parser.add_argument("--profile", action='store_const', const=True, default=False, help="Enable profiling")
+    parser.add_argument("--stats-file", dest="stats_file", type=str, default=None,
+                        help="Periodically write frame stage timing to this file (.json for JSON, otherwise text)")
+    parser.add_argument("--record", type=str, default=None,
+                        help="Record the show's inputs to this file, for use with 'firemix.py replay'")
     parser.add_argument("--yappi", action='store_const', const=True, default=False, help="Enable YAPPI")
     parser.add_argument("--nogui", dest='gui', action='store_false',
                         default=True, help="Disable GUI")
@@ -63,6 +75,7 @@ def main():
     app.start()
 
     if args.gui:
+        from ui.firemixgui import FireMixGUI
         gui = FireMixGUI(app=app)
         gui.show()
     else:
@@ -78,11 +91,48 @@ def main():
     qt_app.exec_()
 
     if args.profile:
-        print   "------ TICK TIME HISTOGRAM ------"
+        print "------ FRAME STAGE TIMING ------"
         elapsed = (app.mixer._stop_time - app.mixer._start_time)
         print "%d frames in %0.2f seconds (%0.2f FPS) " %  (app.mixer._num_frames, elapsed, app.mixer._num_frames / elapsed)
-        for c in sorted(app.mixer._tick_time_data.iterkeys()):
-            print "[%d fps]:\t%4d\t%0.2f%%" % (c, app.mixer._tick_time_data[c], (float(app.mixer._tick_time_data[c]) / app.mixer._num_frames) * 100.0)
+        print app.mixer.stats.format_table()
+
+        stats = app.mixer.get_scheduler_stats()
+        if stats:
+            print "------ FRAME SCHEDULER ------"
+            print "Policy: %s at %0.1f FPS" % (stats["policy"], stats["tick-rate"])
+            print "%d missed deadlines, %d dropped frames" % (stats["missed-deadlines"], stats["dropped-frames"])
+            print "Jitter: %0.3f ms mean, %0.3f ms max" % (stats["jitter-mean"] * 1000.0, stats["jitter-max"] * 1000.0)
+
+        stats = app.mixer.get_output_stats()
+        if stats:
+            print "------ OUTPUT PIPELINE ------"
+            print "%d frames sent, %d dropped, max queue depth %d of %d" % (stats["frames-sent"], stats["frames-dropped"], stats["max-queue-depth"], stats["depth"])
+            print "Queue latency: %0.3f ms max" % (stats["queue-latency-max"] * 1000.0)
+            print "Send time: %0.3f ms max" % (stats["send-time-max"] * 1000.0)
+            for client, client_stats in sorted(stats["clients"].iteritems()):
+                print "%s: %d frames sent, %d skipped, %d packets dropped, %d errors" % (
+                    client, client_stats.get("frames-sent", 0), client_stats.get("frames-skipped", 0),
+                    client_stats.get("packets-dropped", 0), client_stats.get("errors", 0))
+                if client_stats.get("bytes-saved"):
+                    total = client_stats["bytes-sent"] + client_stats["bytes-saved"]
+                    print "%s: %d unchanged strand packets not sent, %d%% of the bandwidth saved" % (
+                        client, client_stats["packets-saved"], client_stats["bytes-saved"] * 100 / total)
+                if "connects" in client_stats:
+                    print "%s: %s, %d connects, %d frames dropped while disconnected or backed up" % (
+                        client, "connected" if client_stats["connected"] else "not connected",
+                        client_stats["connects"], client_stats["frames-dropped"] + client_stats["packets-dropped"])
+
+        stats = BufferUtils.buffer_stats()
+        print "------ FRAME BUFFERS ------"
+        print "%d allocated, %d acquired, %d released, %d pooled" % (stats["allocated"], stats["acquired"], stats["released"], stats["pooled"])
+
+        stats = app.mixer.get_governor_stats()
+        if stats:
+            print "------ FRAME GOVERNOR ------"
+            print "Quality %0.2f at %0.1f of %0.1f FPS after %d decisions" % (stats["quality"], stats["tick-rate"], stats["target-tick-rate"], stats["decisions"])
+            print "Frame cost: %0.3f ms (%d%% of the frame budget)" % (stats["frame-cost"] * 1000.0, stats["load"] * 100)
+            if stats["last-decision"]:
+                print "Last decision: %s" % stats["last-decision"]
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
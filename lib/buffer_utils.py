@@ -37,6 +37,11 @@ class BufferUtils:
     _pixel_offset_cache = {}
     _pixel_index_cache = {}
     _pixel_logical_cache = {}
+    _buffer_pool = []
+    _max_pooled_buffers = 16
+    buffers_allocated = 0
+    buffers_acquired = 0
+    buffers_released = 0
 
     @classmethod
     def set_app(cls, app):
@@ -120,8 +125,50 @@ class BufferUtils:
         The reference to the app is required to lookup the required dimensions, in order
         to figure out the total y-axis length required.
         """
+        cls.buffers_allocated += 1
         return np.zeros((cls._buffer_length, 3), dtype=np.float32)
 
+    @classmethod
+    def acquire_buffer(cls):
+        """
+        Returns a zeroed pixel buffer like create_buffer(), reusing a released
+        buffer when one is available.  Hand it back with release_buffer() once
+        it is no longer used, so that steady-state rendering never allocates.
+        """
+        cls.buffers_acquired += 1
+        try:
+            buffer = cls._buffer_pool.pop()
+        except IndexError:
+            return cls.create_buffer()
+        buffer.fill(0.0)
+        return buffer
+
+    @classmethod
+    def release_buffer(cls, buffer):
+        """
+        Returns a buffer obtained from acquire_buffer() to the pool.  The caller
+        must not use it afterwards.  Buffers of a stale size are dropped.
+        """
+        if buffer is None or buffer.shape != (cls._buffer_length, 3):
+            return
+        if any(b is buffer for b in cls._buffer_pool):
+            raise ValueError("Buffer released twice")
+        cls.buffers_released += 1
+        if len(cls._buffer_pool) < cls._max_pooled_buffers:
+            cls._buffer_pool.append(buffer)
+
+    @classmethod
+    def buffer_stats(cls):
+        """
+        Returns the buffer allocation counters
+        """
+        return {
+            "allocated": cls.buffers_allocated,
+            "acquired": cls.buffers_acquired,
+            "released": cls.buffers_released,
+            "pooled": len(cls._buffer_pool),
+        }
+
     @classmethod
     def get_buffer_size(cls):
         """
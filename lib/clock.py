@@ -0,0 +1,68 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+import time
+
+log = logging.getLogger("firemix.lib.clock")
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _posix_monotonic():
+    """
+    Returns a clock_gettime(CLOCK_MONOTONIC) based timer, or None if the
+    platform does not provide one.
+    """
+    if sys.platform.startswith("linux"):
+        clock_id = 1
+    elif sys.platform == "darwin":
+        clock_id = 6
+    else:
+        return None
+
+    for name in (ctypes.util.find_library("c"), ctypes.util.find_library("rt")):
+        if name is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            ts = _timespec()
+            if clock_gettime(clock_id, ctypes.pointer(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic
+
+    return None
+
+
+monotonic = getattr(time, "monotonic", None) or _posix_monotonic()
+
+if monotonic is None:
+    log.warn("No monotonic clock available; frame timing will follow the wall clock")
+    monotonic = time.time
@@ -0,0 +1,206 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+
+import numpy as np
+
+from lib.clock import monotonic
+from lib.colors import hls_to_rgb
+
+log = logging.getLogger("firemix.lib.color_lut")
+
+# Bits of hue, lightness and saturation used to index the table
+DEFAULT_BITS = (7, 7, 7)
+MAX_BITS = 8
+
+# Bump when the table contents change, to ignore stale cache files
+TABLE_VERSION = 1
+
+# Levels of the quantized RGB in the table, as in core.networking
+LEVELS = 65536
+
+
+class ColorLUT:
+    """
+    Converts HLS frames to RGB through a table of precomputed colors, for
+    outputs that only need 8 bits per channel.
+
+    Hue, lightness and saturation are rounded to `bits` bits each, and
+    the three combined into one index per pixel.  The table holds the RGB
+    of each index, quantized to 16 bits per channel like the exact
+    conversion; fold() bakes a client's output LUT (gamma, white balance
+    and channel order, but not the dimmer) into a copy of it, so converting
+    a frame for a client is a single gather.
+
+    The table is built from hls_to_rgb() and cached in cache_dir.
+    """
+
+    def __init__(self, bits=DEFAULT_BITS, cache_dir=None):
+        bits = tuple(int(b) for b in bits)
+        if len(bits) != 3 or not all(1 <= b <= MAX_BITS for b in bits):
+            raise ValueError("Color LUT bits must be three numbers from 1 to %d, not %r" % (MAX_BITS, bits))
+        self.bits = bits
+        self.size = 1 << sum(bits)
+        self.table = None
+        self._scratch = None
+        self._index = None
+        if cache_dir is not None:
+            self.table = self._load(cache_dir)
+        if self.table is None:
+            start = monotonic()
+            self.table = self._build()
+            log.info("Built %d-%d-%d bit color LUT (%d colors) in %0.1f ms" %
+                     (bits + (self.size, (monotonic() - start) * 1000.0)))
+            if cache_dir is not None:
+                self._save(cache_dir)
+
+    def __repr__(self):
+        return "ColorLUT(%d, %d, %d)" % self.bits
+
+    def _cache_path(self, cache_dir):
+        return os.path.join(cache_dir, "hls_lut_v%d_%d_%d_%d.npy" % ((TABLE_VERSION,) + self.bits))
+
+    def _load(self, cache_dir):
+        path = self._cache_path(cache_dir)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = np.load(path)
+        except (IOError, ValueError) as e:
+            log.warn("Could not load color LUT %s: %s" % (path, e))
+            return None
+        if table.shape != (self.size, 3) or table.dtype != np.uint16:
+            log.warn("Ignoring color LUT %s of the wrong shape" % path)
+            return None
+        return table
+
+    def _save(self, cache_dir):
+        path = self._cache_path(cache_dir)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Written to a temporary file first, so a reader never sees half a table
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as f:
+                np.save(f, self.table)
+            os.rename(temporary, path)
+        except (IOError, OSError) as e:
+            log.warn("Could not save color LUT %s: %s" % (path, e))
+
+    def grid(self):
+        """
+        Returns the (size, 3) float32 HLS color of each table entry
+        """
+        hue_bits, lightness_bits, saturation_bits = self.bits
+        H, L, S = np.meshgrid(np.arange(1 << hue_bits, dtype=np.float32) / (1 << hue_bits),
+                              np.linspace(0.0, 1.0, 1 << lightness_bits).astype(np.float32),
+                              np.linspace(0.0, 1.0, 1 << saturation_bits).astype(np.float32),
+                              indexing='ij')
+        return np.column_stack((H.ravel(), L.ravel(), S.ravel()))
+
+    def _build(self):
+        rgb = hls_to_rgb(self.grid())
+        rgb *= LEVELS - 1
+        np.clip(rgb, 0, LEVELS - 1, rgb)
+        return rgb.astype(np.uint16)
+
+    def index(self, hls, out=None):
+        """
+        Returns the table index of each pixel of an (N, 3) HLS frame, as
+        int32, in out if given.  Hue wraps around (from -16 turns up), and
+        lightness and saturation are clipped to [0, 1].
+        """
+        hue_bits, lightness_bits, saturation_bits = self.bits
+        if out is None:
+            if self._index is None or len(self._index) != len(hls):
+                self._index = np.empty(len(hls), dtype=np.int32)
+            out = self._index
+        if self._scratch is None or len(self._scratch[0]) != len(hls):
+            self._scratch = (np.empty(len(hls), dtype=np.float32), np.empty(len(hls), dtype=np.int32))
+        value, level = self._scratch
+
+        # Rounding to the nearest entry: the offset keeps the hue positive
+        # for the truncating cast, and the mask wraps it
+        np.multiply(hls[:, 0], 1 << hue_bits, value)
+        value += (16 << hue_bits) + 0.5
+        np.copyto(out, value, casting='unsafe')
+        np.bitwise_and(out, (1 << hue_bits) - 1, out)
+        out <<= lightness_bits + saturation_bits
+
+        for channel, bits, shift in ((1, lightness_bits, saturation_bits), (2, saturation_bits, 0)):
+            np.clip(hls[:, channel], 0.0, 1.0, value)
+            value *= (1 << bits) - 1
+            value += 0.5
+            np.copyto(level, value, casting='unsafe')
+            if shift:
+                level <<= shift
+            out |= level
+        return out
+
+    def frame(self, hls):
+        """
+        Returns an IndexedFrame of an (N, 3) HLS frame, in a buffer that is
+        reused by the next call
+        """
+        return IndexedFrame(self, self.index(hls))
+
+    def fold(self, output_lut, out=None):
+        """
+        Returns the (size, 3) uint8 table of a client's undimmed output for
+        each index: the table put through the client's OutputLUT (see
+        lib/output_driver.py), whose dim() then applies the dimmer
+        """
+        if out is None:
+            out = np.empty((self.size, 3), dtype=np.uint8)
+        output_lut.apply(self.table, out, dimmed=False)
+        return out
+
+    def error_report(self, hls=None, pixels=100000, seed=0):
+        """
+        Compares the table with hls_to_rgb() on the HLS colors hls (by
+        default, random colors), and returns the maximum, mean and 99th
+        percentile of the absolute error per channel, in 8-bit levels
+        """
+        if hls is None:
+            hls = np.random.RandomState(seed).random_sample((pixels, 3)).astype(np.float32)
+        exact = hls_to_rgb(hls)
+        np.clip(exact, 0.0, 1.0, exact)
+        error = self.table[self.index(hls, np.empty(len(hls), dtype=np.int32))] / float(LEVELS - 1)
+        error -= exact
+        np.absolute(error, error)
+        error *= 255.0
+        return {"bits": self.bits, "colors": self.size, "pixels": len(hls),
+                "max": float(error.max()), "mean": float(error.mean()),
+                "p99": float(np.percentile(error, 99))}
+
+
+class IndexedFrame:
+    """
+    A frame converted by a ColorLUT: the table index of each pixel.  In color
+    LUT mode, RGB8 output drivers are given these instead of 16-bit frames,
+    and OutputDriver.to_rgb8() turns them into the client's output with the
+    folded table.
+    """
+
+    def __init__(self, lut, index):
+        self.lut = lut
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
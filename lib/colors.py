@@ -16,8 +16,17 @@
 # along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
 
 import colorsys
+import threading
+
 import numpy as np
 
+from lib.buffer_utils import BufferUtils
+
+# The colorspaces of a frame buffer, an (N, 3) float32 array of [[H, L, S]]
+# or [[R, G, B]] pixels
+HLS = "HLS"
+RGB = "RGB"
+
 def float_to_uint8(float_color):
     """
     Converts a float color (0 to 1.0) to uint8 (0 to 255)
@@ -53,180 +62,309 @@ def blend_to_buffer(source, destination, progress, mode):
 
 
 def hls_blend(start, end, temporary_buffer, progress, mode, fade_length=1.0, ease_power=0.5):
-    p = abs(progress)
-
-    startPower = (1.0 - p) / fade_length
-    startPower = clip(0.0, startPower, 1.0)
-    startPower = pow(startPower, ease_power)
-
-    endPower = p / fade_length
-    endPower = clip(0.0, endPower, 1.0)
-    endPower = pow(endPower, ease_power)
-
-    h1,l1,s1 = start.T
-    h2,l2,s2 = end.T
-
-    l1clipped = l1
-    l2clipped = l2
-    np.clip(l1,0,1,l1clipped)
-    np.clip(l2,0,1,l2clipped)
-    np.clip(s1,0,1,s1)
-    np.clip(s2,0,1,s2)
-
-    startWeight = (1.0 - 2 * np.abs(0.5 - l1clipped)) * s1
-    endWeight = (1.0 - 2 * np.abs(0.5 - l2clipped)) * s2
-
-    s = (s1 * startPower + s2 * endPower)
-    x1 = np.cos(2 * np.pi * h1) * startPower * startWeight
-    x2 = np.cos(2 * np.pi * h2) * endPower * endWeight
-    y1 = np.sin(2 * np.pi * h1) * startPower * startWeight
-    y2 = np.sin(2 * np.pi * h2) * endPower * endWeight
-    x = x1 + x2
-    y = y1 + y2
-
-    if progress >= 0:
-        l = np.maximum(l1 * startPower, l2 * endPower)
-        opposition = np.sqrt(np.square((x1-x2)/2) + np.square((y1-y2)/2))
-        if mode == 'multiply':
-            l = np.minimum(l1 * startPower, l2 * endPower)
-            #l -= opposition
-        elif mode == 'add':
-            l = np.maximum(l, opposition, l)
-    else: # hacky support for old blend
-        l = np.sqrt(np.square(x) + np.square(y)) / 2
-
-    h = np.arctan2(y, x) / (2*np.pi)
-
-    nocolor = (x * y == 0)
-    np.where(nocolor, h, 0)
-    np.where(nocolor, s, 0)
-
-    np.clip(l, 0, 1, l)
-
-    if temporary_buffer is not None:
-        frame = temporary_buffer
-        frame[:, 0] = h
-        frame[:, 1] = l
-        frame[:, 2] = s
-    else:
-        frame = np.asarray([h, l, s]).T
-
-    return frame
-
-def rgb_to_hls(arr):
-    """ fast rgb_to_hls using numpy array """
-
-    # adapted from Arnar Flatberg
-    # http://www.mail-archive.com/numpy-discussion@scipy.org/msg06147.html
-
-    arr = arr.astype("float32") / 255.0
-    out = np.empty_like(arr)
-
-    arr_max = arr.max(-1)
-    delta = arr.ptp(-1)
-    arr_min = arr.min(-1)
-    total = arr_max + arr_min
-
-    l = total / 2.0
-
-    if total.all() > 0:
-        s = delta / total
-        idx = (l > 0.5)
-        s[idx] = delta[idx] / (2.0 - total[idx])
-
-        # red is max
-        idx = (arr[:,:,0] == arr_max)
-        out[idx, 0] = (arr[idx, 1] - arr[idx, 2]) / delta[idx]
+    """
+    Blends two HLS frames with a blender owned by the calling thread (see
+    HLSBlender.blend)
+    """
+    blender = getattr(_thread_scratch, "hls_blender", None)
+    if blender is None:
+        blender = _thread_scratch.hls_blender = HLSBlender(len(start))
+    return blender.blend(start, end, progress, mode, fade_length, ease_power, temporary_buffer)
 
-        # green is max
-        idx = (arr[:,:,1] == arr_max)
-        out[idx, 0] = 2. + (arr[idx, 2] - arr[idx, 0] ) / delta[idx]
 
-        # blue is max
-        idx = (arr[:,:,2] == arr_max)
-        out[idx, 0] = 4. + (arr[idx, 0] - arr[idx, 1] ) / delta[idx]
+class HLSBlender:
+    """
+    Blends two HLS frames by adding their hues as vectors, weighted by
+    chroma, and combining lightness and saturation.  Owns its work arrays,
+    sized to the pixel buffer, so blending does not allocate.
+    """
+    ROWS = 10
+
+    def __init__(self, length=None):
+        if length is None:
+            length = BufferUtils.get_buffer_size()
+        self._rows = np.empty((self.ROWS, length), dtype=np.float32)
+
+    def blend(self, start, end, progress, mode='add', fade_length=1.0, ease_power=0.5, out=None):
+        """
+        Blends the (N, 3) HLS frames start and end, which are not modified,
+        into out (allocated if None, and may be start or end) and returns it.
+
+        start fades out and end fades in over the first fade_length of
+        progress (0 to 1), with powers eased by ease_power.  Lightness and
+        saturation are clipped to [0, 1] before blending.  In the output:
+
+        - H is the angle of the weighted sum of the hue vectors, in turns
+          from -0.5 to 0.5 (consumers wrap it)
+        - L is the brighter of the faded lightnesses, or the darker with
+          mode 'multiply'; mode 'add' raises it to half the distance between
+          the hue vectors, so opposite colors blend to white.  A negative
+          progress (the old blend) takes L from the length of the hue sum.
+          Clipped to [0, 1].
+        - S is the sum of the faded saturations, which is not clipped
+        """
+        if out is None:
+            out = np.empty((len(start), 3), dtype=np.float32)
+        if self._rows.shape[1] != len(start):
+            self._rows = np.empty((self.ROWS, len(start)), dtype=np.float32)
+        L1, S1, L2, S2, X1, Y1, X2, Y2, W, T = self._rows
+
+        p = abs(progress)
+        start_power = pow(clip(0.0, (1.0 - p) / fade_length, 1.0), ease_power)
+        end_power = pow(clip(0.0, p / fade_length, 1.0), ease_power)
+
+        # Hue vectors, scaled by chroma and power
+        for frame, power, L, S, X, Y in ((start, start_power, L1, S1, X1, Y1),
+                                         (end, end_power, L2, S2, X2, Y2)):
+            np.clip(frame[:, 1], 0, 1, L)
+            np.clip(frame[:, 2], 0, 1, S)
+            np.subtract(0.5, L, W)
+            np.absolute(W, W)
+            W *= 2
+            np.subtract(1.0, W, W)
+            W *= S
+            np.multiply(frame[:, 0], 2 * np.pi, T)
+            np.cos(T, X)
+            X *= power
+            X *= W
+            np.sin(T, Y)
+            Y *= power
+            Y *= W
+
+        # Lightness, into W
+        if progress >= 0:
+            np.multiply(L1, start_power, W)
+            np.multiply(L2, end_power, T)
+            if mode == 'multiply':
+                np.minimum(W, T, W)
+            else:
+                np.maximum(W, T, W)
+            if mode == 'add':
+                # Opposition of the hue vectors
+                np.subtract(X1, X2, L1)
+                L1 /= 2
+                np.square(L1, L1)
+                np.subtract(Y1, Y2, L2)
+                L2 /= 2
+                np.square(L2, L2)
+                L1 += L2
+                np.sqrt(L1, L1)
+                np.maximum(W, L1, W)
+
+        # Saturation, into S1, and the hue vector sum, into X1, Y1
+        S1 *= start_power
+        S2 *= end_power
+        S1 += S2
+        X1 += X2
+        Y1 += Y2
+
+        if progress < 0:
+            # hacky support for old blend
+            np.square(X1, W)
+            np.square(Y1, T)
+            W += T
+            np.sqrt(W, W)
+            W /= 2
+        np.clip(W, 0, 1, W)
+
+        np.arctan2(Y1, X1, T)
+        T /= 2 * np.pi
+
+        out[:, 0] = T
+        out[:, 1] = W
+        out[:, 2] = S1
+        return out
+
+def rgb_hue_rotation(turns):
+    """
+    Returns the 3x3 matrix that rotates the hue of RGB colors (as row
+    vectors, so rgb.dot(matrix)) by turns (1.0 is a full turn), about the
+    gray axis.  This keeps the average of the channels, and is close to, but
+    not the same as, shifting the HLS hue.
+    """
+    c = np.cos(2 * np.pi * turns)
+    s = np.sin(2 * np.pi * turns) / np.sqrt(3.0)
+    a = (1.0 - c) / 3.0
+    return np.array([[c + a, a + s, a - s],
+                     [a - s, c + a, a + s],
+                     [a + s, a - s, c + a]], dtype=np.float32)
+
+def convert(buffer, source, target, out=None):
+    """
+    Converts a frame buffer from colorspace source to target, into out if
+    given (which must not be buffer).  Returns buffer itself if the
+    colorspaces are the same.
+    """
+    if source == target:
+        return buffer
+    if target == RGB:
+        return hls_to_rgb(buffer, out)
+    return rgb_to_hls(buffer, out)
 
-        out[:,:,0] = (out[:,:,0]/6.0) % 1.0
-        out[:,:,1] = l
-        out[:,:,2] = s
+def clamp_frame(buffer, colorspace, out):
+    """
+    Writes buffer to out for output, with hue wrapped to [0, 1) and
+    lightness and saturation (or RGB) clipped to [0, 1].  buffer is left
+    alone, so presets that read back their last frame see what they wrote.
+    """
+    if colorspace == RGB:
+        np.clip(buffer, 0.0, 1.0, out)
+    else:
+        np.mod(buffer.T[0], 1.0, out.T[0])
+        np.clip(buffer.T[1], 0.0, 1.0, out.T[1])
+        np.clip(buffer.T[2], 0.0, 1.0, out.T[2])
+    return out
 
-        idx = (delta==0)
-        out[idx, 2] = 0.0
-        out[idx, 0] = 0.0
+def rgb_to_hls(rgb, out=None):
+    """
+    Converts RGB color array [[R,G,B]] (a list of pixels, or an image of
+    shape (height, width, 3)) to HLS, as float32, in out if given (which
+    may be rgb itself).  Integer input is taken to be 0..255, float input
+    0..1.
 
-        # remove NaN
-        out[np.isnan(out)] = 0
+    Every pixel goes through the same steps, without masks: sorting the
+    channels tracks which sextant the hue is in, after
+    http://lolengine.net/blog/2013/01/13/fast-rgb-to-hsv
+    Large inputs are converted in blocks that fit in the CPU cache.
 
+    Once warmed up, this only allocates if rgb or out are not contiguous.
+    """
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    pixels = rgb.reshape(-1, 3)
+    hls = out.reshape(-1, 3)
+    scale = 1.0 / 255.0 if pixels.dtype.kind in "ui" else 1.0
+    block = max(1, min(len(pixels), _BLOCK_SIZE))
+    staging = _scratch("rgb_to_hls_pixels", (block, 3))
+    channels = _scratch("rgb_to_hls", (7, block))
+    mask = _scratch("rgb_to_hls_mask", (block,), np.bool_)
+    for start in xrange(0, len(pixels), block):
+        end = min(start + block, len(pixels))
+        n = end - start
+        _rgb_to_hls_block(pixels[start:end], hls[start:end], scale, staging[:n], channels[:, :n], mask[:n])
+    if not np.may_share_memory(hls, out):
+        out[...] = hls.reshape(out.shape)
     return out
 
-def hls_to_rgb(hls):
+# Pixels converted at a time by rgb_to_hls
+_BLOCK_SIZE = 8192
+
+def _sort(high, low, t, u):
+    """
+    Sets high, low to max(high, low), min(high, low) with arithmetic only
+    """
+    np.add(high, low, t)
+    np.subtract(high, low, u)
+    np.absolute(u, u)
+    np.add(t, u, high)
+    np.subtract(t, u, low)
+    high *= 0.5
+    low *= 0.5
+
+def _rgb_to_hls_block(pixels, hls, scale, staging, channels, mask):
+    # Contiguous copies are much faster than converting strided channels
+    np.copyto(staging, pixels)
+    np.copyto(channels[:3], staging.T)
+    R, G, B, K, C, t, u = channels
+
+    # Sort G >= B, then R >= G, adjusting the hue offset K for each swap
+    np.less(G, B, mask)
+    np.copyto(K, mask.view(np.uint8))
+    np.negative(K, K)
+    _sort(G, B, t, u)
+    np.less(R, G, mask)
+    np.copyto(C, mask.view(np.uint8))
+    np.multiply(K, -2.0, u)
+    u -= 1.0 / 3.0
+    u *= C
+    K += u
+    _sort(R, G, t, u)
+
+    # R is now the highest channel: chroma is R - min(G, B)
+    np.subtract(G, B, u)
+    np.absolute(u, u)
+    np.add(G, B, t)
+    t -= u
+    t *= 0.5
+    np.subtract(R, t, C)
+    np.add(R, t, t)
+    np.multiply(t, 0.5 * scale, hls[:, 1])
+
+    # H = |K + (G - B) / 6C|, wrapped to [0, 1)
+    np.subtract(G, B, u)
+    np.multiply(C, 6.0, t)
+    t += 1e-20
+    u /= t
+    u += K
+    np.absolute(u, u)
+    np.greater_equal(u, 1.0, mask)
+    np.copyto(t, mask.view(np.uint8))
+    np.subtract(u, t, hls[:, 0])
+
+    # S = C / (1 - |2L - 1|)
+    np.multiply(hls[:, 1], 2.0, u)
+    u -= 1.0
+    np.absolute(u, u)
+    np.subtract(1.0, u, u)
+    np.maximum(u, 1e-20, u)
+    C *= scale
+    np.divide(C, u, hls[:, 2])
+
+def _scratch(name, shape, dtype=np.float32):
+    """
+    Returns a work array, owned by the calling thread and reused between
+    calls with the same shape
+    """
+    buffers = getattr(_thread_scratch, name, None)
+    if buffers is None:
+        buffers = {}
+        setattr(_thread_scratch, name, buffers)
+    buffer = buffers.get(shape)
+    if buffer is None:
+        buffer = buffers[shape] = np.empty(shape, dtype=dtype)
+    return buffer
+
+_thread_scratch = threading.local()
+
+def hls_to_rgb(hls, out=None):
     """
     Converts HLS color array [[H,L,S]] to RGB array.
 
     http://en.wikipedia.org/wiki/HSL_and_HSV#From_HSL
 
-    Returns [[R,G,B]] in [0..1]
+    Returns [[R,G,B]] in [0..1], as float32, in out if given (which must not
+    be hls).  Each channel is computed in one pass without branches, from
+    the distance d of the hue (in sextants, wrapped to [0, 6)) to the
+    channel's own hue (0, 2 and 4 for R, G and B):
 
-    Adapted from: http://stackoverflow.com/questions/4890373/detecting-thresholds-in-hsv-color-space-from-rgb-using-python-pil/4890878#4890878
-    """
+        C = (1 - |2L - 1|) * S
+        channel = L + C * (clip(||6H - n| - 3| - 1, 0, 1) - 0.5)
 
+    Once warmed up, this does not allocate.
+    """
+    if out is None:
+        out = np.empty(hls.shape, dtype=np.float32)
     H = hls[:, 0]
     L = hls[:, 1]
     S = hls[:, 2]
-
-    C = (1 - np.absolute(2 * L - 1)) * S
-
-    Hp = H * 6.0
-    i = Hp.astype(np.int)
-    #f = Hp - i  # |H' mod 2|  ?
-
-    X = C * (1 - np.absolute(np.mod(Hp, 2) - 1))
-    #X = C * (1 - f)
-
-    # initialize with zero
-    R = np.zeros(H.shape, float)
-    G = np.zeros(H.shape, float)
-    B = np.zeros(H.shape, float)
-
-    # handle each case:
-
-    #mask = (Hp >= 0) == ( Hp < 1)
-    mask = i % 6 == 0
-    R[mask] = C[mask]
-    G[mask] = X[mask]
-
-    #mask = (Hp >= 1) == ( Hp < 2)
-    mask = i == 1
-    R[mask] = X[mask]
-    G[mask] = C[mask]
-
-    #mask = (Hp >= 2) == ( Hp < 3)
-    mask = i == 2
-    G[mask] = C[mask]
-    B[mask] = X[mask]
-
-    #mask = (Hp >= 3) == ( Hp < 4)
-    mask = i == 3
-    G[mask] = X[mask]
-    B[mask] = C[mask]
-
-    #mask = (Hp >= 4) == ( Hp < 5)
-    mask = i == 4
-    R[mask] = X[mask]
-    B[mask] = C[mask]
-
-    #mask = (Hp >= 5) == ( Hp < 6)
-    mask = i == 5
-    R[mask] = C[mask]
-    B[mask] = X[mask]
-
-    m = L - 0.5*C
-    R += m
-    G += m
-    B += m
-
-    rgb = np.empty_like(hls)
-    rgb[:, 0] = R
-    rgb[:, 1] = G
-    rgb[:, 2] = B
-    return rgb
+    C, Hp, value = _scratch("hls_to_rgb", (3, len(hls)))
+
+    np.multiply(L, 2.0, C)
+    C -= 1.0
+    np.absolute(C, C)
+    np.subtract(1.0, C, C)
+    C *= S
+
+    np.mod(H, 1.0, Hp)
+    Hp *= 6.0
+    for channel, n in ((0, 0.0), (1, 2.0), (2, 4.0)):
+        np.subtract(Hp, n, value)
+        np.absolute(value, value)
+        value -= 3.0
+        np.absolute(value, value)
+        value -= 1.0
+        np.clip(value, 0.0, 1.0, value)
+        value -= 0.5
+        value *= C
+        np.add(value, L, out[:, channel])
+    return out
@@ -0,0 +1,259 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from lib.color_lut import IndexedFrame
+
+# Color formats a driver can ask for (see lib/color_modes.py)
+RGB8 = "RGB8"       # 8-bit RGB: the frame quantized to uint16, for OutputDriver.to_rgb8()
+HLSF32 = "HLSF32"   # The (N, 3) float HLS frame itself
+
+
+def color_order(color_mode):
+    """
+    Returns the channel order for a client color mode such as "RGB8" or
+    "GRB8", as indices into an RGB pixel
+    """
+    channels = color_mode[:3].upper() if color_mode else "RGB"
+    if sorted(channels) != ["B", "G", "R"]:
+        return (0, 1, 2)
+    return tuple("RGB".index(c) for c in channels)
+
+
+class OutputLUT:
+    """
+    Turns a frame quantized to 16 bits per channel into a client's 8-bit
+    output with one lookup per channel.  The tables bake in the client's
+    white balance, dimming and gamma (in that order) and its channel
+    order.  The white balance and gamma curves are computed once; a new
+    dimmer only rescales them, as dimming before the gamma curve is the
+    same as scaling after it by dimmer ** gamma.
+    """
+    LEVELS = 65536
+
+    def __init__(self, order=(0, 1, 2), gamma=1.0, white_balance=(1.0, 1.0, 1.0)):
+        self.order = order
+        self.gamma = gamma
+        self.white_balance = white_balance
+        self.dimmer = None
+        # Exact for the identity table: level * 255 / 65535 truncates to what
+        # truncating the unquantized value * 255 gives
+        levels = np.arange(self.LEVELS, dtype=np.float64) * 255.0 / (self.LEVELS - 1)
+        self._curves = np.empty((3, self.LEVELS), dtype=np.float64)
+        for i, channel in enumerate(self.order):
+            np.multiply(levels, self.white_balance[channel], self._curves[i])
+            if self.gamma != 1.0:
+                self._curves[i] = 255.0 * (self._curves[i] / 255.0) ** self.gamma
+        self._scaled = np.empty_like(self._curves)
+        self._undimmed = np.empty((3, self.LEVELS), dtype=np.uint8)
+        np.copyto(self._undimmed, np.clip(self._curves, 0, 255), casting='unsafe')
+        self._tables = np.zeros((3, self.LEVELS), dtype=np.uint8)
+        self._dim_table = np.arange(256, dtype=np.uint8)
+        self.set_dimmer(1.0)
+
+    def set_dimmer(self, dimmer):
+        if dimmer == self.dimmer:
+            return
+        self.dimmer = dimmer
+        scale = dimmer ** self.gamma
+        np.multiply(self._curves, scale, self._scaled)
+        np.clip(self._scaled, 0, 255, self._scaled)
+        np.copyto(self._tables, self._scaled, casting='unsafe')
+        # For dim(): the middle of each 8-bit level, scaled
+        values = (np.arange(256, dtype=np.float64) + 0.5) * scale
+        np.clip(values, 0, 255, values)
+        np.copyto(self._dim_table, values, casting='unsafe')
+
+    def apply(self, frame, out, dimmed=True):
+        """
+        Writes the 8-bit output of frame, an (N, 3) uint16 RGB array, to out,
+        without the dimmer if dimmed is False
+        """
+        tables = self._tables if dimmed else self._undimmed
+        for i, channel in enumerate(self.order):
+            np.take(tables[i], frame[:, channel], out=out[:, i], mode='clip')
+
+    def dim(self, rgb):
+        """
+        Applies the dimmer in place to the undimmed 8-bit output rgb, to
+        within a level of what apply() gives (for white balance up to 1)
+        """
+        if self.dimmer != 1.0:
+            np.take(self._dim_table, rgb, out=rgb)
+
+
+class OutputDriver:
+    """
+    Defines the interface for an output driver, which sends frames to one
+    kind of client (the client's "protocol" setting).
+
+    Drivers are plugins, loaded from the plugins directory like transitions.
+    Networking creates a driver for each enabled client of its protocol.
+    Every frame, the mixer output is converted once to each color format
+    the drivers ask for, and the result is shared by all of them; a driver
+    then builds its wire format into its own buffers in write(), and hands
+    it to its own send thread in send().  Both run on the output thread and
+    must not block.
+
+    A driver that sets `sender` to a core.networking.ClientSender gets
+    start(), stop(), stopped() and stats() from it.
+
+    RGB8 drivers get the frame quantized to 16 bits, shared by all of them,
+    and turn it into their client's 8-bit RGB with to_rgb8(), which applies
+    the client's gamma, white balance, dimming and color order in one
+    lookup.  They should build their packets in RGB order.  In color LUT
+    mode (see lib/color_lut.py), they are given an IndexedFrame instead,
+    which to_rgb8() converts with one gather, and one more lookup when
+    dimmed.
+
+    A client with a `max-fps` setting is only written to at that rate, on
+    its own schedule (see frame_due()).  With `"resample": "blend"`, RGB8
+    clients get each frame blended from the two mixer frames either side of
+    its scheduled time; otherwise they get the latest frame.
+    """
+    # The client protocols this driver speaks
+    protocols = ()
+    # The color format write() is given
+    color_format = RGB8
+
+    def __init__(self, client):
+        self.client = client
+        self.sender = None
+        self._lut = None
+        self._dimmer = 1.0
+        self._folded = None
+        self._folded_key = None
+        self._next_frame_time = None
+
+    def __repr__(self):
+        return "%s %s:%d" % (self.client.get("protocol", "Legacy"), self.client["host"], self.client["port"])
+
+    def dimmed(self):
+        """
+        Returns whether the frames given to this driver have the global
+        dimmer applied
+        """
+        return not self.client.get("ignore-dimming", False)
+
+    def update(self, client):
+        """
+        Called when the client's settings change.  Returns False if the
+        driver has to be recreated to apply them.
+        """
+        self.client = client
+        self._lut = None
+        return True
+
+    def frame_due(self, frame_time):
+        """
+        Called every frame with the time the mixer rendered it.  Returns the
+        time this client's next frame is scheduled for if it is due by then
+        (so it is no later than frame_time), or None to skip this frame.
+        """
+        rate = self.client.get("max-fps", 0)
+        if not rate:
+            return frame_time
+        period = 1.0 / rate
+        scheduled = self._next_frame_time
+        if scheduled is None or frame_time - scheduled >= period:
+            # First frame, or the mixer is slower than the client: start over
+            scheduled = frame_time
+        elif frame_time < scheduled:
+            return None
+        self._next_frame_time = scheduled + period
+        return scheduled
+
+    def blends(self):
+        """
+        Returns whether this client's frames are blended from the mixer
+        frames either side of their scheduled time
+        """
+        return (self.color_format == RGB8 and self.client.get("max-fps", 0) > 0
+                and self.client.get("resample", "latest") == "blend")
+
+    def set_dimmer(self, dimmer):
+        """
+        Called every frame with the mixer's global dimmer
+        """
+        self._dimmer = dimmer if self.dimmed() else 1.0
+
+    def to_rgb8(self, frame, out):
+        """
+        Writes the client's 8-bit RGB of a frame quantized to 16 bits, or of
+        an IndexedFrame, to out
+        """
+        if self._lut is None:
+            self._lut = OutputLUT(color_order(self.client.get("color-mode")), self.client.get("gamma", 1.0),
+                                  self.client.get("white-balance", (1.0, 1.0, 1.0)))
+        self._lut.set_dimmer(self._dimmer)
+        if isinstance(frame, IndexedFrame):
+            # The color LUT with this client's output LUT folded in, rebuilt
+            # when either changes.  The dimmer is left out, so changing it
+            # does not refold the whole table, and applied afterwards.
+            key = (frame.lut, self._lut)
+            if self._folded_key != key:
+                if self._folded is not None and len(self._folded) != frame.lut.size:
+                    self._folded = None
+                self._folded = frame.lut.fold(self._lut, self._folded)
+                self._folded_key = key
+            np.take(self._folded, frame.index, axis=0, out=out)
+            self._lut.dim(out)
+        else:
+            self._lut.apply(frame, out)
+
+    def start(self):
+        """
+        Starts the send thread
+        """
+        if self.sender is not None:
+            self.sender.start()
+
+    def write(self, frame, strands):
+        """
+        Builds the wire format of a frame.  strands is the list of (strand,
+        start, end) pixel extents of the enabled strands, and is the same
+        object for as long as the strands do not change.  The frame must not
+        be modified, as it is shared with other drivers.
+        """
+        pass
+
+    def send(self):
+        """
+        Hands the frame built by write() to the send thread
+        """
+        pass
+
+    def stop(self):
+        """
+        Stops the send thread
+        """
+        if self.sender is not None:
+            self.sender.stop()
+
+    def join(self, timeout=None):
+        if self.sender is not None:
+            self.sender.join(timeout)
+
+    def stopped(self):
+        return self.sender is not None and self.sender.stopped()
+
+    def stats(self):
+        """
+        Returns a dict of counters for this client (see ClientSender.stats)
+        """
+        return self.sender.stats() if self.sender is not None else {}
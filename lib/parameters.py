@@ -50,15 +50,31 @@ class Parameter:
 
     def set(self, value):
         if self.validate(value):
-            self._wibbler = None
-            self._value = value
-            self._valueString = str(value)
-            if self._parent is not None and self._parent.initialized:
-                self._parent.parameter_changed(self)
+            self._change(str(value), self._set, value)
             return True
         else:
             return False
 
+    def _set(self, value):
+        self._wibbler = None
+        self._value = value
+        self._valueString = str(value)
+
+    def _set_wibbler(self, valueString, wibbler):
+        self._wibbler = wibbler
+        self._value = numpy.random.random() * (self._wibbler._max - self._wibbler._min) + self._wibbler._min
+        self._valueString = valueString
+
+    def _change(self, valueString, apply, *args):
+        """
+        Changes the value with apply(*args), through the parent preset once
+        it is initialized (see Pattern._parameter_set)
+        """
+        if self._parent is not None and self._parent.initialized:
+            self._parent._parameter_set(self, valueString, apply, *args)
+        else:
+            apply(*args)
+
     def set_from_str(self, valueString):
         cval = None
         try:
@@ -67,11 +83,7 @@ class Parameter:
             try:
                 value = ast.literal_eval(valueString)
                 if len(value) == 3:
-                    self._wibbler = Wibbler(value)
-                    self._value = numpy.random.random() * (self._wibbler._max - self._wibbler._min) + self._wibbler._min
-                    self._valueString = valueString
-                    if self._parent is not None and self._parent.initialized:
-                        self._parent.parameter_changed(self)
+                    self._change(valueString, self._set_wibbler, valueString, Wibbler(value))
                     return True
                 return False
             except:
@@ -22,13 +22,26 @@ import colorsys
 
 from lib.json_dict import JSONDict
 from lib.buffer_utils import BufferUtils
+from lib.colors import HLS, RGB, hls_to_rgb, rgb_to_hls, _scratch
 from lib.parameters import BoolParameter
 
 log = logging.getLogger("firemix.lib.pattern")
 
 
 class Pattern(JSONDict):
-    """Base Pattern.  Does nothing."""
+    """
+    Base Pattern.  Does nothing.
+
+    The mixer only clips the copy of each frame it sends out, so a preset
+    that reads back its own buffer (for trails or feedback) has to keep
+    lightness and saturation in range itself.
+    """
+
+    # The colorspace of the pixel buffer (see lib/colors.py).  Presets that
+    # compute RGB should set this to RGB and draw with the RGB methods: the
+    # mixer then keeps their frames in RGB unless it has to blend them with
+    # an HLS preset.
+    colorspace = HLS
 
     def __init__(self, mixer, slug=""):
         self._mixer = mixer
@@ -40,6 +53,8 @@ class Pattern(JSONDict):
         self._instance_slug = slug
         self.initialized = False
         self.disabled = False
+        self.quality = 1.0
+        self._pooled_buffer = None
 
         filepath = os.path.join(os.getcwd(), "data", "presets", "".join([slug, ".json"]))
         JSONDict.__init__(self, 'preset', filepath, True)
@@ -95,9 +110,29 @@ class Pattern(JSONDict):
 
     def init_pixels(self):
         """
-        Sets up the pixel array
+        Sets up the pixel array.  The preset keeps its pooled buffer until it
+        is removed from the playlist (see release_buffer), and clears it on
+        every reset; a buffer left over from a scene of another size is
+        replaced.
+        """
+        if (self._pooled_buffer is not None and
+                self._pooled_buffer.shape != (BufferUtils.get_buffer_size(), 3)):
+            BufferUtils.release_buffer(self._pooled_buffer)
+            self._pooled_buffer = None
+        if self._pooled_buffer is None:
+            self._pooled_buffer = BufferUtils.acquire_buffer()
+        else:
+            self._pooled_buffer.fill(0.0)
+        self._pixel_buffer = self._pooled_buffer
+
+    def release_buffer(self):
+        """
+        Hands the pooled buffer back to BufferUtils.  Only call this once the
+        preset is no longer rendered; the next reset acquires a new one.
         """
-        self._pixel_buffer = BufferUtils.create_buffer()
+        BufferUtils.release_buffer(self._pooled_buffer)
+        self._pooled_buffer = None
+        self._pixel_buffer = None
 
     def setup(self):
         """
@@ -111,6 +146,39 @@ class Pattern(JSONDict):
         """
         pass
 
+    def _parameter_set(self, parameter, value, apply, *args):
+        """
+        Called by a parameter to change its value to the string value with
+        apply(*args).  While a show is being recorded, the change is held
+        back to the start of the next frame like audio input (see
+        ShowRecorder).
+        """
+        def change():
+            apply(*args)
+            self.parameter_changed(parameter)
+
+        recorder = getattr(self._mixer, 'recorder', None)
+        if recorder is not None:
+            recorder.parameter(self, parameter, value, change)
+        else:
+            change()
+
+    def set_quality(self, quality):
+        """
+        Called by the mixer's frame governor to ask the preset to trade detail
+        for speed when frames run late, and to restore it when there is
+        headroom again.  quality is in (0, 1]; 1.0 is full quality.
+        """
+        self.quality = quality
+        self.quality_changed(quality)
+
+    def quality_changed(self, quality):
+        """
+        Override this method to lower the cost of draw() for quality < 1.0,
+        for example by rendering fewer noise samples or fewer rings.
+        """
+        pass
+
     def can_transition(self):
         """
         Override this method to define clear points at which the mixer can
@@ -179,7 +247,7 @@ class Pattern(JSONDict):
 
     def tick_rate(self):
         # TODO: should have a different way of getting to the mixer settings
-        return self._mixer.get_tick_rate()
+        return self._mixer.get_effective_tick_rate()
 
     def _convert_color(self, color):
         if (type(color[0]) == float) or (type(color[1]) == float) or (type(color[2]) == float) or (type(color[1]) ==np.float32):
@@ -198,22 +266,24 @@ class Pattern(JSONDict):
 
     def current_color(self, address):
         """
-        Returns the current color of a pixel in RGB float
+        Returns the current color of a pixel, in the preset's colorspace
         address is a tuple of (strand, fixture, pixel)
         """
         return self._pixel_buffer[address]
 
     def setPixelHLS(self, index, color):
+        if self.colorspace == RGB:
+            color = colorsys.hls_to_rgb(*color)
         self._pixel_buffer[index] = color
 
     def setPixelRGB(self, index, color):
-        self.setPixelHLS(index, colorsys.rgb_to_hls(*color))
+        if self.colorspace == RGB:
+            self._pixel_buffer[index] = color
+        else:
+            self._pixel_buffer[index] = colorsys.rgb_to_hls(*color)
 
     def setPixelHSV(self, index, color):
-        # There's probably a more efficient way to do this:
-        hls = colorsys.rgb_to_hls(*colorsys.hsv_to_rgb(*color))
-
-        self.setPixelHLS(index, hls)
+        self.setPixelRGB(index, colorsys.hsv_to_rgb(*color))
 
     def setAllHLS(self, hues, luminances, saturations):
         """
@@ -222,3 +292,18 @@ class Pattern(JSONDict):
         self._pixel_buffer[:,0] = hues
         self._pixel_buffer[:,1] = luminances
         self._pixel_buffer[:,2] = saturations
+        if self.colorspace == RGB:
+            # hls_to_rgb can't write over its input, so go through scratch
+            rgb = _scratch("set_all_hls", self._pixel_buffer.shape)
+            self._pixel_buffer[:] = hls_to_rgb(self._pixel_buffer, rgb)
+
+    def setAllRGB(self, reds, greens, blues):
+        """
+        Sets the entire buffer from red, green and blue values (or lists) in
+        [0..1].  This is free for RGB presets.
+        """
+        self._pixel_buffer[:,0] = reds
+        self._pixel_buffer[:,1] = greens
+        self._pixel_buffer[:,2] = blues
+        if self.colorspace == HLS:
+            rgb_to_hls(self._pixel_buffer, self._pixel_buffer)
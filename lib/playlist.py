@@ -250,6 +250,9 @@ class Playlist(JSONDict):
         """
         Enables or disables playlist shuffle
         """
+        self._app.mixer.record_event("shuffle_mode", self._shuffle_mode, shuffle)
+
+    def _shuffle_mode(self, shuffle):
         self._shuffle = shuffle
         self.update_next_preset()
 
@@ -288,12 +291,20 @@ class Playlist(JSONDict):
                 p.disabled = True
                 log.error("Disabling %s because the preset is crashing." % p.name())
 
+    def quarantine_preset(self, preset):
+        preset.disabled = True
+        # The buffer the mixer reads, which is in shared memory when the
+        # preset renders in the render pool
+        self._app.mixer.get_preset_buffer(preset).fill(0.0)
+        log.error("Disabling %s because the preset keeps rendering bad pixels." % preset.name())
+
     def module_reloaded(self, module_name):
         to_rebuild = [(i, p) for (i, p) in enumerate(self._playlist) if p.__module__ == module_name]
 
         for idx, preset in to_rebuild:
             preset_data = self.load_preset_from_file(preset.slug())
             new_inst = self.get_preset_from_json_data(preset_data, preset.slug())
+            self._release_preset(preset)
             self._playlist[idx] = new_inst
 
             if self.active_preset is preset:
@@ -361,6 +372,9 @@ class Playlist(JSONDict):
 
     def set_active_preset_by_name(self, name):
         #TODO: Support transitions other than jump cut
+        self._app.mixer.record_event("set_active_preset_by_name", self._set_active_preset_by_name, name)
+
+    def _set_active_preset_by_name(self, name):
         for i, preset in enumerate(self._playlist):
             if preset.name() == name:
                 preset._reset()
@@ -463,12 +477,23 @@ class Playlist(JSONDict):
         pl = [(i, p) for i, p in enumerate(self._playlist) if p.name() == name]
         assert len(pl) == 1
 
+        self._release_preset(pl[0][1])
         self._playlist.remove(pl[0][1])
 
         self.playlist_mutated()
         self.changed()
         return True
 
+    def _release_preset(self, preset):
+        """
+        Returns the pooled buffer of a preset that is leaving the playlist,
+        unless the mixer may still be rendering it this frame
+        """
+        playing = [self.active_preset, self.next_preset]
+        playing.extend(layer.preset for layer in self._app.mixer.get_layers())
+        if not any(p is preset for p in playing):
+            preset.release_buffer()
+
     def clone_preset(self, old_name):
         old = self.get_preset_by_name(old_name)
         classname = old.__class__.__name__
@@ -489,6 +514,8 @@ class Playlist(JSONDict):
         self.changed()
 
     def clear_playlist(self):
+        for preset in self._playlist:
+            self._release_preset(preset)
         self._playlist = []
         self.playlist_mutated()
         self.changed()
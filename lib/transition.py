@@ -15,16 +15,28 @@
 # You should have received a copy of the GNU General Public License
 # along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
 
+from lib.buffer_utils import BufferUtils
+from lib.colors import HLS
+
 
 class Transition:
     """
     Defines the interface for a transition.
 
     Given two numpy arrays and a progress (0 to 1.0), it produces one output array.
+
+    Both arrays are in the same colorspace, one of `colorspaces`; the mixer
+    converts a preset's frame when the two presets do not share one the
+    transition supports, and sets `colorspace` before calling get().  The
+    output is in that colorspace too.
     """
+    # The colorspaces get() can blend in (see lib/colors.py)
+    colorspaces = (HLS,)
 
     def __init__(self, app):
         self._app = app
+        self._frame = None
+        self.colorspace = HLS
 
     def __repr__(self):
         """
@@ -44,6 +56,23 @@ class Transition:
         """
         pass
 
+    def get_frame(self):
+        """
+        Returns a pooled buffer to write the output frame into.  The same
+        buffer is returned until release_frame() is called.
+        """
+        if self._frame is None:
+            self._frame = BufferUtils.acquire_buffer()
+        return self._frame
+
+    def release_frame(self):
+        """
+        Called by the mixer when the transition has finished, to return the
+        output frame to the buffer pool
+        """
+        BufferUtils.release_buffer(self._frame)
+        self._frame = None
+
     def get(self, start, end, progress):
         """
         This method will return a frame that is between start and end, according to progress
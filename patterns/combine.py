@@ -34,7 +34,10 @@ class CombinePresets(Pattern):
         super(CombinePresets, self).setup()
 
     def parameter_changed(self, parameter):
-        self._transition = self._mixer.get_transition_by_name(self.parameter('transition-mode').get())
+        # Keep the transition (and its output frame) unless the mode changed
+        mode = self.parameter('transition-mode').get()
+        if getattr(self, '_transition', None) is None or str(self._transition) != mode:
+            self._transition = self._mixer.get_transition_by_name(mode)
         if self._transition:
             self._transition.reset()
 
@@ -18,14 +18,19 @@
 import random
 import math
 import numpy as np
-from lib.colors import hls_blend
 from PySide.QtGui import QPixmap
 
 from lib.pattern import Pattern
 from lib.parameters import FloatParameter, StringParameter
-from lib.colors import rgb_to_hls
+from lib.colors import RGB, rgb_hue_rotation
 
 class ImagePattern(Pattern):
+    """
+    Draws a rotating, orbiting image.  Renders in RGB, so the image is used
+    as it is, with no conversion to HLS and back.
+    """
+    colorspace = RGB
+
     def setup(self):
         self.add_parameter(FloatParameter('speed-rotation', 0.1))
         self.add_parameter(FloatParameter('speed-hue', 0.0))
@@ -48,7 +53,6 @@ class ImagePattern(Pattern):
         self.hue_offset = 0
         self.imagename = None
         self.image = None
-        self._buffer = None
 
         super(ImagePattern, self).setup()
 
@@ -64,7 +68,7 @@ class ImagePattern(Pattern):
 
                 self.image = np.asarray((self.image[2],self.image[1],self.image[0])).T
 
-                self.image = rgb_to_hls(self.image)
+                self.image = self.image.astype(np.float32) / 255.0
                 #print self.image
 
                 #print "image", self.parameter('image-file').get(), "loaded:", self.image.shape
@@ -118,15 +122,17 @@ class ImagePattern(Pattern):
 
             colors = self.image[locations.T[1], locations.T[0]]
 
-            colors.T[0] += self.hue_offset
-            colors.T[1] += self.lum_boost
+            if self.hue_offset % 1.0:
+                colors = colors.dot(rgb_hue_rotation(self.hue_offset))
+            # Adding to every channel raises the lightness by the same amount
+            colors += self.lum_boost
 
             ghost = self.parameter('ghost').get()
             if abs(ghost) > 0:
-                if self.lastFrame != None:
-                    if self._buffer is None:
-                        self._buffer = np.empty_like(self.lastFrame)
-                    colors = hls_blend(colors, self.lastFrame, self._buffer, ghost, "add", 1.0, 0.1)
+                if self.lastFrame is not None:
+                    # Like an additive hls_blend: the brighter of the faded frames
+                    ghost = min(abs(ghost), 1.0)
+                    np.maximum(colors * pow(1.0 - ghost, 0.1), self.lastFrame * pow(ghost, 0.1), colors)
                 self.lastFrame = colors
 
             lum_time = self.parameter('beat-lum-time').get()
@@ -58,6 +58,7 @@ class SimplexNoise(Pattern):
         self.pixel_locations = np.asarray(self.scene().get_all_pixel_locations())
 
         self.color_lookup = {}
+        self._noise_step = 1
         self._setup_pars()
 
         super(SimplexNoise, self).setup()
@@ -68,6 +69,10 @@ class SimplexNoise(Pattern):
     def reset(self):
         self._setup_pars()
 
+    def quality_changed(self, quality):
+        # Sample the noise at every n-th pixel and hold the value in between
+        self._noise_step = max(1, int(round(1.0 / quality)))
+
     def _setup_pars(self):
         self.hue_min = self.parameter('hue-min').get()
         self.hue_max = self.parameter('hue-max').get()
@@ -97,7 +102,9 @@ class SimplexNoise(Pattern):
         locations = np.asarray([x,y]).T
 
         luminance_scale = self.parameter('luminance-scale').get() / 100.0
-        brights = np.asarray([snoise3(luminance_scale * location[0], luminance_scale * location[1], self._offset_z, 1, 0.5, 0.5) for location in locations])
+        brights = np.asarray([snoise3(luminance_scale * location[0], luminance_scale * location[1], self._offset_z, 1, 0.5, 0.5) for location in locations[::self._noise_step]])
+        if self._noise_step > 1:
+            brights = np.repeat(brights, self._noise_step)[:len(locations)]
         brights = (1.0 + brights) / 2
         brights *= self._luminance_steps
         LS = self.lum_fader.color_cache[np.int_(brights)].T
@@ -171,5 +171,6 @@ class TestFFT(Pattern):
         np.minimum(self.pixel_amplitudes, 1, self.pixel_amplitudes)
         colors.T[1] *= np.power(self.pixel_amplitudes - self.parameter('fft-bias').get(), self.parameter('fft-gamma').get())
         colors.T[1] = self._pixel_buffer.T[1] * self.parameter('ghosting').get() + colors.T[1]
+        np.clip(colors.T[1], 0.0, 1.0, colors.T[1])
 
         self._pixel_buffer = colors
@@ -128,7 +128,12 @@ class Twinkle(Pattern):
 
             currentTimes = self._current_time - self.ringTimes
             ringLife = self.parameter('audio-ring-lifetime').get()
-            for pixel in np.where(currentTimes < ringLife)[0]:
+            live = np.where(currentTimes < ringLife)[0]
+            if self.quality < 1.0 and len(live):
+                # Only draw the youngest rings
+                max_rings = int(math.ceil(len(live) * self.quality))
+                live = live[np.argsort(currentTimes[live])[:max_rings]]
+            for pixel in live:
                 if self.ringTimes[pixel] > 0:
                     #print pixel
                     ringWidth = self.parameter('audio-ring-width').get()
@@ -218,3 +223,6 @@ class Twinkle(Pattern):
                 self._idle = np.append(self._idle, self._fading_up[finished])
                 self._fading_up = self._fading_up[np.logical_not(finished)]
                 self._time[finished] = self._current_time
+
+        # Rings add to the lightness, so keep it in range for the next frame
+        np.clip(self._pixel_buffer.T[1], 0.0, 1.0, self._pixel_buffer.T[1])
@@ -37,7 +37,6 @@ class AdditiveBlend(Transition):
 
     def reset(self):
         self.buffer_len = BufferUtils.get_buffer_size()
-        self.frame = np.tile(np.array([0.0], dtype=np.float), (self.buffer_len, 3))
 
     def get(self, start, end, progress):
 
@@ -82,12 +81,15 @@ class AdditiveBlend(Transition):
 
         sats = (start_transpose[2] * startWeight + end_transpose[2] * endWeight).clip(0,1)
 
-        self.frame = np.asarray([hues, lums, sats]).T
+        frame = self.get_frame()
+        frame.T[0] = hues
+        frame.T[1] = lums
+        frame.T[2] = sats
 
         """
         if np.random.random() > 0.95:
-            print "progress %.2f," % progress, '%.2f' % start[0][0][0], '%.2f' % start[0][0][1], '%.2f' % start[0][0][2], "+", '%.2f' % end[0][0][0], '%.2f' % end[0][0][1], '%.2f' % end[0][0][2], "=", '%.2f' % self.frame[0][0][0], '%.2f' % self.frame[0][0][1], '%.2f' % self.frame[0][0][2]
+            print "progress %.2f," % progress, '%.2f' % start[0][0][0], '%.2f' % start[0][0][1], '%.2f' % start[0][0][2], "+", '%.2f' % end[0][0][0], '%.2f' % end[0][0][1], '%.2f' % end[0][0][2], "=", '%.2f' % frame[0][0], '%.2f' % frame[0][1], '%.2f' % frame[0][2]
             print "    delta %.2f" % hueDelta[0][0], useAlternatePath[0][0], "oppo %.2f" % opposition[0][0], "sW %.2f" % startWeight[0][0], "eW %.2f" % endWeight[0][0], "sP %.2f" % startPower, "eP %.2f" % endPower
         """
 
-        return self.frame
+        return frame
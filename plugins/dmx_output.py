@@ -0,0 +1,59 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+from core import networking
+from lib.output_driver import OutputDriver
+
+
+class DMXDriver(OutputDriver):
+    """
+    sACN (E1.31) and Art-Net: the strands are mapped to DMX universes by
+    the client's "universes" setting (see universe_spans), and each frame
+    of universes is sent as one batch
+    """
+    protocols = ("sACN", "ArtNet")
+
+    def __init__(self, client):
+        OutputDriver.__init__(self, client)
+        # A frame of universes goes out in one batch, so it is not paced by default
+        self.sender = networking.DMXSender(client["host"], client["port"],
+                                           client.get("max-packets-per-second", 0),
+                                           client.get("max-bytes-per-second", 0),
+                                           client.get("multicast", False))
+        self._strands = None
+        self._packets = None
+
+    def update(self, client):
+        if client.get("multicast", False) != self.client.get("multicast", False):
+            return False
+        OutputDriver.update(self, client)
+        self.sender.set_rate(client.get("max-packets-per-second", 0), client.get("max-bytes-per-second", 0))
+        # The universe mapping may have changed
+        self._strands = None
+        return True
+
+    def write(self, frame, strands):
+        if strands is not self._strands:
+            self._strands = strands
+            self._packets = networking.DMXPackets(self.client["protocol"],
+                                                  networking.universe_spans(self.client, strands), len(frame),
+                                                  priority=self.client.get("priority", 100))
+        self.to_rgb8(frame, self._packets.rgb)
+        self._packets.fill()
+
+    def send(self):
+        self.sender.send_universes(self._packets, self._packets.snapshot())
@@ -18,12 +18,14 @@
 import numpy as np
 
 from lib.transition import Transition
+from lib.colors import HLS, RGB
 from lib.buffer_utils import BufferUtils
 
 
 class FixtureStep(Transition):
     """
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -43,8 +45,9 @@ class FixtureStep(Transition):
         self.last_idx = 0
 
     def get(self, start, end, progress):
-        start[self.mask] = 0.0
-        end[np.invert(self.mask)] = 0.0
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=self.mask)
 
         idx = int(progress * len(self.rand_index))
         for i in range(self.last_idx, idx):
@@ -53,4 +56,4 @@ class FixtureStep(Transition):
             self.mask[pix_start:pix_end][:] = True
         self.last_idx = idx
 
-        return (start) + (end)
+        return frame
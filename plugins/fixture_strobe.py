@@ -18,12 +18,14 @@
 import numpy as np
 
 from lib.transition import Transition
+from lib.colors import HLS, RGB
 from lib.buffer_utils import BufferUtils
 
 
 class FixtureStrobe(Transition):
     """
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -47,8 +49,9 @@ class FixtureStrobe(Transition):
         self.last_idx = 0
 
     def get(self, start, end, progress):
-        start[self.mask] = 0.0
-        end[np.invert(self.mask)] = 0.0
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=self.mask)
 
         idx = int(progress * len(self.rand_index))
         for i in range(self.last_idx, idx):
@@ -66,4 +69,4 @@ class FixtureStrobe(Transition):
                 self._strobing.remove(fix)
                 self.mask[pix_start:pix_end][:] = True
 
-        return (start) + (end)
+        return frame
@@ -19,12 +19,13 @@ import numpy as np
 
 from lib.transition import Transition
 from lib.buffer_utils import BufferUtils
-from lib.colors import clip
+from lib.colors import HLS, RGB, clip
 
 
 class Fuzz(Transition):
     """
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -63,7 +64,8 @@ class Fuzz(Transition):
                 self.mask.flat[offset + 2] = False
         self.last_idx = idx
 
-        start[self.mask] = 0.0
-        end[np.invert(self.mask)] = 0.0
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=self.mask)
 
-        return (start) + (end)
+        return frame
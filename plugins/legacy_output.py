@@ -0,0 +1,52 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+from core import networking
+from lib.output_driver import OutputDriver
+
+
+class LegacyDriver(OutputDriver):
+    """
+    FireMix's own UDP protocol: a "B" packet, one packet per strand, then "E"
+    """
+    protocols = ("Legacy",)
+
+    def __init__(self, client):
+        OutputDriver.__init__(self, client)
+        self.sender = networking.ClientSender(client["host"], client["port"],
+                                              client.get("max-packets-per-second", 1000),
+                                              client.get("max-bytes-per-second", 0),
+                                              client.get("keyframe-interval", 0))
+        self._strands = None
+        self._packets = None
+
+    def update(self, client):
+        OutputDriver.update(self, client)
+        self.sender.set_rate(client.get("max-packets-per-second", 1000), client.get("max-bytes-per-second", 0))
+        self.sender.keyframe_interval = client.get("keyframe-interval", 0)
+        return True
+
+    def write(self, frame, strands):
+        if strands is not self._strands:
+            self._strands = strands
+            self._packets = networking.StrandPackets(strands, len(frame))
+        self.to_rgb8(frame, self._packets.rgb)
+        self._packets.fill()
+
+    def send(self):
+        # The sender gets an immutable snapshot, since the packets are rebuilt in place next frame
+        self.sender.send_frame(["B"], self._packets.snapshot(), ["E"])
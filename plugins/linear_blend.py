@@ -15,9 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
 
-import numpy as np
-
-from lib.colors import hls_blend
+from lib.colors import HLSBlender
 from lib.transition import Transition
 
 class LinearBlend(Transition):
@@ -28,12 +26,10 @@ class LinearBlend(Transition):
 
     def __init__(self, app):
         Transition.__init__(self, app)
-        self._buffer = None
+        self._blender = HLSBlender()
 
     def __str__(self):
         return "Linear Blend"
 
     def get(self, start, end, progress, fade_length=0.6):
-        if self._buffer is None:
-            self._buffer = np.empty_like(start)
-        return hls_blend(start, end, self._buffer, progress, 'add', fade_length, 1.0)
+        return self._blender.blend(start, end, progress, 'add', fade_length, 1.0, self.get_frame())
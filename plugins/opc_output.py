@@ -0,0 +1,63 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+from core import networking
+from lib.output_driver import OutputDriver
+
+
+class OPCDriver(OutputDriver):
+    """
+    Open Pixel Control, over a persistent TCP connection (see OPCSender), or
+    as UDP datagrams with "transport": "udp".
+    """
+    protocols = ("OPC",)
+
+    def __init__(self, client):
+        OutputDriver.__init__(self, client)
+        if client.get("transport", "tcp") == "tcp":
+            sender_class = networking.OPCSender
+        else:
+            sender_class = networking.ClientSender
+        self.sender = sender_class(client["host"], client["port"],
+                                   client.get("max-packets-per-second", 1000),
+                                   client.get("max-bytes-per-second", 0),
+                                   client.get("keyframe-interval", 0))
+        self._strands = None
+        self._packets = None
+
+    def update(self, client):
+        if client.get("transport", "tcp") != self.client.get("transport", "tcp"):
+            return False
+        OutputDriver.update(self, client)
+        self.sender.set_rate(client.get("max-packets-per-second", 1000), client.get("max-bytes-per-second", 0))
+        self.sender.keyframe_interval = client.get("keyframe-interval", 0)
+        return True
+
+    def write(self, frame, strands):
+        if strands is not self._strands:
+            self._strands = strands
+            self._packets = networking.StrandPackets(strands, len(frame))
+        self.to_rgb8(frame, self._packets.rgb)
+        # OPC happens to look a lot like our existing protocol...
+        # Byte 0 is channel (aka strand).  0 is broadcast address, indexing starts at 1.
+        # Byte 1 is command, always 0 for "set pixel colors"
+        # Bytes 2 and 3 are big-endian length of the data block.
+        # Note: LEDScape needs the strands all concatenated together which is annoying
+        self._packets.fill_opc()
+
+    def send(self):
+        self.sender.send_frame([], [self._packets.opc_snapshot()], [])
@@ -19,6 +19,7 @@ import numpy as np
 import math
 
 from lib.transition import Transition
+from lib.colors import HLS, RGB
 from lib.buffer_utils import BufferUtils
 
 
@@ -26,6 +27,7 @@ class RadialWipe(Transition):
     """
     Implements a radial wipe (Iris) transition
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -42,7 +44,14 @@ class RadialWipe(Transition):
         self.distances /= max(self.distances)
 
     def get(self, start, end, progress):
-        buffer = np.where(self.distances < progress, end.T, start.T)
-        buffer[1][np.abs(self.distances - progress) < 0.02] += 0.5 # we can apply effects to transition line here
-
-        return buffer.T
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=(self.distances < progress)[:, np.newaxis])
+        line = np.abs(self.distances - progress) < 0.02
+        # we can apply effects to transition line here
+        if self.colorspace == RGB:
+            frame[line] += 0.5
+        else:
+            frame.T[1][line] += 0.5
+
+        return frame
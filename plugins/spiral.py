@@ -20,6 +20,7 @@ from math import fmod, fabs, sqrt, pow, tan, pi, atan2
 from copy import deepcopy
 
 from lib.transition import Transition
+from lib.colors import HLS, RGB
 from lib.buffer_utils import BufferUtils
 
 
@@ -27,6 +28,7 @@ class Spiral(Transition):
     """
     Spiral wipe
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -77,9 +79,10 @@ class Spiral(Transition):
                 self.mask[pixel][:] = True
                 self.active[pixel] = False
 
-        start[self.mask] = 0.0
-        end[np.invert(self.mask)] = 0.0
-        return start + end
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=self.mask)
+        return frame
 
     def _is_point_inside_wipe(self, point, progress):
         return np.dot((point - self.wipe_point), self.wipe_vector) >= 0
@@ -19,11 +19,13 @@ import numpy as np
 import math
 
 from lib.transition import Transition
+from lib.colors import HLS, RGB
 
 class Wipe(Transition):
     """
     Implements a simple wipe
     """
+    colorspaces = (HLS, RGB)
 
     def __init__(self, app):
         Transition.__init__(self, app)
@@ -47,8 +49,14 @@ class Wipe(Transition):
         self.dots /= maxDot - minDot
 
     def get(self, start, end, progress):
-        buffer = np.where(self.dots < progress, end.T, start.T)
-        buffer[1][np.abs(self.dots - progress) < 0.02] += 0.5 # we can apply effects to transition line here
-        buffer = buffer.T
-
-        return buffer
+        frame = self.get_frame()
+        np.copyto(frame, start)
+        np.copyto(frame, end, where=(self.dots < progress)[:, np.newaxis])
+        line = np.abs(self.dots - progress) < 0.02
+        # we can apply effects to transition line here
+        if self.colorspace == RGB:
+            frame[line] += 0.5
+        else:
+            frame.T[1][line] += 0.5
+
+        return frame
@@ -0,0 +1,92 @@
+# This file is part of Firemix.
+#
+# Copyright 2013-2016 Jonathan Evans <jon@craftyjon.com>
+#
+# Firemix is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Firemix is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Firemix.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+import zmq
+
+from core import networking
+from lib.output_driver import OutputDriver
+
+log = logging.getLogger("firemix.plugins.zmq_output")
+
+
+class ZMQDriver(OutputDriver):
+    """
+    Publishes frames (see ZMQPublisher) on a PUB socket bound to the
+    client's port, for FireSim.  Sending is done by ZMQ's own I/O thread.
+    """
+    protocols = ("ZMQ",)
+
+    def __init__(self, client):
+        OutputDriver.__init__(self, client)
+        self._socket = None
+        self._publisher = None
+        self._stopped = False
+        self._strands = None
+        self._packets = None
+        self.frames_sent = 0
+        self.errors = 0
+
+    def update(self, client):
+        # The socket is bound to the client's port, which is part of the
+        # client's key, so everything else can change freely
+        OutputDriver.update(self, client)
+        return True
+
+    def start(self):
+        self._socket = zmq.Context.instance().socket(zmq.PUB)
+        # Subscribers only ever get the newest frame
+        self._socket.setsockopt(zmq.SNDHWM, 1)
+        self._socket.setsockopt(zmq.CONFLATE, 1)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        try:
+            self._socket.bind("tcp://*:%d" % self.client["port"])
+        except zmq.ZMQError as e:
+            log.error("Could not publish frames on port %d: %s" % (self.client["port"], e))
+            self.errors += 1
+            self._socket.close()
+            self._socket = None
+            return
+        self._publisher = networking.ZMQPublisher(self._socket)
+
+    def write(self, frame, strands):
+        if strands is not self._strands:
+            self._strands = strands
+            self._packets = networking.StrandPackets(strands, len(frame))
+        self.to_rgb8(frame, self._packets.rgb)
+
+    def send(self):
+        if self._publisher is not None:
+            self._publisher.publish(self._packets)
+            self.frames_sent += 1
+
+    def stop(self):
+        self._stopped = True
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            self._publisher = None
+
+    def stopped(self):
+        return self._stopped
+
+    def stats(self):
+        return {
+            "frames-sent": self.frames_sent,
+            "errors": self.errors,
+        }
@@ -1,11 +1,30 @@
+import colorsys
+import errno
+import os
+import shutil
+import socket
+import tempfile
+import time
 import unittest
 import string
 
+import numpy as np
+import zmq
+
 import core.mixer
 import core.networking
+import core.offline_render
+import core.frame_guard
+import core.governor
+import core.show_recorder
 
 import lib.pattern
+import lib.buffer_utils
 import lib.color_fade
+import lib.color_lut
+import lib.colors
+import lib.output_driver
+import lib.parameters
 import lib.playlist
 import lib.scene
 
@@ -84,6 +103,687 @@ class TestPlaylist(unittest.TestCase):
     #TODO test tabs and other whitespace handling
         #test_chars = set([i for i in string.whitespace])
 
+
+class TestPattern(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+        self.buffer_length = lib.buffer_utils.BufferUtils._buffer_length
+
+    def tearDown(self):
+        lib.buffer_utils.BufferUtils._buffer_length = self.buffer_length
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_pooled_buffer_follows_the_buffer_size(self):
+        BufferUtils = lib.buffer_utils.BufferUtils
+        BufferUtils._buffer_length = 4
+        preset = lib.pattern.Pattern(None, "audio-noise")
+        buffer = preset.get_buffer()
+        self.assertEqual(buffer.shape, (4, 3))
+        preset._reset()
+        self.assertIs(preset.get_buffer(), buffer)
+
+        BufferUtils._buffer_length = 6
+        preset._reset()
+        self.assertEqual(preset.get_buffer().shape, (6, 3))
+
+        buffer = preset.get_buffer()
+        preset.release_buffer()
+        self.assertIsNone(preset.get_buffer())
+        self.assertTrue(any(b is buffer for b in BufferUtils._buffer_pool))
+        BufferUtils._buffer_pool = [b for b in BufferUtils._buffer_pool if b is not buffer]
+
+    def test_mixer_output_clip_leaves_the_preset_buffer_alone(self):
+        class Feedback(lib.pattern.Pattern):
+            def draw(self, dt):
+                self._pixel_buffer[:, 1] += 0.4
+
+        lib.buffer_utils.BufferUtils._buffer_length = 4
+        preset = Feedback(None, "audio-noise")
+        frame = np.empty((4, 3), dtype=np.float32)
+        for i in xrange(3):
+            preset.draw(0.0)
+            lib.colors.clamp_frame(preset.get_buffer(), lib.colors.HLS, frame)
+        np.testing.assert_allclose(preset.get_buffer()[:, 1], 1.2, rtol=1e-6)
+        np.testing.assert_array_equal(frame[:, 1], 1.0)
+
+
+class TestLayerStack(unittest.TestCase):
+    class Preset:
+        colorspace = lib.colors.HLS
+
+        def __init__(self, hls):
+            self.buffer = np.array(hls, dtype=np.float32)
+
+        def get_buffer(self):
+            return self.buffer
+
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+        BufferUtils = lib.buffer_utils.BufferUtils
+        self.buffer_length = BufferUtils._buffer_length
+        self.buffer_pool = BufferUtils._buffer_pool
+        BufferUtils._buffer_length = 3
+        BufferUtils._buffer_pool = []
+
+    def tearDown(self):
+        BufferUtils = lib.buffer_utils.BufferUtils
+        BufferUtils._buffer_length = self.buffer_length
+        BufferUtils._buffer_pool = self.buffer_pool
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_layers_are_drawn_bottom_to_top(self):
+        base = np.array([[0.0, 0.2, 1.0]] * 3, dtype=np.float32)
+        low = core.mixer.Layer(self.Preset([[0.3, 0.5, 1.0], [0.3, 0.5, 1.0], [0.0, 0.0, 0.0]]))
+        high = core.mixer.Layer(self.Preset([[0.6, 0.7, 1.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]))
+        stack = core.mixer.LayerStack()
+        stack.add(low)
+        stack.add(high)
+        expected = base.copy()
+
+        out = stack.composite(base)
+        np.testing.assert_allclose(out[:, 0], [0.6, 0.3, 0.0])
+        np.testing.assert_allclose(out[:, 1], [0.7, 0.5, 0.2])
+        np.testing.assert_array_equal(base, expected)
+
+        stack.remove(high)
+        stack.add(high, 0)
+        self.assertEqual(stack.layers, (high, low))
+        out = stack.composite(base)
+        np.testing.assert_allclose(out[:, 0], [0.3, 0.3, 0.0])
+
+    def test_opacity_scales_each_blend_mode(self):
+        base = np.array([[0.0, 0.2, 1.0]] * 3, dtype=np.float32)
+        layer = core.mixer.Layer(self.Preset([[0.5, 0.8, 1.0], [0.5, 0.8, 1.0], [0.5, 0.0, 1.0]]),
+                                 opacity=0.5)
+        stack = core.mixer.LayerStack()
+        stack.add(layer)
+
+        # Lit pixels fade in their lightness, dark ones leave the base alone
+        np.testing.assert_allclose(stack.composite(base)[:, 1], [0.5, 0.5, 0.2], rtol=1e-6)
+
+        layer.blend_mode = "add"
+        np.testing.assert_allclose(stack.composite(base)[:, 1], [0.6, 0.6, 0.2], rtol=1e-6)
+
+        layer.blend_mode = "multiply"
+        np.testing.assert_allclose(stack.composite(base)[:, 1], [0.18, 0.18, 0.1], rtol=1e-6)
+
+        # Disabled and fully transparent layers are skipped
+        layer.opacity = 0.0
+        np.testing.assert_array_equal(stack.composite(base), base)
+        layer.opacity = 1.0
+        layer.enabled = False
+        np.testing.assert_array_equal(stack.composite(base), base)
+
+
+class TestFrameGuard(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def tearDown(self):
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_clean_frame_is_untouched(self):
+        guard = core.frame_guard.FrameGuard()
+        buffer = np.random.random((100, 3)).astype(np.float32)
+        expected = buffer.copy()
+        self.assertEqual(guard.repair(buffer), 0)
+        self.assertTrue((buffer == expected).all())
+
+    def test_bad_pixels_are_blacked_out(self):
+        guard = core.frame_guard.FrameGuard(max_magnitude=100.0)
+        buffer = np.ones((10, 3), dtype=np.float32)
+        buffer[1][0] = np.nan
+        buffer[4][1] = np.inf
+        buffer[7][2] = -1000.0
+        self.assertEqual(guard.repair(buffer), 3)
+        self.assertTrue((buffer[[1, 4, 7]] == 0.0).all())
+        self.assertTrue((buffer[[0, 2, 3, 5, 6, 8, 9]] == 1.0).all())
+
+    def test_lightness_below_zero_is_not_a_fault(self):
+        # Presets write L < 0 on purpose and rely on the output clip for black
+        guard = core.frame_guard.FrameGuard(fault_limit=3)
+        buffer = np.full((10, 3), 0.5, dtype=np.float32)
+        buffer[:, 1] = -1.0
+        buffer[2][2] = 1.41
+        expected = buffer.copy()
+        for i in xrange(5):
+            self.assertFalse(guard.check("dark", buffer))
+        np.testing.assert_array_equal(buffer, expected)
+        self.assertEqual(guard.stats(), {})
+
+    def test_quarantine_after_fault_limit(self):
+        guard = core.frame_guard.FrameGuard(fault_limit=3)
+        buffer = np.zeros((10, 3), dtype=np.float32)
+        results = []
+        for i in xrange(3):
+            buffer[0][1] = np.nan
+            results.append(guard.check("bad", buffer))
+        self.assertEqual(results, [False, False, True])
+        self.assertEqual(guard.stats(), {"bad": (3, 3)})
+
+
+class TestFrameGovernor(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def tearDown(self):
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def steps(self, governor, cost, frames):
+        results = []
+        for i in xrange(frames):
+            rate = governor.frame_rendered(cost)
+            results.append((governor.quality(), rate))
+        return results
+
+    def test_quality_drops_before_the_tick_rate_and_comes_back_after(self):
+        governor = core.governor.FrameGovernor(100.0, min_rate=50.0, smoothing=1.0, hold_time=0.0)
+
+        # Twice the frame budget: quality steps down first, then the rate
+        self.assertEqual(self.steps(governor, 0.02, 8), [
+            (0.75, None), (0.5, None), (0.25, None),
+            (0.25, 80.0), (0.25, 64.0), (0.25, 51.2), (0.25, 50.0), (0.25, None)])
+
+        # A tenth of it: the rate comes back first, then quality
+        results = self.steps(governor, 0.001, 8)
+        self.assertEqual([quality for quality, rate in results],
+                         [0.25, 0.25, 0.25, 0.25, 0.5, 0.75, 1.0, 1.0])
+        rates = [rate for quality, rate in results]
+        self.assertEqual(rates[4:], [None] * 4)
+        np.testing.assert_allclose(rates[:4], [62.5, 78.125, 97.65625, 100.0])
+        self.assertEqual(governor.rate, 100.0)
+
+    def test_no_step_within_the_hold_time_or_low_water(self):
+        governor = core.governor.FrameGovernor(100.0, smoothing=1.0, hold_time=60.0)
+        self.assertEqual(self.steps(governor, 0.02, 3), [(0.75, None)] * 3)
+        self.assertEqual(governor.decisions, 1)
+
+        # Stepping quality back up would put the load at 0.8, over low_water
+        governor = core.governor.FrameGovernor(100.0, smoothing=1.0, hold_time=0.0)
+        governor.frame_rendered(0.02)
+        self.assertEqual(self.steps(governor, 0.006, 2), [(0.75, None)] * 2)
+
+
+class TestStrandPackets(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def tearDown(self):
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_packets_have_headers_and_pixels(self):
+        packets = core.networking.StrandPackets([(0, 0, 2), (2, 3, 4)], 4)
+        packets.rgb[:] = [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10, 11, 12]]
+        packets.fill()
+        packets.fill_opc()
+        self.assertEqual([p.tobytes() for p in packets.packets],
+                         ["S\x00\x06\x00\x01\x02\x03\x04\x05\x06", "S\x02\x03\x00\x0a\x0b\x0c"])
+        self.assertEqual(packets.opc_packet.tobytes(),
+                         "\x00\x00\x00\x09\x01\x02\x03\x04\x05\x06\x0a\x0b\x0c")
+        snapshot = packets.snapshot()
+        packets.rgb[:] = 0
+        packets.fill()
+        self.assertEqual(snapshot[1].tobytes(), "S\x02\x03\x00\x0a\x0b\x0c")
+
+    def test_output_lut_applies_order_dimmer_and_gamma(self):
+        frame = np.array([[65535, 32768, 0], [257 * 10, 257 * 20, 257 * 30]], dtype=np.uint16)
+        out = np.zeros((2, 3), dtype=np.uint8)
+        lut = lib.output_driver.OutputLUT(lib.output_driver.color_order("GRB8"))
+        lut.apply(frame, out)
+        self.assertEqual(out.tolist(), [[127, 255, 0], [20, 10, 30]])
+        lut.set_dimmer(0.5)
+        lut.apply(frame, out)
+        self.assertEqual(out.tolist(), [[63, 127, 0], [10, 5, 15]])
+        lut = lib.output_driver.OutputLUT(gamma=2.0, white_balance=(1.0, 1.0, 0.5))
+        lut.apply(frame, out)
+        self.assertEqual(out.tolist(), [[255, 63, 0], [0, 1, 0]])
+
+    def test_color_lut_frames_match_exact_output_on_the_grid(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            lut = lib.color_lut.ColorLUT((5, 4, 4), cache_dir)
+            cached = lib.color_lut.ColorLUT((5, 4, 4), cache_dir)
+            np.testing.assert_array_equal(cached.table, lut.table)
+        finally:
+            shutil.rmtree(cache_dir)
+        hls = lut.grid()
+        np.testing.assert_array_equal(lut.index(hls), np.arange(lut.size))
+        # Hue wraps around, lightness and saturation are clipped
+        outside = hls * [1.0, 1.5, 1.5] - [1.0, 0.25, 0.25]
+        inside = np.clip(outside, 0.0, 1.0)
+        inside[:, 0] = outside[:, 0] + 1.0
+        np.testing.assert_array_equal(lut.index(outside).copy(), lut.index(inside))
+
+        # The client's gamma and order are folded into the table, and the
+        # dimmer applied afterwards to within a level
+        driver = lib.output_driver.OutputDriver({"host": "127.0.0.1", "port": 1, "gamma": 2.2, "color-mode": "GRB8"})
+        hls = lut.grid()
+        rgb = lib.colors.hls_to_rgb(hls) * 65535
+        np.clip(rgb, 0, 65535, rgb)
+        expected = np.empty(hls.shape, dtype=np.uint8)
+        out = np.empty_like(expected)
+        folds = []
+        fold = lut.fold
+        lut.fold = lambda *args: folds.append(args) or fold(*args)
+        for dimmer in (1.0, 0.7):
+            driver.set_dimmer(dimmer)
+            driver.to_rgb8(rgb.astype(np.uint16), expected)
+            driver.to_rgb8(lut.frame(hls), out)
+            if dimmer == 1.0:
+                np.testing.assert_array_equal(out, expected)
+            else:
+                self.assertLessEqual(np.abs(out.astype(int) - expected).max(), 1)
+        self.assertEqual(len(folds), 1)
+        del lut.fold
+
+        self.assertLess(lut.error_report()["max"], 40)
+        self.assertRaises(ValueError, lib.color_lut.ColorLUT, (9, 1, 1))
+
+    def test_drivers_send_on_their_own_schedule(self):
+        driver = lib.output_driver.OutputDriver({"host": "127.0.0.1", "port": 1, "max-fps": 25})
+        # Mixer frames at 60 fps: each scheduled frame falls between two of them
+        due = [driver.frame_due(i / 60.0) for i in xrange(13)]
+        self.assertEqual([i for i, t in enumerate(due) if t is not None], [0, 3, 5, 8, 10, 12])
+        self.assertEqual([round(t, 3) for t in due if t is not None], [0.0, 0.04, 0.08, 0.12, 0.16, 0.2])
+        self.assertFalse(driver.blends())
+        driver.update(dict(driver.client, resample="blend"))
+        self.assertTrue(driver.blends())
+        # A mixer slower than the client gets every frame
+        self.assertEqual(driver.frame_due(1.0), 1.0)
+        self.assertEqual(driver.frame_due(1.1), 1.1)
+
+    def test_zmq_frames_decode_to_the_published_pixels(self):
+        packets = core.networking.StrandPackets([(0, 0, 2), (2, 3, 4)], 4)
+        packets.rgb[:] = [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10, 11, 12]]
+        context = zmq.Context()
+        sender, receiver = context.socket(zmq.PAIR), context.socket(zmq.PAIR)
+        sender.bind("inproc://frames")
+        receiver.connect("inproc://frames")
+        try:
+            core.networking.ZMQPublisher(sender).publish(packets)
+            frame_number, timestamp, strands, rgb = core.networking.decode_frame(receiver.recv(copy=False))
+        finally:
+            sender.close()
+            receiver.close()
+            context.term()
+        self.assertEqual(frame_number, 1)
+        self.assertEqual(strands, [(0, 0, 2), (2, 2, 3)])
+        self.assertEqual(rgb.tolist(), [[1, 2, 3], [4, 5, 6], [10, 11, 12]])
+        self.assertRaises(ValueError, core.networking.decode_frame, "B")
+        # Not to be mistaken for a frame file, or the reverse
+        self.assertNotEqual(core.networking.ZMQ_FRAME_MAGIC, core.offline_render.FrameFileWriter.MAGIC)
+
+    def test_dmx_universes_follow_the_mapping(self):
+        client = {"protocol": "ArtNet", "universes": [{"strand": 0, "universe": 3, "channel": 508},
+                                                      {"strand": 1, "universe": 9}]}
+        spans = core.networking.universe_spans(client, [(0, 0, 2), (1, 2, 3)])
+        packets = core.networking.DMXPackets("ArtNet", spans, 3)
+        packets.rgb[:] = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+        packets.fill()
+        # The second pixel of strand 0 does not fit in universe 3 and moves on to universe 4
+        self.assertEqual(packets.universes, [3, 4, 9])
+        self.assertEqual(packets.wire[0, :18].tobytes(), "Art-Net\x00\x00\x50\x00\x0e\x00\x00\x03\x00\x02\x00")
+        data = packets.wire[:, 18:]
+        self.assertEqual(data[0, 507:].tolist(), [1, 2, 3, 0, 0])
+        self.assertEqual(data[1, :4].tolist(), [4, 5, 6, 0])
+        self.assertEqual(data[2, :4].tolist(), [7, 8, 9, 0])
+
+
+class TestColors(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def tearDown(self):
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_hls_to_rgb_matches_colorsys(self):
+        # Every sextant boundary and midpoint, at the edges and middle of lightness and saturation
+        values = [0.0, 0.25, 0.5, 0.75, 1.0]
+        hls = np.array([(h / 12.0, l, s) for h in xrange(12) for l in values for s in values], dtype=np.float32)
+        hls = np.concatenate([hls, np.random.RandomState(0).random_sample((1000, 3)).astype(np.float32)])
+        expected = np.array([colorsys.hls_to_rgb(*pixel) for pixel in hls.astype(np.float64)])
+        out = np.empty_like(hls)
+        self.assertTrue(lib.colors.hls_to_rgb(hls, out) is out)
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_allclose(out, expected, atol=1e-6)
+        # Hue wraps around
+        shifted = hls.copy()
+        shifted[:, 0] += 1.0
+        np.testing.assert_allclose(lib.colors.hls_to_rgb(shifted), expected, atol=1e-6)
+
+    def test_rgb_to_hls_handles_black_and_images(self):
+        image = np.random.RandomState(2).randint(0, 256, (40, 30, 3)).astype(np.uint8)
+        image[0] = 0
+        image[1] = 255
+        expected = np.array([colorsys.rgb_to_hls(*(pixel / 255.0)) for pixel in image.reshape(-1, 3)])
+        hls = lib.colors.rgb_to_hls(image)
+        self.assertEqual(hls.shape, image.shape)
+        self.assertEqual(hls.dtype, np.float32)
+        np.testing.assert_allclose(hls.reshape(-1, 3), expected, atol=1e-5)
+        # A list of float pixels, converted in place
+        pixels = (image.reshape(-1, 3) / 255.0).astype(np.float32)
+        self.assertTrue(lib.colors.rgb_to_hls(pixels, pixels) is pixels)
+        np.testing.assert_allclose(pixels, expected, atol=1e-5)
+
+    def test_hls_blend_leaves_inputs_alone(self):
+        random = np.random.RandomState(3)
+        start = (random.random_sample((500, 3)) * 1.4 - 0.2).astype(np.float32)
+        end = (random.random_sample((500, 3)) * 1.4 - 0.2).astype(np.float32)
+        start_before, end_before = start.copy(), end.copy()
+        blender = lib.colors.HLSBlender(len(start))
+        out = np.empty_like(start)
+        for mode in ('add', 'multiply'):
+            self.assertTrue(blender.blend(start, end, 0.3, mode, 1.0, 0.5, out) is out)
+            np.testing.assert_array_equal(start, start_before)
+            np.testing.assert_array_equal(end, end_before)
+            self.assertTrue((out[:, 0] >= -0.5).all() and (out[:, 0] <= 0.5).all())
+            self.assertTrue((out[:, 1] >= 0.0).all() and (out[:, 1] <= 1.0).all())
+        # Fully faded in, the output is the end frame, with lightness and saturation clipped
+        visible = (end[:, 1] > 0.01) & (end[:, 1] < 0.99) & (end[:, 2] > 0.01)
+        blender.blend(start, end, 1.0, 'overwrite', 1.0, 1.0, out)
+        np.testing.assert_allclose(out[:, 1:], np.clip(end[:, 1:], 0, 1), atol=1e-6)
+        np.testing.assert_allclose(np.mod(out[visible, 0], 1.0), np.mod(end[visible, 0], 1.0), atol=1e-4)
+        # The output may be one of the inputs
+        np.testing.assert_array_equal(blender.blend(start, end, 0.3, 'add', 1.0, 0.5, start),
+                                      lib.colors.hls_blend(start_before, end, None, 0.3, 'add', 1.0, 0.5))
+
+    def test_rgb_frames_convert_to_hls_and_back(self):
+        rgb = np.random.RandomState(1).random_sample((1000, 3)).astype(np.float32)
+        rgb[:10] = 0.0
+        rgb[10:20] = 0.5
+        hls = lib.colors.convert(rgb, lib.colors.RGB, lib.colors.HLS)
+        expected = np.array([colorsys.rgb_to_hls(*pixel) for pixel in rgb.astype(np.float64)])
+        np.testing.assert_allclose(hls, expected, atol=1e-6)
+        np.testing.assert_allclose(lib.colors.convert(hls, lib.colors.HLS, lib.colors.RGB), rgb, atol=1e-6)
+        self.assertTrue(lib.colors.convert(rgb, lib.colors.RGB, lib.colors.RGB) is rgb)
+
+
+class TestShowRecorder(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+        fd, self.filename = tempfile.mkstemp(suffix=".fmxr")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_inputs_are_applied_and_recorded_at_the_next_frame(self):
+        sr = core.show_recorder
+        recorder = sr.ShowRecorder(self.filename, seed=1)
+        recorder.recording = True
+        applied = []
+        recorder.fft([0.5, 0.25], applied.append)
+        recorder.onset(lambda: applied.append("onset"))
+        recorder.event("set_preset_duration", applied.append, 30.0)
+        self.assertEqual(applied, [])
+
+        recorder.tick(0.025, 1.0, 0.75)
+        self.assertEqual(len(applied), 3)
+        self.assertEqual(applied[0].tolist(), [0.5, 0.25])
+        self.assertEqual(applied[1:], ["onset", 30.0])
+        recorder.close()
+
+        records = list(sr.read_show(self.filename))
+        self.assertEqual([r[0] for r in records], [sr.FFT, sr.ONSET, sr.EVENT, sr.TICK])
+        self.assertEqual(records[0][1].tolist(), [0.5, 0.25])
+        self.assertEqual(records[2][1], ["set_preset_duration", 30.0])
+        self.assertEqual(records[3][1], (0.025, 1.0, 0.75))
+
+    def test_mid_frame_inputs_replay_on_the_same_frame_in_order(self):
+        sr = core.show_recorder
+
+        class Preset(lib.pattern.Pattern):
+            def setup(self):
+                self.add_parameter(lib.parameters.FloatParameter('test-level', 1.0))
+                lib.pattern.Pattern.setup(self)
+
+            def parameter_changed(self, parameter):
+                if parameter is not None:
+                    self._mixer.applied.append(str(parameter))
+
+        class Mixer:
+            recorder = None
+            record_event = core.mixer.Mixer.record_event.im_func
+            pause = core.mixer.Mixer.pause.im_func
+
+            def __init__(self):
+                self.frames = []
+                self.applied = []
+                self.paused = False
+
+            def _pause(self, pause):
+                self.applied.append("pause")
+                self.paused = pause
+
+            def on_tick_timer(self, dt):
+                self.frames.append((self.preset.parameter('test-level').get(), self.paused))
+
+        class App:
+            def __init__(self, mixer):
+                self.mixer = mixer
+                self.playlist = self
+
+            def get_preset_by_name(self, name):
+                return self.mixer.preset if name == self.mixer.preset.name() else None
+
+        live = Mixer()
+        live.preset = Preset(live, "audio-noise")
+        del live.applied[:]
+        live.recorder = sr.ShowRecorder(self.filename, seed=1)
+        live.recorder.recording = True
+        for frame in xrange(4):
+            live.recorder.tick(0.025, 1.0, 1.0)
+            # From the GUI, while the frame renders
+            if frame == 1:
+                live.preset.parameter('test-level').set(2.0)
+                live.pause(True)
+            elif frame == 2:
+                live.pause(False)
+                live.preset.parameter('test-level').set(3.0)
+            live.on_tick_timer(0.025)
+        live.recorder.close()
+        self.assertEqual(live.frames, [(1.0, False), (1.0, False), (2.0, True), (3.0, False)])
+        self.assertEqual(live.applied, ["test-level", "pause", "pause", "test-level"])
+        self.assertEqual([r[0] for r in sr.read_show(self.filename)],
+                         [sr.TICK, sr.TICK, sr.PARAMETER, sr.EVENT, sr.TICK, sr.EVENT, sr.PARAMETER, sr.TICK])
+
+        replayed = Mixer()
+        replayed.preset = Preset(replayed, "audio-noise")
+        del replayed.applied[:]
+        sr.replay(App(replayed), self.filename)
+        self.assertEqual(replayed.frames, live.frames)
+        self.assertEqual(replayed.applied, live.applied)
+
+
+class TestClientSender(unittest.TestCase):
+    class Clock:
+        def __init__(self):
+            self.now = 100.0
+
+        def __call__(self):
+            return self.now
+
+    class FullSocket:
+        """
+        Socket whose send buffer never drains
+        """
+        def __init__(self, sock):
+            self._sock = sock
+
+        def fileno(self):
+            return self._sock.fileno()
+
+        def sendto(self, packet, address):
+            raise socket.error(errno.EAGAIN, "Resource temporarily unavailable")
+
+        def close(self):
+            self._sock.close()
+
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+        self.monotonic = core.networking.monotonic
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", 0))
+        self.receiver.settimeout(5.0)
+        self.sender = core.networking.ClientSender("127.0.0.1", self.receiver.getsockname()[1])
+        self.sender._address = self.receiver.getsockname()
+
+    def tearDown(self):
+        core.networking.monotonic = self.monotonic
+        self.sender._socket.close()
+        self.receiver.close()
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def test_token_bucket_paces_to_its_rate(self):
+        clock = core.networking.monotonic = self.Clock()
+        bucket = core.networking.TokenBucket(10.0, 4)
+        self.assertEqual([bucket.delay(1) for i in xrange(4)], [0.0] * 4)
+        self.assertAlmostEqual(bucket.delay(1), 0.1)
+        clock.now += 0.25
+        self.assertEqual(bucket.delay(1), 0.0)
+        self.assertAlmostEqual(bucket.delay(2), 0.05)
+
+        # Tokens stop at the burst size, and a larger amount waits for a full bucket
+        clock.now += 10.0
+        self.assertEqual(bucket.delay(10), 0.0)
+        self.assertAlmostEqual(bucket.delay(1), 0.7)
+        self.assertEqual(core.networking.TokenBucket(None).delay(1000), 0.0)
+
+    def test_slow_client_drops_frames_and_packets_without_blocking(self):
+        # Only the newest frame waits for the sender thread
+        for i in xrange(3):
+            self.sender.send_frame([], ["frame %d" % i], [])
+        self.assertEqual(self.sender.frames_skipped, 2)
+        self.assertEqual(self.sender._frame, ([], ["frame 2"], []))
+
+        # A full socket buffer costs one short wait per packet, not the frame
+        self.sender._socket = self.FullSocket(self.sender._socket)
+        start = time.time()
+        self.assertTrue(self.sender._send_frame(["header"], ["a", "b"], ["trailer"]))
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(self.sender.packets_dropped, 4)
+        self.assertEqual(self.sender.packets_sent, 0)
+
+        self.sender._socket = self.sender._socket._sock
+        self.assertTrue(self.sender._send_frame([], ["a"], []))
+        self.assertEqual(self.receiver.recv(16), "a")
+
+    def received(self):
+        packets = []
+        self.receiver.setblocking(0)
+        try:
+            while True:
+                packets.append(self.receiver.recv(16))
+        except socket.error:
+            return packets
+
+    def test_unchanged_strands_are_only_sent_in_keyframes(self):
+        # Without a keyframe interval every frame is sent in full
+        for i in xrange(2):
+            self.sender._send_frame(["h"], ["a", "b"], [])
+        self.assertEqual(self.received(), ["h", "a", "b"] * 2)
+        self.assertEqual((self.sender.keyframes, self.sender.packets_saved), (0, 0))
+
+        self.sender.keyframe_interval = 3
+        sent = []
+        for packets in (["a", "b"], ["a", "c"], ["a", "c"], ["a", "c"]):
+            self.sender._send_frame(["h"], packets, [])
+            sent.append(self.received())
+        self.assertEqual(sent, [["h", "a", "b"], ["h", "c"], ["h"], ["h", "a", "c"]])
+        self.assertEqual((self.sender.keyframes, self.sender.packets_saved), (2, 3))
+
+        # A dropped strand packet goes out again even though it is unchanged
+        sock = self.sender._socket
+        self.sender._socket = self.FullSocket(sock)
+        self.sender._send_frame([], ["a", "d"], [])
+        self.sender._socket = sock
+        self.sender._send_frame([], ["a", "d"], [])
+        self.assertEqual(self.received(), ["d"])
+
+
+class TestOPCSender(unittest.TestCase):
+    def setUp(self):
+        print divider
+        print('Starting test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.server.settimeout(5.0)
+        self.sender = core.networking.OPCSender("127.0.0.1", self.server.getsockname()[1])
+        self.sender.start()
+
+    def tearDown(self):
+        self.sender.stop()
+        self.sender.join(1.0)
+        self.server.close()
+        print divider
+        print('Ending test: ' + self.id().split('.')[-2] + ' ' + self.id().split('.')[-1])
+        print divider
+
+    def receive_frame(self, connection, frame):
+        self.sender.send_frame([], [frame], [])
+        data = ""
+        while len(data) < len(frame):
+            data += connection.recv(len(frame) - len(data))
+        return data
+
+    def test_frames_arrive_whole_and_sender_reconnects(self):
+        frame = "\x00\x00\x00\x06\x01\x02\x03\x04\x05\x06"
+        self.sender.send_frame([], [frame], [])
+        connection, _ = self.server.accept()
+        connection.settimeout(5.0)
+        self.assertEqual(connection.recv(len(frame), socket.MSG_WAITALL), frame)
+        self.assertEqual(self.receive_frame(connection, frame[::-1]), frame[::-1])
+
+        # Frames sent while the server is gone are dropped until it is back
+        connection.close()
+        while self.sender.connected():
+            self.sender.send_frame([], [frame], [])
+            time.sleep(0.01)
+        while not self.sender.connected():
+            self.sender.send_frame([], [frame], [])
+            time.sleep(0.01)
+        connection, _ = self.server.accept()
+        connection.settimeout(5.0)
+        self.assertEqual(self.receive_frame(connection, frame), frame)
+        connection.close()
+        self.assertEqual(self.sender.stats()["connects"], 2)
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -20,9 +20,6 @@ from PySide import QtCore, QtGui
 from ui.ui_dlg_settings import Ui_DlgSettings
 from lib import color_modes
 
-# TODO: This is a hack
-PROTOCOLS = ["Legacy", "ZMQ", "OPC"]
-
 
 class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
 
@@ -31,6 +28,9 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
         self.playlist = parent.app.playlist
         self.setupUi(self)
         self.app = parent.app
+        # New clients default to the first protocol
+        self.protocols = sorted((p for driver in self.app.plugins.get('OutputDriver') for p in driver.protocols),
+                                key=lambda p: (p != "Legacy", p))
 
         # Setup tree view
         self.tree_settings.itemClicked.connect(self.on_tree_changed)
@@ -110,8 +110,10 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
             proto = self.tbl_networking_clients.cellWidget(i, 4).currentText()
             ignore_dimming = (self.tbl_networking_clients.cellWidget(i, 5).checkState() == QtCore.Qt.Checked)
 
-            client = {"host": host, "port": port, "enabled": enabled, "color-mode": color_mode,
-                      "protocol": proto, "ignore-dimming": ignore_dimming}
+            # Keep the settings that are not in the table (pacing, universes...)
+            client = dict(self._client_settings.get(self.tbl_networking_clients.item(i, 0), {}))
+            client.update({"host": host, "port": port, "enabled": enabled, "color-mode": color_mode,
+                           "protocol": proto, "ignore-dimming": ignore_dimming})
             if client not in clients:
                 clients.append(client)
         self.app.settings['networking']['clients'] = clients
@@ -133,8 +135,10 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
     def populate_networking_clients_table(self):
         clients = self.app.settings['networking']['clients']
         self.tbl_networking_clients.setRowCount(len(clients))
+        self._client_settings = {}
         for i, client in enumerate(clients):
             item_host = QtGui.QTableWidgetItem(client["host"])
+            self._client_settings[item_host] = client
             item_port = QtGui.QTableWidgetItem(str(client["port"]))
             item_enabled = QtGui.QCheckBox()
             item_ignore_dimming = QtGui.QCheckBox()
@@ -143,7 +147,7 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
             for mode in color_modes.modes:
                 item_color_mode.addItem(mode)
 
-            item_color_mode.setCurrentIndex(color_modes.modes.index(client["color-mode"]))
+            item_color_mode.setCurrentIndex(color_modes.modes.index(client.get("color-mode", "RGB8")))
 
             if client["enabled"]:
                 item_enabled.setCheckState(QtCore.Qt.Checked)
@@ -152,10 +156,11 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
                 item_ignore_dimming.setCheckState(QtCore.Qt.Checked)
 
             item_protocol = QtGui.QComboBox()
-            for proto in PROTOCOLS:
+            for proto in self.protocols:
                 item_protocol.addItem(proto)
 
-            item_protocol.setCurrentIndex(PROTOCOLS.index(client["protocol"]))
+            if client["protocol"] in self.protocols:
+                item_protocol.setCurrentIndex(self.protocols.index(client["protocol"]))
 
             self.tbl_networking_clients.setItem(i, 0, item_host)
             self.tbl_networking_clients.setItem(i, 1, item_port)
@@ -176,7 +181,7 @@ class DlgSettings(QtGui.QDialog, Ui_DlgSettings):
             item_color_mode.addItem(mode)
 
         item_protocol = QtGui.QComboBox()
-        for proto in PROTOCOLS:
+        for proto in self.protocols:
             item_protocol.addItem(proto)
         self.tbl_networking_clients.setCellWidget(row, 3, item_color_mode)
         self.tbl_networking_clients.setCellWidget(row, 4, item_protocol)